@@ -0,0 +1,462 @@
+# alert_dispatch.py
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+import urllib.request
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Any, Optional, List, Tuple
+
+import aiosqlite
+
+from feed import parse_address
+
+ALERTS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS alert_events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    ts TEXT NOT NULL,
+    rule_id TEXT,
+    rule_name TEXT,
+    metric TEXT,
+    symbol TEXT,
+    value REAL,
+    side TEXT,
+    threshold REAL,
+    message TEXT,
+    created_at TEXT DEFAULT (datetime('now'))
+);
+CREATE INDEX IF NOT EXISTS idx_alert_events_ts ON alert_events(ts);
+"""
+EVENT_FIELDS = ["ts", "rule_id", "rule_name", "metric", "symbol", "value", "side", "threshold", "message"]
+
+
+class AlertStore:
+    """
+    Alert events in SQLite, written by a batched async writer.
+    - enqueue(event) never waits on disk; the writer inserts whatever is queued in one transaction
+    - recent(limit) / count() are synchronous read-only reads for the UI
+    """
+
+    def __init__(self, path: str = "alerts.db", batch_size: int = 500):
+        self.path = path
+        self.batch_size = batch_size
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._db: Optional[aiosqlite.Connection] = None
+        self.written = 0
+        self.batches = 0
+
+    async def start(self):
+        self._db = await aiosqlite.connect(self.path, timeout=30.0)
+        await self._db.execute("PRAGMA journal_mode=WAL;")
+        await self._db.execute("PRAGMA synchronous=NORMAL;")
+        await self._db.executescript(ALERTS_SCHEMA)
+        await self._db.commit()
+        self._queue = asyncio.Queue()
+        self._task = asyncio.get_running_loop().create_task(self._writer_loop())
+
+    def enqueue(self, event: Dict[str, Any]):
+        if self._queue is not None:
+            self._queue.put_nowait(event)
+
+    async def _writer_loop(self):
+        stmt = f"INSERT INTO alert_events ({', '.join(EVENT_FIELDS)}) VALUES ({', '.join('?' for _ in EVENT_FIELDS)})"
+        while True:
+            batch = [await self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except asyncio.QueueEmpty:
+                    break
+            try:
+                await self._db.executemany(stmt, [tuple(e.get(f) for f in EVENT_FIELDS) for e in batch])
+                await self._db.commit()
+                self.written += len(batch)
+                self.batches += 1
+            except Exception:
+                try:
+                    await self._db.rollback()
+                except Exception:
+                    pass
+
+    async def close(self):
+        # flush what is queued, then stop the writer
+        if self._queue is not None:
+            for _ in range(50):
+                if self._queue.empty():
+                    break
+                await asyncio.sleep(0.02)
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, Exception):
+                pass
+        if self._db:
+            await self._db.close()
+            self._db = None
+
+    def recent(self, limit: int = 500) -> List[Dict[str, Any]]:
+        if not os.path.exists(self.path):
+            return []
+        conn = sqlite3.connect(f"file:{os.path.abspath(self.path)}?mode=ro", uri=True, timeout=5.0)
+        try:
+            rows = conn.execute(f"SELECT {', '.join(EVENT_FIELDS)} FROM alert_events ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
+        except sqlite3.Error:
+            return []
+        finally:
+            conn.close()
+        return [dict(zip(EVENT_FIELDS, r)) for r in reversed(rows)]
+
+    def count(self) -> int:
+        if not os.path.exists(self.path):
+            return 0
+        conn = sqlite3.connect(f"file:{os.path.abspath(self.path)}?mode=ro", uri=True, timeout=5.0)
+        try:
+            return int(conn.execute("SELECT COUNT(*) FROM alert_events").fetchone()[0])
+        except sqlite3.Error:
+            return 0
+        finally:
+            conn.close()
+
+
+class _RateLimiter:
+    """Token bucket: `rate` sends per second with bursts up to `burst`."""
+
+    def __init__(self, rate: Optional[float], burst: int = 5):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._last = time.monotonic()
+
+    async def acquire(self):
+        if not self.rate:
+            return
+        while True:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            if self._tokens >= 1.0:
+                self._tokens -= 1.0
+                return
+            await asyncio.sleep((1.0 - self._tokens) / self.rate)
+
+
+class AlertSink:
+    """
+    Base delivery target. Subclasses implement `send(batch)` (raise on failure).
+    Each sink has its own bounded queue (oldest dropped when full), batching, token-bucket
+    rate limit, retries with exponential backoff and delivery metrics.
+    """
+
+    kind = "sink"
+
+    def __init__(self, name: Optional[str] = None, queue_size: int = 10000, batch_size: int = 50,
+                 rate_per_s: Optional[float] = 5.0, burst: int = 5, max_retries: int = 3, backoff_s: float = 0.5):
+        self.name = name or self.kind
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.backoff_s = backoff_s
+        self._limiter = _RateLimiter(rate_per_s, burst)
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self.metrics: Dict[str, Any] = {"sent": 0, "failed": 0, "dropped": 0, "retries": 0, "batches": 0,
+                                        "last_error": None, "last_latency_ms": None}
+
+    def start(self):
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._task = asyncio.get_running_loop().create_task(self._worker())
+
+    def offer(self, event: Dict[str, Any]):
+        if self._queue is None:
+            return
+        try:
+            self._queue.put_nowait(event)
+        except asyncio.QueueFull:
+            try:
+                self._queue.get_nowait()
+                self._queue.put_nowait(event)
+            except Exception:
+                pass
+            self.metrics["dropped"] += 1
+
+    async def _worker(self):
+        while True:
+            batch = [await self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except asyncio.QueueEmpty:
+                    break
+            await self._limiter.acquire()
+            for attempt in range(self.max_retries + 1):
+                t0 = time.perf_counter()
+                try:
+                    await self.send(batch)
+                    self.metrics["sent"] += len(batch)
+                    self.metrics["batches"] += 1
+                    self.metrics["last_latency_ms"] = (time.perf_counter() - t0) * 1000.0
+                    break
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    self.metrics["last_error"] = f"{datetime.utcnow().isoformat()} {e}"
+                    if attempt == self.max_retries:
+                        self.metrics["failed"] += len(batch)
+                        break
+                    self.metrics["retries"] += 1
+                    await asyncio.sleep(self.backoff_s * (2 ** attempt))
+
+    async def send(self, batch: List[Dict[str, Any]]):
+        raise NotImplementedError
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, Exception):
+                pass
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(self.metrics, name=self.name, kind=self.kind, queued=self._queue.qsize() if self._queue else 0)
+
+
+class WebhookSink(AlertSink):
+    """POSTs {"events": [...]} as JSON; urllib runs in a worker thread so the loop never blocks."""
+
+    kind = "webhook"
+
+    def __init__(self, url: str, timeout: float = 5.0, headers: Optional[Dict[str, str]] = None, **kw):
+        super().__init__(**kw)
+        self.url = url
+        self.timeout = timeout
+        self.headers = dict(headers or {}, **{"Content-Type": "application/json"})
+
+    def _post(self, body: bytes):
+        req = urllib.request.Request(self.url, data=body, headers=self.headers, method="POST")
+        with urllib.request.urlopen(req, timeout=self.timeout) as resp:
+            if resp.status >= 300:
+                raise RuntimeError(f"HTTP {resp.status}")
+
+    async def send(self, batch: List[Dict[str, Any]]):
+        await asyncio.to_thread(self._post, json.dumps({"events": batch}).encode())
+
+
+class FileSink(AlertSink):
+    """Appends events as NDJSON lines."""
+
+    kind = "file"
+
+    def __init__(self, path: str, **kw):
+        kw.setdefault("rate_per_s", None)
+        super().__init__(**kw)
+        self.path = path
+
+    def _append(self, batch: List[Dict[str, Any]]):
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write("".join(json.dumps(e) + "\n" for e in batch))
+
+    async def send(self, batch: List[Dict[str, Any]]):
+        await asyncio.to_thread(self._append, batch)
+
+
+class SocketSink(AlertSink):
+    """NDJSON over a persistent TCP / Unix socket connection ('host:port' or 'unix:/path'); reconnects on error."""
+
+    kind = "socket"
+
+    def __init__(self, address: str, **kw):
+        super().__init__(**kw)
+        self.address = address
+        self._writer: Optional[asyncio.StreamWriter] = None
+
+    async def send(self, batch: List[Dict[str, Any]]):
+        if self._writer is None or self._writer.is_closing():
+            kind, target = parse_address(self.address)
+            if kind == "unix":
+                _, self._writer = await asyncio.open_unix_connection(target)
+            else:
+                _, self._writer = await asyncio.open_connection(target[0], target[1])
+        try:
+            self._writer.write(b"".join(json.dumps(e).encode() + b"\n" for e in batch))
+            await self._writer.drain()
+        except Exception:
+            self._writer.close()
+            self._writer = None
+            raise
+
+
+def make_sink(spec: Dict[str, Any]) -> AlertSink:
+    """{"kind": "webhook"|"file"|"socket", "target": url/path/address, "rate_per_s": ...} -> sink."""
+    kind, target = spec["kind"], spec["target"]
+    kw = {k: v for k, v in spec.items() if k not in ("kind", "target")}
+    # rate is part of the name: a changed limit registers a new sink rather than mutating a shared one
+    kw.setdefault("name", f"{kind}:{target}" + (f"@{kw['rate_per_s']:g}/s" if kw.get("rate_per_s") else ""))
+    if kind == "webhook":
+        return WebhookSink(target, **kw)
+    if kind == "file":
+        return FileSink(target, **kw)
+    if kind == "socket":
+        return SocketSink(target, **kw)
+    raise ValueError(f"unknown sink kind {kind}")
+
+
+class AlertDispatcher:
+    """
+    Process-wide alert output: AlertStore + sinks on their own background event loop.
+    - submit(events, sinks) is thread-safe and returns immediately (it only schedules a fan-out),
+      so rule evaluation and ingestion never wait on disk or network
+    - add_sink(spec, owner) registers a sink once (by name) and returns its name
+    - select_sinks(owner, names) records which sinks an owner (dashboard session) still uses and closes
+      sinks no owner seen within `owner_timeout_s` has selected, e.g. after a rate change or a cleared target
+    - stats(): store counters plus per-sink delivery metrics
+    """
+
+    def __init__(self, db_path: str = "alerts.db", owner_timeout_s: float = 120.0):
+        self.store = AlertStore(db_path)
+        self.sinks: Dict[str, AlertSink] = {}
+        # owner -> (last seen monotonic, selected sink names)
+        self.owners: Dict[str, Tuple[float, set]] = {}
+        self.owner_timeout_s = owner_timeout_s
+        self.submitted = 0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._ready = threading.Event()
+        self._lock = threading.Lock()
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._ready.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        self._ready.wait(timeout=5.0)
+
+    def _run(self):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        self._loop = loop
+        try:
+            loop.run_until_complete(self.store.start())
+        except Exception:
+            pass
+        self._ready.set()
+        loop.run_forever()
+
+    def add_sink(self, spec: Dict[str, Any], owner: Optional[str] = None) -> str:
+        sink = make_sink(spec)
+        with self._lock:
+            if owner is not None:
+                # claimed right away so another owner's select_sinks() cannot close it in between
+                self.owners.setdefault(owner, (time.monotonic(), set()))[1].add(sink.name)
+            if sink.name in self.sinks:
+                return sink.name
+            self.sinks[sink.name] = sink
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(sink.start)
+        return sink.name
+
+    def select_sinks(self, owner: str, names: List[str]):
+        now = time.monotonic()
+        with self._lock:
+            self.owners[owner] = (now, set(names))
+            for o, (seen, _) in list(self.owners.items()):
+                if now - seen > self.owner_timeout_s:
+                    del self.owners[o]
+            wanted = set().union(*(n for _, n in self.owners.values()))
+            stale = [n for n in self.sinks if n not in wanted]
+        for name in stale:
+            self.remove_sink(name)
+
+    def remove_sink(self, name: str):
+        with self._lock:
+            sink = self.sinks.pop(name, None)
+        if sink is not None and self._loop is not None:
+            asyncio.run_coroutine_threadsafe(sink.close(), self._loop)
+
+    def submit(self, events: List[Dict[str, Any]], sinks: Optional[List[str]] = None):
+        if not events or self._loop is None:
+            return
+        self.submitted += len(events)
+        self._loop.call_soon_threadsafe(self._fanout, list(events), sinks)
+
+    def _fanout(self, events: List[Dict[str, Any]], sinks: Optional[List[str]]):
+        targets = [s for n, s in self.sinks.items() if sinks is None or n in sinks]
+        for e in events:
+            self.store.enqueue(e)
+            for s in targets:
+                s.offer(e)
+
+    def stop(self, wait_seconds: float = 3.0):
+        if self._loop is None:
+            return
+
+        async def _shutdown():
+            for s in list(self.sinks.values()):
+                await s.close()
+            await self.store.close()
+
+        try:
+            asyncio.run_coroutine_threadsafe(_shutdown(), self._loop).result(timeout=wait_seconds)
+        except Exception:
+            pass
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        if self._thread:
+            self._thread.join(timeout=wait_seconds)
+        self._loop = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {"submitted": self.submitted, "stored": self.store.written,
+                "sinks": [s.stats() for s in list(self.sinks.values())]}
+
+
+class WebhookStandIn:
+    """
+    Local HTTP receiver for exercising WebhookSink without a real endpoint.
+    Records every POSTed event; `fail_first` makes the first N requests return 500
+    and `delay_s` slows responses, to exercise retries and back-pressure.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, fail_first: int = 0, delay_s: float = 0.0):
+        self.events: List[Dict[str, Any]] = []
+        self.requests = 0
+        self.fail_first = fail_first
+        self.delay_s = delay_s
+        stand_in = self
+
+        class _Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                stand_in.requests += 1
+                if stand_in.delay_s:
+                    time.sleep(stand_in.delay_s)
+                if stand_in.requests <= stand_in.fail_first:
+                    self.send_response(500)
+                    self.end_headers()
+                    return
+                try:
+                    stand_in.events.extend(json.loads(body).get("events", []))
+                except Exception:
+                    pass
+                self.send_response(200)
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), _Handler)
+        self.url = f"http://{host}:{self._server.server_address[1]}/alerts"
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    def start(self) -> "WebhookStandIn":
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
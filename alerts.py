@@ -1,8 +1,24 @@
 # alerts.py
-from typing import List, Dict, Any, Callable
+from typing import List, Dict, Any, Callable, Optional
+import operator
 import uuid
 from datetime import datetime, timezone
 
+import numpy as np
+
+OPS = {">": operator.gt, "<": operator.lt, ">=": operator.ge, "<=": operator.le, "==": operator.eq}
+# metrics whose rules may use a percentile of their own recent history as the threshold
+QUANTILE_METRICS = ("spread", "zscore")
+
+def is_adaptive(rule: Dict[str,Any]) -> bool:
+    """Rule compares against a percentile of the metric's last `lookback_h` hours ({"threshold_mode": "quantile", "quantile": 99, "lookback_h": 6})."""
+    return rule.get("threshold_mode") == "quantile" and rule.get("metric") in QUANTILE_METRICS
+
+def threshold_label(rule: Dict[str,Any]) -> str:
+    if is_adaptive(rule):
+        return f"p{float(rule.get('quantile', 99)):g} of {float(rule.get('lookback_h', 6)):g}h"
+    return f"{float(rule.get('threshold', 0.0)):g}"
+
 def now_iso():
     return datetime.utcnow().replace(tzinfo=timezone.utc).isoformat()
 
@@ -27,28 +43,49 @@ def match_rule(rule: Dict[str,Any], value: float) -> bool:
         return False
     return False
 
-def evaluate_rules(rules: List[Dict[str,Any]], metrics_provider: Callable[[Dict[str,Any]], float]) -> List[Dict[str,Any]]:
+def match_rule_array(rule: Dict[str,Any], values: np.ndarray, threshold=None) -> np.ndarray:
+    """Vectorised match_rule over a whole metric series (NaN never matches).
+    `threshold` overrides the rule's, e.g. with a per-point array for percentile rules."""
+    op = OPS.get(rule.get("side"))
+    if op is None:
+        return np.zeros(len(values), dtype=bool)
+    th = float(rule.get("threshold", 0.0)) if threshold is None else np.asarray(threshold, dtype=float)
+    with np.errstate(invalid="ignore"):
+        return op(values, th) & ~np.isnan(values) & ~np.isnan(th)
+
+def make_event(rule: Dict[str,Any], value: float, ts: str) -> Dict[str,Any]:
+    return {
+        "rule_id": rule.get("id"),
+        "rule_name": rule.get("name"),
+        "metric": rule.get("metric"),
+        "symbol": rule.get("symbol"),
+        "ts": ts,
+        "value": float(value),
+        "side": rule.get("side"),
+        "threshold": float(rule.get("threshold", 0.0)),
+        "message": f"{rule.get('metric')} {float(value):.6f} {rule.get('side')} {float(rule.get('threshold')):.6f}"
+                   + (f" ({threshold_label(rule)})" if is_adaptive(rule) else "")
+    }
+
+def evaluate_rules(rules: List[Dict[str,Any]], metrics_provider: Callable[[Dict[str,Any]], float],
+                   threshold_provider: Optional[Callable[[Dict[str,Any]], Optional[float]]] = None) -> List[Dict[str,Any]]:
+    """Fire every enabled rule whose metric matches; percentile rules take their threshold from
+    `threshold_provider` (skipped while it returns None, e.g. not enough history yet)."""
     events = []
     for r in rules:
         if not r.get("enabled", True):
             continue
         try:
+            if is_adaptive(r):
+                th = threshold_provider(r) if threshold_provider else None
+                if th is None:
+                    continue
+                r = dict(r, threshold=float(th))
             val = metrics_provider(r)
             if val is None:
                 continue
             if match_rule(r, val):
-                evt = {
-                    "rule_id": r.get("id"),
-                    "rule_name": r.get("name"),
-                    "metric": r.get("metric"),
-                    "symbol": r.get("symbol"),
-                    "ts": now_iso(),
-                    "value": float(val),
-                    "side": r.get("side"),
-                    "threshold": float(r.get("threshold", 0.0)),
-                    "message": f"{r.get('metric')} {float(val):.6f} {r.get('side')} {float(r.get('threshold')):.6f}"
-                }
-                events.append(evt)
+                events.append(make_event(r, val, now_iso()))
         except Exception as e:
             print(f"Error evaluating rule {r.get('name')}: {e}")
             continue
@@ -1,7 +1,11 @@
 # analytics.py
+import itertools
+import math
+import random
+from collections import deque
 import numpy as np
 import pandas as pd
-from typing import Tuple
+from typing import Tuple, Any, Optional, List, Dict
 
 def ols_hedge_ratio(y: pd.Series, x: pd.Series) -> float:
     df = pd.concat([y, x], axis=1).dropna()
@@ -24,13 +28,670 @@ def spread_and_zscore(y: pd.Series, x: pd.Series, beta: float = None, window: in
     if beta is None:
         beta = ols_hedge_ratio(y_aligned, x_aligned)
     spread = y_aligned - beta * x_aligned
-    rm = spread.rolling(window=window, min_periods=5).mean()
-    rs = spread.rolling(window=window, min_periods=5).std()
-    z = (spread - rm) / rs
-    return spread, z
+    return spread, rolling_zscore(spread, window)
 
-def rolling_correlation(s1: pd.Series, s2: pd.Series, window: int = 50) -> pd.Series:
+def rolling_zscore(s: pd.Series, window: int = 50) -> pd.Series:
+    rm = s.rolling(window=window, min_periods=5).mean()
+    rs = s.rolling(window=window, min_periods=5).std()
+    return (s - rm) / rs
+
+def rolling_correlation(s1: pd.Series, s2: pd.Series, window: int = 50, min_periods: int = 5):
+    """Rolling Pearson correlation from cumulative sums (O(n); `window` may be a list of ints)."""
     df = pd.concat([s1, s2], axis=1).dropna()
     if df.empty:
         return pd.Series(dtype=float)
-    return df.iloc[:,0].rolling(window, min_periods=5).corr(df.iloc[:,1])
+    a = df.iloc[:,0].values.astype(float)
+    b = df.iloc[:,1].values.astype(float)
+    a, b = a - a.mean(), b - b.mean()
+    w = _windows(window)
+    n = _rolling_count(len(a), w, min_periods)
+    sa, sb = _rolling_sum(a, w, min_periods), _rolling_sum(b, w, min_periods)
+    saa, sbb, sab = _rolling_sum(a * a, w, min_periods), _rolling_sum(b * b, w, min_periods), _rolling_sum(a * b, w, min_periods)
+    va, vb = n * saa - sa * sa, n * sbb - sb * sb
+    with np.errstate(invalid="ignore", divide="ignore"):
+        corr = np.where((va > 1e-12 * n * n) & (vb > 1e-12 * n * n), (n * sab - sa * sb) / np.sqrt(va * vb), np.nan)
+    return _as_output(np.clip(corr, -1.0, 1.0), df.index, window, "corr")
+
+def microprice(bid: float, bid_qty: float, ask: float, ask_qty: float) -> float:
+    """Size-weighted mid: leans towards the side with less resting size."""
+    tot = bid_qty + ask_qty
+    if tot <= 0:
+        return (bid + ask) / 2.0
+    return (bid * ask_qty + ask * bid_qty) / tot
+
+def depth_imbalance(bid_depth: float, ask_depth: float) -> float:
+    """(bid - ask) / (bid + ask) over the top-N book depth, in [-1, 1]."""
+    tot = bid_depth + ask_depth
+    if tot <= 0:
+        return 0.0
+    return (bid_depth - ask_depth) / tot
+
+def spread_bps(bid: float, ask: float) -> float:
+    mid = (bid + ask) / 2.0
+    if mid <= 0:
+        return float("nan")
+    return (ask - bid) / mid * 1e4
+
+def _windows(window) -> np.ndarray:
+    return np.atleast_1d(np.asarray(window, dtype=np.int64))
+
+def _rolling_sum(a: np.ndarray, windows: np.ndarray, min_periods: Optional[int] = None) -> np.ndarray:
+    """Rolling sums of `a` for every window at once -> (len(windows), len(a)).
+    NaN until a window fills, or until `min_periods` points are available when given."""
+    cs = np.cumsum(a)
+    n = len(a)
+    out = np.empty((len(windows), n))
+    # contiguous slices per window (a gather over (k, n) index arrays is several times slower)
+    for i, w in enumerate(windows):
+        row = out[i]
+        row[:] = cs
+        if w < n:
+            row[w:] -= cs[:n - w]
+        row[:(w - 1 if min_periods is None else min_periods - 1)] = np.nan
+    return out
+
+def _rolling_count(n: int, windows: np.ndarray, min_periods: Optional[int] = None) -> np.ndarray:
+    t = np.arange(1, n + 1, dtype=float)
+    return np.minimum(t[None, :], windows[:, None]) if min_periods is not None else windows[:, None].astype(float)
+
+def _as_output(arr: np.ndarray, index, window, name: str):
+    if np.ndim(window) == 0:
+        return pd.Series(arr[0], index=index, name=name)
+    return pd.DataFrame(arr.T, index=index, columns=[int(w) for w in np.atleast_1d(window)])
+
+def rolling_ols(y: pd.Series, x: pd.Series, window=100) -> Tuple[Any, Any]:
+    """
+    Rolling y = alpha + beta * x over the trailing `window` points, O(n) per window via cumulative sums.
+    `window` may be an int (-> Series) or a list of ints (-> DataFrames, one column per window).
+    Inputs are de-meaned over the full sample first to keep the cumsum differences well conditioned.
+    """
+    df = pd.concat([y, x], axis=1).dropna()
+    if df.empty:
+        return pd.Series(dtype=float), pd.Series(dtype=float)
+    Y = df.iloc[:, 0].values.astype(float)
+    X = df.iloc[:, 1].values.astype(float)
+    my, mx = Y.mean(), X.mean()
+    Y, X = Y - my, X - mx
+    w = _windows(window)
+    n = w[:, None].astype(float)
+    sx, sy = _rolling_sum(X, w), _rolling_sum(Y, w)
+    sxx, sxy = _rolling_sum(X * X, w), _rolling_sum(X * Y, w)
+    var = n * sxx - sx * sx
+    with np.errstate(invalid="ignore", divide="ignore"):
+        beta = np.where(var > 1e-12 * n * n, (n * sxy - sx * sy) / var, np.nan)
+        alpha = (sy - beta * sx) / n + my - beta * mx
+    return _as_output(beta, df.index, window, "beta"), _as_output(alpha, df.index, window, "alpha")
+
+def rolling_spread(y: pd.Series, x: pd.Series, window: int = 100) -> pd.Series:
+    """Spread against a rolling hedge: y - (alpha_t + beta_t * x)."""
+    beta, alpha = rolling_ols(y, x, window)
+    if beta.empty:
+        return pd.Series(dtype=float)
+    df = pd.concat([y, x], axis=1).dropna()
+    return df.iloc[:, 0] - (alpha + beta * df.iloc[:, 1])
+
+def ewma_zscore(s: pd.Series, halflife=30, min_periods: int = 5):
+    """(s - EWMA mean) / EWMA std; `halflife` may be a list (-> one column per halflife)."""
+    s = s.dropna()
+    if s.empty:
+        return pd.Series(dtype=float)
+    out = []
+    for hl in np.atleast_1d(halflife):
+        ew = s.ewm(halflife=float(hl), adjust=False, min_periods=min_periods)
+        out.append(((s - ew.mean()) / ew.std()).values)
+    return _as_output(np.asarray(out), s.index, halflife, "zscore")
+
+def rolling_half_life(spread: pd.Series, window=200):
+    """
+    Rolling Ornstein-Uhlenbeck half-life (in samples) from the AR(1) fit ds_t = a + b * s_{t-1}:
+    half_life = -ln 2 / ln(1 + b); NaN where the window is not mean-reverting (b >= 0).
+    """
+    s = spread.dropna()
+    if len(s) < 3:
+        return pd.Series(dtype=float)
+    lagged = s.shift(1)
+    b, _ = rolling_ols(s - lagged, lagged, window)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        hl = -np.log(2.0) / np.log1p(b.where((b < 0) & (b > -1)))
+    return hl.reindex(s.index)
+
+# ---------- realized volatility ----------
+VOL_ESTIMATORS = ("cc", "parkinson", "gk", "rs", "yz", "rv")
+_VOL_TERMS = ("r", "r2", "on", "on2", "oc", "oc2", "park", "gk", "rs")
+_MS_PER_YEAR = 365.0 * 24 * 3600 * 1000
+
+def vol_terms(o, h, l, c, prev_c) -> np.ndarray:
+    """
+    Per-bar variance terms (rows of _VOL_TERMS) shared by the batch and streaming estimators:
+    close-to-close and overnight (open vs previous close) log returns and their squares, open-to-close,
+    and the Parkinson, Garman-Klass and Rogers-Satchell range terms. Works on arrays or scalars.
+    """
+    o, h, l, c, prev_c = (np.asarray(a, dtype=float) for a in (o, h, l, c, prev_c))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        hl, co = np.log(h / l), np.log(c / o)
+        r, on = np.log(c / prev_c), np.log(o / prev_c)
+        rs = np.log(h / c) * np.log(h / o) + np.log(l / c) * np.log(l / o)
+    return np.array([r, r * r, on, on * on, co, co * co, hl * hl / (4.0 * np.log(2.0)),
+                     0.5 * hl * hl - (2.0 * np.log(2.0) - 1.0) * co * co, rs])
+
+def _vol_from_sums(estimator: str, s: dict, n, rv_sum=None, rv_n=None):
+    """Per-bar sigma from window sums of the vol terms (scalars or arrays)."""
+    with np.errstate(invalid="ignore", divide="ignore"):
+        if estimator == "cc":
+            var = (s["r2"] - s["r"] ** 2 / n) / (n - 1)
+        elif estimator == "parkinson":
+            var = s["park"] / n
+        elif estimator == "gk":
+            var = s["gk"] / n
+        elif estimator == "rs":
+            var = s["rs"] / n
+        elif estimator == "yz":
+            var_on = (s["on2"] - s["on"] ** 2 / n) / (n - 1)
+            var_oc = (s["oc2"] - s["oc"] ** 2 / n) / (n - 1)
+            k = 0.34 / (1.34 + (n + 1) / (n - 1))
+            var = var_on + k * var_oc + (1.0 - k) * s["rs"] / n
+        elif estimator == "rv":
+            var = rv_sum / rv_n
+        else:
+            raise ValueError(f"unknown vol estimator {estimator}")
+        return np.sqrt(np.maximum(var, 0.0))
+
+def annualization(bar_ms: Optional[int]) -> float:
+    """sqrt(bars per year) for a 24/7 market; 1.0 when bar_ms is None."""
+    return float(np.sqrt(_MS_PER_YEAR / bar_ms)) if bar_ms else 1.0
+
+def tick_realized_variance(ts_ms: np.ndarray, price: np.ndarray, bar_ms: int) -> pd.Series:
+    """Sum of squared tick log returns per bar (bar start index, UTC); the return into a bar's first tick counts in that bar."""
+    ts_ms = np.asarray(ts_ms, dtype=np.int64)
+    p = np.asarray(price, dtype=float)
+    if len(ts_ms) < 2:
+        return pd.Series(dtype=float, name="rv")
+    r2 = np.r_[0.0, np.diff(np.log(p)) ** 2]
+    buckets = ts_ms - ts_ms % bar_ms
+    first = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    return pd.Series(np.add.reduceat(r2, first), index=pd.to_datetime(buckets[first], unit="ms", utc=True), name="rv")
+
+def realized_vol(ohlc: pd.DataFrame, estimator="yz", window: int = 30, bar_ms: Optional[int] = None):
+    """
+    Rolling realized volatility per bar from OHLC bars, O(n) via cumulative sums of vol_terms().
+    `estimator` is one of VOL_ESTIMATORS or a list (-> DataFrame, one column each); "rv" needs an `rv`
+    column (tick_realized_variance). Annualized when bar_ms is given. The first bar uses its open as
+    previous close. Same numbers as RollingVol fed the same closed bars.
+    """
+    names = [estimator] if isinstance(estimator, str) else list(estimator)
+    if ohlc is None or ohlc.empty:
+        return pd.Series(dtype=float) if isinstance(estimator, str) else pd.DataFrame(columns=names)
+    o, h, l, c = (ohlc[k].values.astype(float) for k in ("open", "high", "low", "close"))
+    prev_c = np.r_[o[0], c[:-1]]
+    terms = vol_terms(o, h, l, c, prev_c)
+    w = _windows(window)
+    sums = {k: _rolling_sum(terms[i], w)[0] for i, k in enumerate(_VOL_TERMS)}
+    rv_sum = _rolling_sum(ohlc["rv"].values.astype(float), w)[0] if "rv" in ohlc else None
+    scale = annualization(bar_ms)
+    out = {e: _vol_from_sums(e, sums, float(window), rv_sum, float(window)) * scale for e in names}
+    if isinstance(estimator, str):
+        return pd.Series(out[estimator], index=ohlc.index, name=estimator)
+    return pd.DataFrame(out, index=ohlc.index)
+
+class RollingVol:
+    """
+    Streaming counterpart of realized_vol(): O(1) per closed bar.
+    - add_bar(o, h, l, c) pushes one closed bar's vol_terms into a `window`-long ring and updates the
+      running sums (re-summed from the ring every `window` bars to stop float drift)
+    - add_tick(price) accumulates squared tick log returns for the open bar (the "rv" estimator)
+    - value(estimator) -> per-bar sigma (annualized when bar_ms is set); NaN until the window is full
+    """
+
+    def __init__(self, window: int = 30, bar_ms: Optional[int] = None):
+        self.window = int(window)
+        self.bar_ms = bar_ms
+        self._terms = np.zeros((self.window, len(_VOL_TERMS)))
+        self._rv = np.zeros(self.window)
+        self._rv_ok = np.zeros(self.window, dtype=bool)
+        self._sums = np.zeros(len(_VOL_TERMS))
+        self._n = 0
+        self._pos = 0
+        self._since_resum = 0
+        self._prev_close: Optional[float] = None
+        self._last_tick: Optional[float] = None
+        self._open_rv = 0.0
+        self._open_has_ticks = False
+        self.bars = 0
+
+    def add_tick(self, price: float):
+        p = float(price)
+        if self._last_tick is not None and p > 0 and self._last_tick > 0:
+            self._open_rv += math.log(p / self._last_tick) ** 2
+        self._last_tick = p
+        self._open_has_ticks = True
+
+    def add_bar(self, o: float, h: float, l: float, c: float):
+        t = vol_terms(o, h, l, c, self._prev_close if self._prev_close is not None else o)
+        if not np.all(np.isfinite(t)):
+            return
+        i = self._pos
+        if self._n == self.window:
+            self._sums -= self._terms[i]
+        else:
+            self._n += 1
+        self._terms[i] = t
+        self._sums += t
+        self._rv[i], self._rv_ok[i] = self._open_rv, self._open_has_ticks
+        self._pos = (i + 1) % self.window
+        self._since_resum += 1
+        if self._since_resum >= self.window:
+            self._sums = self._terms[:self._n].sum(axis=0)
+            self._since_resum = 0
+        self._prev_close = float(c)
+        self._open_rv, self._open_has_ticks = 0.0, False
+        self.bars += 1
+
+    def add_bars(self, ohlc: pd.DataFrame):
+        for o, h, l, c in zip(ohlc["open"].values, ohlc["high"].values, ohlc["low"].values, ohlc["close"].values):
+            self.add_bar(o, h, l, c)
+
+    def value(self, estimator: str = "yz") -> float:
+        if self._n < self.window:
+            return float("nan")
+        n = float(self._n)
+        if estimator == "rv":
+            # only bars that saw live ticks (seeded history has no tick data)
+            k = int(self._rv_ok.sum())
+            if k < 2:
+                return float("nan")
+            return float(np.sqrt(self._rv[self._rv_ok].sum() / k) * annualization(self.bar_ms))
+        s = dict(zip(_VOL_TERMS, self._sums))
+        return float(_vol_from_sums(estimator, s, n) * annualization(self.bar_ms))
+
+    def values(self) -> dict:
+        return {e: self.value(e) for e in VOL_ESTIMATORS}
+
+# ---------- streaming quantiles ----------
+class KLLSketch:
+    """
+    KLL quantile sketch: fixed memory (about 3k items), O(1) amortised updates, mergeable.
+    Level h holds items of weight 2^h; a full level is sorted and every other item (random offset)
+    is promoted, so the rank error does not grow with the stream (about 0.2% of n at k=400).
+    """
+
+    def __init__(self, k: int = 400, seed: Optional[int] = None):
+        self.k = int(k)
+        self.levels: List[List[float]] = [[]]
+        self.n = 0
+        self._rng = random.Random(seed)
+
+    def _capacity(self, h: int) -> int:
+        depth = len(self.levels) - h - 1
+        return max(2, int(math.ceil(self.k * (2.0 / 3.0) ** depth)))
+
+    def _size(self) -> int:
+        return sum(len(lv) for lv in self.levels)
+
+    def _compress(self):
+        while self._size() >= sum(self._capacity(h) for h in range(len(self.levels))):
+            for h, lv in enumerate(self.levels):
+                if len(lv) >= self._capacity(h):
+                    if h + 1 == len(self.levels):
+                        self.levels.append([])
+                    lv.sort()
+                    # an odd item stays behind so total weight is preserved exactly
+                    keep = [lv.pop()] if len(lv) % 2 else []
+                    self.levels[h + 1].extend(lv[self._rng.random() < 0.5::2])
+                    self.levels[h] = keep
+                    break
+
+    def update(self, x: float):
+        self.levels[0].append(float(x))
+        self.n += 1
+        if len(self.levels[0]) >= self._capacity(0):
+            self._compress()
+
+    def update_many(self, xs):
+        xs = np.asarray(xs, dtype=float)
+        xs = xs[~np.isnan(xs)]
+        cap = self._capacity(0)
+        for i in range(0, len(xs), cap):
+            self.levels[0].extend(xs[i:i + cap].tolist())
+            self._compress()
+        self.n += len(xs)
+
+    def merge(self, other: "KLLSketch") -> "KLLSketch":
+        while len(self.levels) < len(other.levels):
+            self.levels.append([])
+        for h, lv in enumerate(other.levels):
+            self.levels[h].extend(lv)
+        self.n += other.n
+        self._compress()
+        return self
+
+    def copy(self) -> "KLLSketch":
+        out = KLLSketch(self.k)
+        out.levels = [list(lv) for lv in self.levels]
+        out.n = self.n
+        return out
+
+    def _sorted(self) -> Tuple[np.ndarray, np.ndarray]:
+        vals = np.concatenate([np.asarray(lv, dtype=float) for lv in self.levels])
+        w = np.concatenate([np.full(len(lv), float(2 ** h)) for h, lv in enumerate(self.levels)])
+        order = np.argsort(vals, kind="stable")
+        return vals[order], np.cumsum(w[order])
+
+    def quantile(self, q):
+        """Value at quantile q in [0, 1] (scalar or array); NaN when empty."""
+        if self.n == 0:
+            return np.full(np.shape(q), np.nan) if np.ndim(q) else float("nan")
+        vals, cw = self._sorted()
+        idx = np.minimum(np.searchsorted(cw, np.asarray(q, dtype=float) * cw[-1], side="left"), len(vals) - 1)
+        out = vals[idx]
+        return out if np.ndim(q) else float(out)
+
+    def rank(self, x: float) -> float:
+        """Approximate fraction of items <= x."""
+        if self.n == 0:
+            return float("nan")
+        vals, cw = self._sorted()
+        i = np.searchsorted(vals, x, side="right")
+        return float(cw[i - 1] / cw[-1]) if i else 0.0
+
+
+class WindowedQuantiles:
+    """
+    Quantiles over a sliding time window from per-bucket KLL sketches.
+    - values go into the sketch of their time bucket (bucket_s); buckets older than window_s are dropped,
+      so memory is fixed at about window_s / bucket_s sketches
+    - quantile(q, lookback_s) merges the buckets inside the lookback (closed ones cached as one merged
+      sketch until the set changes) with the open bucket
+    - observe_series(series) feeds only the points newer than the last one seen, so it can be called
+      with the same growing series on every refresh
+    """
+
+    def __init__(self, window_s: float = 24 * 3600, bucket_s: float = 1800, k: int = 400):
+        self.window_ms = int(window_s * 1000)
+        self.bucket_ms = int(bucket_s * 1000)
+        self.k = k
+        self.buckets: deque = deque()
+        self.last_ts_ms: Optional[int] = None
+        self._merged: Dict[Tuple, KLLSketch] = {}
+
+    def update(self, ts_ms: int, x: float):
+        self.update_many(np.array([ts_ms], dtype=np.int64), np.array([x], dtype=float))
+
+    def update_many(self, ts_ms: np.ndarray, xs: np.ndarray):
+        ts_ms = np.asarray(ts_ms, dtype=np.int64)
+        xs = np.asarray(xs, dtype=float)
+        if len(ts_ms) == 0:
+            return
+        b = ts_ms - ts_ms % self.bucket_ms
+        first = np.flatnonzero(np.r_[True, b[1:] != b[:-1]])
+        last = np.r_[first[1:], len(b)]
+        for i, j in zip(first, last):
+            start = int(b[i])
+            sk = None
+            for bs, s in reversed(self.buckets):
+                if bs == start:
+                    sk = s
+                    break
+                if bs < start:
+                    break
+            if sk is None:
+                if self.buckets and start < self.buckets[-1][0]:
+                    continue  # older than the open bucket and not kept
+                sk = KLLSketch(self.k)
+                self.buckets.append((start, sk))
+                self._merged.clear()
+            sk.update_many(xs[i:j])
+        self.last_ts_ms = max(self.last_ts_ms or 0, int(ts_ms[-1]))
+        while self.buckets and self.buckets[0][0] < self.last_ts_ms - self.window_ms:
+            self.buckets.popleft()
+            self._merged.clear()
+
+    def observe_series(self, s: pd.Series):
+        if s is None or s.empty:
+            return
+        s = s.dropna()
+        ts = s.index.as_unit("ms").asi8 if isinstance(s.index, pd.DatetimeIndex) else np.asarray(s.index, dtype=np.int64)
+        if self.last_ts_ms is not None:
+            m = ts > self.last_ts_ms
+            ts, s = ts[m], s[m]
+        self.update_many(ts, s.values)
+
+    def sketch(self, lookback_s: Optional[float] = None) -> KLLSketch:
+        """Merged sketch of the buckets that overlap the last lookback_s (whole window when None)."""
+        if not self.buckets:
+            return KLLSketch(self.k)
+        lo = self.last_ts_ms - int((lookback_s * 1000) if lookback_s else self.window_ms)
+        closed = [(bs, s) for bs, s in list(self.buckets)[:-1] if bs + self.bucket_ms > lo]
+        key = (closed[0][0], closed[-1][0]) if closed else None
+        out = KLLSketch(self.k)
+        if key is not None:
+            if key not in self._merged:
+                m = KLLSketch(self.k)
+                for _, s in closed:
+                    m.merge(s)
+                self._merged[key] = m
+            out.merge(self._merged[key])
+        return out.merge(self.buckets[-1][1])
+
+    def quantile(self, q, lookback_s: Optional[float] = None):
+        return self.sketch(lookback_s).quantile(q)
+
+    def count(self, lookback_s: Optional[float] = None) -> int:
+        lo = (self.last_ts_ms or 0) - int((lookback_s * 1000) if lookback_s else self.window_ms)
+        return sum(s.n for bs, s in self.buckets if bs + self.bucket_ms > lo)
+
+# ---------- VWAP & volume profile ----------
+_DAY_MS = 24 * 3600 * 1000
+
+class IncrementalVWAP:
+    """
+    Per-symbol session and rolling VWAP, O(1) per tick.
+    - session: running sum(price * size) / sum(size) since the session start (UTC day + session_offset_h)
+    - rolling: per-second (pv, v) buckets for the last max_window_s with running sums over rolling_s
+      (re-summed from the buckets every rolling_s evictions to stop float drift); a late tick goes into
+      its own second's bucket, inserted in order if that second had none yet;
+      rolling(window_s) answers any other window up to max_window_s from the same buckets
+    - history: last value of both per second, for plotting
+    """
+
+    def __init__(self, rolling_s: int = 300, max_window_s: int = 3600, session_offset_h: float = 0.0, max_history: int = 5000):
+        self.rolling_s = int(rolling_s)
+        self.max_window_s = max(int(max_window_s), self.rolling_s)
+        self.session_offset_ms = int(session_offset_h * 3600 * 1000)
+        self.session_start: Optional[int] = None
+        self.session_pv = 0.0
+        self.session_v = 0.0
+        self._buckets: deque = deque()  # [second, pv, v]
+        self._roll_pv = 0.0
+        self._roll_v = 0.0
+        self._roll_from = 0  # index into _buckets where the rolling_s window starts
+        self._since_resum = 0
+        self.history: deque = deque(maxlen=max_history)
+        self.last_ts_ms: Optional[int] = None
+
+    def _session_of(self, ts_ms: int) -> int:
+        t = ts_ms - self.session_offset_ms
+        return t - t % _DAY_MS + self.session_offset_ms
+
+    def add_tick(self, ts_ms: int, price: float, size: float):
+        ts_ms, p, v = int(ts_ms), float(price), float(size or 0.0)
+        if v <= 0:
+            return
+        sess = self._session_of(ts_ms)
+        if self.session_start is None or sess > self.session_start:
+            self.session_start, self.session_pv, self.session_v = sess, 0.0, 0.0
+        if sess == self.session_start:
+            self.session_pv += p * v
+            self.session_v += v
+        sec = ts_ms // 1000
+        if self._buckets and self._buckets[-1][0] >= sec:
+            # same second, or a late tick: add to its bucket, or insert one in time order
+            now_s = self.last_ts_ms // 1000
+            if sec <= now_s - self.max_window_s:
+                return
+            i = len(self._buckets) - 1
+            while i >= 0 and self._buckets[i][0] > sec:
+                i -= 1
+            if i >= 0 and self._buckets[i][0] == sec:
+                self._buckets[i][1] += p * v
+                self._buckets[i][2] += v
+            else:
+                i += 1
+                self._buckets.insert(i, [sec, p * v, v])
+                if sec <= now_s - self.rolling_s:
+                    # before the rolling window: shift its start index past the new bucket
+                    self._roll_from += 1
+            if sec > now_s - self.rolling_s:
+                self._roll_pv += p * v
+                self._roll_v += v
+        else:
+            self._buckets.append([sec, p * v, v])
+            self._roll_pv += p * v
+            self._roll_v += v
+        self.last_ts_ms = max(self.last_ts_ms or ts_ms, ts_ms)
+        now_s = self.last_ts_ms // 1000
+        while self._buckets and self._buckets[0][0] <= now_s - self.max_window_s:
+            self._buckets.popleft()
+            self._roll_from = max(0, self._roll_from - 1)
+        while self._roll_from < len(self._buckets) and self._buckets[self._roll_from][0] <= now_s - self.rolling_s:
+            b = self._buckets[self._roll_from]
+            self._roll_pv -= b[1]
+            self._roll_v -= b[2]
+            self._roll_from += 1
+            self._since_resum += 1
+        if self._since_resum >= self.rolling_s:
+            self._roll_pv = sum(b[1] for b in itertools.islice(self._buckets, self._roll_from, None))
+            self._roll_v = sum(b[2] for b in itertools.islice(self._buckets, self._roll_from, None))
+            self._since_resum = 0
+        if self.history and self.history[-1][0] == now_s:
+            self.history[-1] = (now_s, self.session_vwap, self.rolling_vwap)
+        else:
+            self.history.append((now_s, self.session_vwap, self.rolling_vwap))
+
+    def add_ticks(self, ts_ms: np.ndarray, price: np.ndarray, size: np.ndarray):
+        for t, p, v in zip(np.asarray(ts_ms).tolist(), np.asarray(price).tolist(), np.asarray(size).tolist()):
+            self.add_tick(t, p, v)
+
+    @property
+    def session_vwap(self) -> float:
+        return self.session_pv / self.session_v if self.session_v > 0 else float("nan")
+
+    @property
+    def rolling_vwap(self) -> float:
+        return self._roll_pv / self._roll_v if self._roll_v > 1e-12 else float("nan")
+
+    def rolling(self, window_s: int) -> float:
+        """VWAP over the last window_s seconds (<= max_window_s) from the per-second buckets."""
+        if not self._buckets:
+            return float("nan")
+        lo = self.last_ts_ms // 1000 - int(window_s)
+        pv = v = 0.0
+        for b in reversed(self._buckets):
+            if b[0] <= lo:
+                break
+            pv += b[1]
+            v += b[2]
+        return pv / v if v > 0 else float("nan")
+
+    def to_frame(self) -> pd.DataFrame:
+        if not self.history:
+            return pd.DataFrame(columns=["session_vwap", "rolling_vwap"])
+        arr = np.asarray(self.history, dtype=float)
+        return pd.DataFrame(arr[:, 1:], index=pd.to_datetime(arr[:, 0].astype(np.int64), unit="s", utc=True),
+                            columns=["session_vwap", "rolling_vwap"])
+
+
+class VolumeProfile:
+    """
+    Session volume-at-price histogram on a fixed-size array of price bins.
+    - bins start at `step` (default 0.1 bp of the first price), centred on the first price
+    - a price outside the range coarsens the grid 2x (adjacent bins summed, O(n_bins)) and shifts it
+      towards the price, repeatedly if needed; the number of rebins only grows with log(range / step)
+    - to_frame(bin_size) reads it at any coarser bin size by summing groups of bins
+    - resets when the session (UTC day + session_offset_h) changes
+    """
+
+    def __init__(self, n_bins: int = 1024, step: Optional[float] = None, step_bps: float = 0.1, session_offset_h: float = 0.0):
+        self.n_bins = int(n_bins) - int(n_bins) % 2
+        self.base_step = step
+        self.step_bps = step_bps
+        self.session_offset_ms = int(session_offset_h * 3600 * 1000)
+        self.session_start: Optional[int] = None
+        self.rebins = 0
+        self._reset()
+
+    def _reset(self):
+        self.vol = np.zeros(self.n_bins)
+        self.lo: Optional[float] = None
+        self.step: Optional[float] = self.base_step
+        self.total = 0.0
+
+    def _coarsen(self, price: float):
+        merged = self.vol.reshape(-1, 2).sum(axis=1)
+        half = self.n_bins // 2
+        self.vol = np.zeros(self.n_bins)
+        self.step *= 2.0
+        if price < self.lo:
+            # old range moves to the upper half, new room below
+            self.vol[half:] = merged
+            self.lo -= half * self.step
+        else:
+            self.vol[:half] = merged
+        self.rebins += 1
+
+    def add_tick(self, ts_ms: int, price: float, size: float):
+        p, v = float(price), float(size or 0.0)
+        if v <= 0 or p <= 0:
+            return
+        t = int(ts_ms) - self.session_offset_ms
+        sess = t - t % _DAY_MS + self.session_offset_ms
+        if self.session_start is None or sess > self.session_start:
+            self.session_start = sess
+            self._reset()
+        elif sess < self.session_start:
+            return
+        if self.lo is None:
+            self.step = self.step or p * self.step_bps * 1e-4
+            self.lo = p - self.n_bins // 2 * self.step
+        while not (self.lo <= p < self.lo + self.n_bins * self.step):
+            self._coarsen(p)
+        self.vol[int((p - self.lo) // self.step)] += v
+        self.total += v
+
+    def add_ticks(self, ts_ms: np.ndarray, price: np.ndarray, size: np.ndarray):
+        for t, p, v in zip(np.asarray(ts_ms).tolist(), np.asarray(price).tolist(), np.asarray(size).tolist()):
+            self.add_tick(t, p, v)
+
+    def to_frame(self, bin_size: Optional[float] = None) -> pd.DataFrame:
+        """Non-empty price levels (bin mid) with volume, at `bin_size` (rounded to a multiple of the current step)."""
+        if self.lo is None or self.total <= 0:
+            return pd.DataFrame(columns=["price", "volume"])
+        k = max(1, int(round(bin_size / self.step))) if bin_size else 1
+        nz = np.flatnonzero(self.vol)
+        first, last = nz[0] - nz[0] % k, nz[-1] + 1
+        vol = self.vol[first:last]
+        if k > 1:
+            vol = np.add.reduceat(vol, np.arange(0, len(vol), k))
+        price = self.lo + (first + np.arange(len(vol)) * k + k / 2.0) * self.step
+        return pd.DataFrame({"price": price, "volume": vol})
+
+    def point_of_control(self) -> float:
+        if self.lo is None or self.total <= 0:
+            return float("nan")
+        return float(self.lo + (int(np.argmax(self.vol)) + 0.5) * self.step)
+
+    def value_area(self, frac: float = 0.7) -> Tuple[float, float]:
+        """(low, high) of the narrowest band around the POC holding `frac` of the volume."""
+        if self.lo is None or self.total <= 0:
+            return float("nan"), float("nan")
+        i = j = int(np.argmax(self.vol))
+        acc = self.vol[i]
+        while acc < frac * self.total and (i > 0 or j < self.n_bins - 1):
+            down = self.vol[i - 1] if i > 0 else -1.0
+            up = self.vol[j + 1] if j < self.n_bins - 1 else -1.0
+            if up >= down:
+                j += 1
+                acc += up
+            else:
+                i -= 1
+                acc += down
+        return float(self.lo + i * self.step), float(self.lo + (j + 1) * self.step)
@@ -1,31 +1,57 @@
 # app.py
 import streamlit as st
-import queue
 import time
 import json
 import pandas as pd
 import os
 import math
 import threading
-
-from backend import BinanceIngestor
-from resampling import ticks_to_ohlcv, ohlcv_to_plotly
-from analytics import ols_hedge_ratio, spread_and_zscore, rolling_correlation
+import uuid
+
+from feed import DEFAULT_ADDRESS
+from hub import DataHub
+from storage import tick_db_paths
+from alert_dispatch import AlertDispatcher
+from resampling import ohlcv_to_plotly, BarCascade, PairAligner, TIMEFRAMES_MS
+from charts import LiveChart, line_figure, add_line, volume_profile_figure
+import exports
+import backtest
+from profiler import PROFILER
+from analytics import (ols_hedge_ratio, rolling_correlation, rolling_ols, rolling_spread,
+                       rolling_zscore, ewma_zscore, rolling_half_life, VOL_ESTIMATORS)
 import alerts as alert_engine
 
-# autorefresh helper (component may raise duplicate-key if recreated; handle defensively)
-from streamlit_autorefresh import st_autorefresh
-from streamlit.errors import StreamlitDuplicateElementKey
-
 st.set_page_config(layout="wide", page_title="Realtime Candles — Dashboard", initial_sidebar_state="expanded")
+# opt-in (Profiler page); a no-op unless enabled, closed at the end of the script
+PROFILER.begin("rerun")
+
+# ---------- process-wide data hub ----------
+@st.cache_resource
+def get_hub() -> DataHub:
+    # one ingestor + shared buffer/analytics per symbol set, for every browser session
+    return DataHub(db_path="ticks.db")
+
+hub = get_hub()
+
+@st.cache_resource
+def get_dispatcher() -> AlertDispatcher:
+    # alert persistence + delivery on its own loop; evaluation only enqueues
+    d = AlertDispatcher(db_path="alerts.db")
+    d.start()
+    return d
+
+dispatcher = get_dispatcher()
 
 # ---------- session defaults ----------
-if 'ingestor' not in st.session_state:
-    st.session_state.ingestor = None
-if 'q' not in st.session_state:
-    st.session_state.q = queue.Queue()
-if 'buffer' not in st.session_state:
-    st.session_state.buffer = []
+# sessions only hold a reference to the shared feed, a read cursor and view settings
+if 'session_id' not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
+if 'feed' not in st.session_state:
+    st.session_state.feed = None
+if 'attached' not in st.session_state:
+    st.session_state.attached = False
+if 'cursor' not in st.session_state:
+    st.session_state.cursor = 0
 if 'snapshot' not in st.session_state:
     st.session_state.snapshot = {}
 if 'started_at' not in st.session_state:
@@ -38,6 +64,12 @@ if 'alert_rules' not in st.session_state:
     st.session_state.alert_rules = []
 if 'alert_events' not in st.session_state:
     st.session_state.alert_events = []
+if 'charts' not in st.session_state:
+    st.session_state.charts = {}
+if 'alert_seq' not in st.session_state:
+    st.session_state.alert_seq = 0
+if 'render_marks' not in st.session_state:
+    st.session_state.render_marks = {}
 
 # internal flags
 if '_shutting_down' not in st.session_state:
@@ -45,27 +77,38 @@ if '_shutting_down' not in st.session_state:
 if '_cleared' not in st.session_state:
     st.session_state._cleared = False
 
-# ---------- autorefresh (defensive) ----------
-AUTORUN_INTERVAL_MS = 800
-try:
-    # use a unique key for the autorefresh component to avoid duplication
-    st_autorefresh(interval=AUTORUN_INTERVAL_MS, limit=None, key="autorefresh_main_v1")
-except StreamlitDuplicateElementKey:
-    # if key is already registered (rare), skip autorefresh to avoid crash
-    st.sidebar.warning("autorefresh already present — skipping duplicate registration.")
-except Exception:
-    # any other component error should not crash the app
-    st.sidebar.warning("autorefresh component could not be registered.")
-
 # ---------- sidebar controls ----------
+BOOK_METRICS = ['mid', 'microprice', 'imbalance', 'spread_bps']
+# annualized realized vol per symbol on the selected timeframe (analytics.VOL_ESTIMATORS)
+VOL_METRICS = ['vol_' + e for e in VOL_ESTIMATORS]
+ALERT_METRICS = ['zscore','spread','price','rolling_corr','adf','beta','half_life'] + BOOK_METRICS + VOL_METRICS
+
 with st.sidebar:
     st.title("Controls")
 
 
     symbols = st.text_input("Symbols (comma separated)", value="BTCUSDT,ETHUSDT")
-    timeframe_label = st.selectbox("Timeframe", ["1s", "1m", "5m"], index=1)
-    tf_map = {"1s": 1000, "1m": 60000, "5m": 300000}
+    tf_map = TIMEFRAMES_MS
+    timeframe_label = st.selectbox("Timeframe", list(tf_map), index=list(tf_map).index("1m"))
     timeframe_ms = tf_map[timeframe_label]
+    BAR_TYPES = {"Time": None, "Tick": "tick", "Volume": "volume", "Dollar": "dollar", "Imbalance": "imbalance"}
+    bar_type = st.selectbox("Bar type", list(BAR_TYPES), index=0,
+                            help="Event-driven bars close after N ticks / units of volume / notional / signed-flow imbalance.")
+    bar_kind = BAR_TYPES[bar_type]
+    DEFAULT_THRESHOLDS = {"tick": 100.0, "volume": 10.0, "dollar": 500000.0, "imbalance": 5.0}
+    bar_threshold = st.number_input("Bar threshold", min_value=0.0001, value=DEFAULT_THRESHOLDS[bar_kind], key=f"bar_thr_{bar_kind}") if bar_kind else None
+    compare_tfs = st.multiselect("Compare timeframes", [t for t in tf_map if t != timeframe_label], default=[])
+    pair_staleness_s = st.number_input("Pair max forward-fill (s, 0 = unlimited)", min_value=0, value=0, step=1)
+    hedge_mode = st.selectbox("Hedge ratio", ["Static OLS", "Rolling OLS"], index=0)
+    zscore_mode = st.selectbox("Z-score", ["Rolling", "EWMA"], index=0,
+                               help="EWMA uses the z-score window as its half-life.")
+    hedge_window = int(st.number_input("Rolling OLS / half-life window (grid points)", min_value=10, value=300, step=10))
+    vol_window = int(st.number_input("Realized vol window (bars)", min_value=2, value=30, step=1,
+                                     help="Bars of the selected timeframe; vol alert rules use their own window."))
+    show_profile = st.checkbox("Volume profile & VWAP", value=True)
+    profile_bin_bps = float(st.number_input("Volume profile bin (bps)", min_value=0.5, value=5.0, step=0.5,
+                                            help="Read off a fixed fine grid; changing it does not rebuild anything."))
+    vwap_window_s = int(st.number_input("Rolling VWAP window (s)", min_value=10, max_value=3600, value=300, step=10))
 
     col1, col2 = st.columns(2)
     with col1:
@@ -73,7 +116,28 @@ with st.sidebar:
     with col2:
         stop_btn = st.button("Stop")
 
+    data_source = st.radio("Data source", ["Local ingest", "Feed service"], horizontal=True,
+                           help="Feed service: subscribe to a running `python feed.py` instead of opening websockets here.")
+    feed_address = st.text_input("Feed address", value=DEFAULT_ADDRESS) if data_source == "Feed service" else DEFAULT_ADDRESS
     demo_mode_chk = st.checkbox("Enable Demo Mode (local testing)", value=False)
+    sim_cfg = None
+    if demo_mode_chk:
+        # in-process MarketSimulator: cointegrated pairs, Poisson or bursty arrivals
+        sim_rate = float(st.number_input("Simulated trades / s (all symbols)", min_value=1.0, value=20.0, step=10.0))
+        sim_arrivals = st.selectbox("Arrivals", ["poisson", "bursty"], index=0)
+        sim_seed = int(st.number_input("Seed", min_value=0, value=0, step=1, help="0 = random"))
+        sim_cfg = {"rate": sim_rate, "arrivals": sim_arrivals, **({"seed": sim_seed} if sim_seed else {})}
+    ws_base_url = st.text_input("WebSocket base URL", value="",
+                                help="Empty = Binance. e.g. ws://127.0.0.1:9443/ws for `python simulator.py`.") if data_source == "Local ingest" and not demo_mode_chk else ""
+    COALESCE_MODES = {"Off": "off", "Merge same ms/price": "merge", "aggTrade stream": "aggtrade"}
+    coalesce_label = st.selectbox("Trade aggregation", list(COALESCE_MODES), index=0,
+                                  help="Merge trades with the same (ms, price), or subscribe to aggTrade; volume and trade counts stay exact.")
+    reorder_ms = int(st.number_input("Reorder watermark (ms)", min_value=0, value=250, step=50,
+                                     help="Hold ticks this long to release them in exchange-time order and drop duplicate trade ids; later ticks amend their bars."))
+    depth_chk = st.checkbox("Order book (L2 depth)", value=False,
+                            help="Maintain per-symbol books from @depth diffs; adds mid/microprice/imbalance/spread metrics.")
+    warm_start_chk = st.checkbox("Warm start from ticks.db", value=True)
+    warm_start_minutes = st.number_input("Warm start window (minutes)", min_value=1, value=30, step=5)
     inject_demo_btn = st.button("Inject Demo Tick")
 
     pause_display = st.checkbox("Pause Chart (freeze)", value=st.session_state.display_paused)
@@ -85,6 +149,10 @@ with st.sidebar:
         st.session_state.db_clear_requested = True
     else:
         st.session_state.db_clear_requested = False
+    storage_shards = int(st.number_input("Storage shards", min_value=1, max_value=64, value=1, step=1,
+                                         help="Split ticks.db into K files (ticks.shardI-of-K.db) with one writer thread each."))
+    retention_hours = st.number_input("Tick retention in DB (hours, 0 = keep all)", min_value=0.0, value=0.0, step=1.0,
+                                      help="Older ticks are rolled up into 1m bars (bars_1m) and deleted in the background.")
 
     st.markdown("---")
     st.subheader("Alert rules")
@@ -97,6 +165,9 @@ with st.sidebar:
             "side": ">",
             "threshold": 2.0,
             "window": 50,
+            "threshold_mode": "fixed",
+            "quantile": 99.0,
+            "lookback_h": 6.0,
             "enabled": True
         }
         st.session_state.alert_rules.append(new)
@@ -104,8 +175,8 @@ with st.sidebar:
     for i, r in enumerate(st.session_state.alert_rules):
         with st.expander(f"{r.get('name')} ({r.get('metric')})", expanded=False):
             r['name'] = st.text_input(f"Name {i}", value=r.get('name'), key=f"ar_name_{i}")
-            r['metric'] = st.selectbox(f"Metric {i}", options=['zscore','spread','price','rolling_corr','adf'],
-                                       index=['zscore','spread','price','rolling_corr','adf'].index(r.get('metric','zscore')),
+            r['metric'] = st.selectbox(f"Metric {i}", options=ALERT_METRICS,
+                                       index=ALERT_METRICS.index(r.get('metric','zscore')),
                                        key=f"ar_metric_{i}")
             # Parse global symbols for options
             sym_options = [s.strip().upper() for s in symbols.split(",") if s.strip()]
@@ -120,7 +191,18 @@ with st.sidebar:
             r['symbol'] = st.selectbox(f"Symbol {i}", options=sym_options, index=idx_sym, key=f"ar_sym_{i}")
             r['side'] = st.selectbox(f"Operator {i}", options=['>','<','>=','<=','=='],
                                      index=['>','<','>=','<=','=='].index(r.get('side','>')), key=f"ar_side_{i}")
-            r['threshold'] = float(st.number_input(f"Threshold {i}", value=float(r.get('threshold',0.0)), key=f"ar_thr_{i}"))
+            if r['metric'] in alert_engine.QUANTILE_METRICS:
+                r['threshold_mode'] = st.selectbox(f"Threshold type {i}", options=['fixed', 'quantile'],
+                                                   index=['fixed', 'quantile'].index(r.get('threshold_mode', 'fixed')),
+                                                   format_func=lambda m: "Fixed value" if m == 'fixed' else "Percentile of recent history",
+                                                   key=f"ar_thmode_{i}")
+            if alert_engine.is_adaptive(r):
+                r['quantile'] = float(st.number_input(f"Percentile {i}", min_value=0.1, max_value=99.9,
+                                                      value=float(r.get('quantile', 99.0)), key=f"ar_q_{i}"))
+                r['lookback_h'] = float(st.number_input(f"Lookback (hours) {i}", min_value=0.1, max_value=24.0,
+                                                        value=float(r.get('lookback_h', 6.0)), key=f"ar_lb_{i}"))
+            else:
+                r['threshold'] = float(st.number_input(f"Threshold {i}", value=float(r.get('threshold',0.0)), key=f"ar_thr_{i}"))
             r['window'] = int(st.number_input(f"Window {i}", value=int(r.get('window',50)), key=f"ar_win_{i}"))
             r['enabled'] = st.checkbox("Enabled", value=r.get('enabled',True), key=f"ar_en_{i}")
             colx, coly = st.columns(2)
@@ -136,85 +218,180 @@ with st.sidebar:
             st.success("Rules applied successfully!")
             st.rerun()
 
+    with st.expander("Alert delivery", expanded=False):
+        # events are always stored in alerts.db; sinks are optional, retried and rate limited
+        sink_webhook = st.text_input("Webhook URL (POST JSON)", value="")
+        sink_file = st.text_input("NDJSON file", value="")
+        sink_socket = st.text_input("Socket (host:port or unix:/path)", value="")
+        sink_rate = float(st.number_input("Max sends per second per sink", min_value=0.0, value=5.0, step=1.0,
+                                          help="0 = unlimited"))
+        alert_sinks = []
+        for kind, target in (("webhook", sink_webhook), ("file", sink_file), ("socket", sink_socket)):
+            if target.strip():
+                try:
+                    alert_sinks.append(dispatcher.add_sink({"kind": kind, "target": target.strip(),
+                                                            "rate_per_s": sink_rate or None},
+                                                           owner=st.session_state.session_id))
+                except Exception as e:
+                    st.warning(f"{kind} sink: {e}")
+        # sinks no session selects anymore (changed rate, cleared target, ended session) are closed
+        dispatcher.select_sinks(st.session_state.session_id, alert_sinks)
+
     st.markdown("---")
 
     # NDJSON download
     download_ndjson = st.button("Download ticks NDJSON")
     st.markdown("Use Demo Mode for local testing if websockets blocked.")
 
+# ---------- shared state accessors ----------
+def current_feed():
+    return st.session_state.feed
+
+def get_cascade(sym: str) -> BarCascade:
+    feed = current_feed()
+    return feed.cascade(sym) if feed else BarCascade()
+
+def get_bars(sym: str) -> pd.DataFrame:
+    """Bars for the selected bar type: time bars from the cascade, otherwise the shared event-bar builder."""
+    feed = current_feed()
+    if feed is None:
+        return BarCascade().get(timeframe_ms) if bar_kind is None else pd.DataFrame()
+    with PROFILER.section("bars"):
+        if bar_kind is None:
+            # get() may add a level that pump() iterates, so it runs under the feed lock
+            return feed.read(lambda: feed.cascade(sym).get(timeframe_ms))
+        return feed.read(lambda: feed.event_builder(sym, bar_kind, bar_threshold).to_frame())
+
+def get_vol(sym: str, window: int):
+    """(bars, {estimator: annualized vol}) from the shared cascade's tracker, read under the feed lock."""
+    feed = current_feed()
+    if feed is None:
+        return 0, {}
+    def _read():
+        tr = feed.cascade(sym).vol(timeframe_ms, window)
+        return tr.bars, tr.values()
+    return feed.read(_read)
+
 # ---------- queue drain ----------
-def drain_queue(q, buffer, max_append=200):
-    appended = 0
-    while appended < max_append:
-        try:
-            item = q.get_nowait()
-        except Exception:
-            break
-        buffer.append(item)
-        appended += 1
-    
-    # Cap buffer size to prevent indefinite growth
-    MAX_BUFFER_SIZE = 5000
-    if len(buffer) > MAX_BUFFER_SIZE:
-        buffer[:] = buffer[-MAX_BUFFER_SIZE:]
-        
+def drain_queue():
+    """Pull new ticks into the shared state (rate-limited across sessions) and advance our cursor."""
+    feed = current_feed()
+    if feed is None:
+        return 0
+    hub.touch(st.session_state.session_id, feed)
+    with PROFILER.section("drain_queue"):
+        appended = feed.pump()
+    st.session_state.cursor = feed.seq
     return appended
 
+# ---------- charts ----------
+def show_chart(fig):
+    # figure -> JSON for the frontend is a cost of its own on large charts
+    with PROFILER.section("plotly.serialize"):
+        st.plotly_chart(fig, use_container_width=True)
+
 # ---------- snapshot ----------
 def take_snapshot():
     syms_list = [s.strip().upper() for s in symbols.split(",") if s.strip()]
     for sym in syms_list:
-        df = pd.DataFrame([t for t in st.session_state.buffer if t['symbol'].upper() == sym])
-        if df.empty:
-            st.session_state.snapshot[sym] = None
-            continue
-        df['ts'] = pd.to_datetime(df['ts'], utc=True, errors='coerce')
-        df.dropna(subset=['ts'], inplace=True)
-        if df.empty:
-            st.session_state.snapshot[sym] = None
-            continue
-        df.set_index('ts', inplace=True)
-        ohlcv = ticks_to_ohlcv(df, timeframe_ms)
+        ohlcv = get_bars(sym)
         st.session_state.snapshot[sym] = ohlcv.copy() if not ohlcv.empty else None
 
 # ---------- helper fetch ----------
 def fetch_price_series(sym: str):
-    df = pd.DataFrame([t for t in st.session_state.buffer if t['symbol'].upper() == sym.upper()])
-    if df.empty:
-        return pd.Series(dtype=float)
-    df['ts'] = pd.to_datetime(df['ts'], utc=True, errors='coerce')
-    df.dropna(subset=['ts'], inplace=True)
-    if df.empty:
+    feed = current_feed()
+    if feed is None:
         return pd.Series(dtype=float)
-    df.set_index('ts', inplace=True)
-    return df['price'].astype(float)
+    return feed.read(lambda: feed.buffer.series(sym))
+
+# ---------- pair alignment ----------
+def get_aligner(left: str, right: str) -> PairAligner:
+    feed = current_feed()
+    if feed is None:
+        return PairAligner(left, right)
+    return feed.aligner(left, right, int(pair_staleness_s))
+
+def aligned_pair(left: str, right: str):
+    feed = current_feed()
+    al = get_aligner(left, right)
+    grid = feed.read(al.to_frame) if feed else al.to_frame()
+    return grid.iloc[:, 0], grid.iloc[:, 1]
 
 # ---------- pair metrics ----------
 def compute_pair_metrics(left: str, right: str, window: int = 50):
-    sL = fetch_price_series(left)
-    sR = fetch_price_series(right)
-    if sL.empty or sR.empty:
+    feed = current_feed()
+    if feed is None:
+        return pd.Series(dtype=float), pd.Series(dtype=float), None
+    # computed once per new grid point and shared by every session/rule asking for the same pair
+    al = get_aligner(left, right)
+    key = ("pair_metrics", al.left, al.right, int(pair_staleness_s), int(window), hedge_mode, zscore_mode, hedge_window)
+
+    def _compute():
+        res = _compute_pair_metrics(left, right, window)
+        # each new grid point goes into the spread / z-score sketches once, for percentile thresholds
+        feed.quantiles(pair_sketch_key("spread", al.left, al.right, window)).observe_series(res[0])
+        feed.quantiles(pair_sketch_key("zscore", al.left, al.right, window)).observe_series(res[1])
+        return res
+    return feed.memo(key, al.version, _compute)
+
+def pair_sketch_key(metric: str, left: str, right: str, window: int = 50):
+    # the spread does not depend on the z-score window
+    key = (metric, left.upper(), right.upper(), int(pair_staleness_s), hedge_mode, hedge_window)
+    return key + (int(window), zscore_mode) if metric == "zscore" else key
+
+@PROFILER.timed("pair_metrics")
+def _compute_pair_metrics(left: str, right: str, window: int = 50):
+    sL1, sR1 = aligned_pair(left, right)
+    if sL1.empty or sR1.empty:
         return pd.Series(dtype=float), pd.Series(dtype=float), None
-    sL1 = sL.resample('1S').last().ffill()
-    sR1 = sR.resample('1S').last().ffill()
-    beta = ols_hedge_ratio(sL1, sR1)
-    spread, zscore = spread_and_zscore(sL1, sR1, beta=beta, window=window)
+    if hedge_mode == "Rolling OLS":
+        spread = rolling_spread(sL1, sR1, hedge_window).dropna()
+    else:
+        spread = sL1 - ols_hedge_ratio(sL1, sR1) * sR1
+    zscore = ewma_zscore(spread, halflife=window) if zscore_mode == "EWMA" else rolling_zscore(spread, window)
     adf_res = None
     try:
         from statsmodels.tsa.stattools import adfuller
         s = spread.dropna()
         if len(s) >= 10:
-            r = adfuller(s)
+            with PROFILER.section("adf"):
+                r = adfuller(s)
             adf_res = {"adf_stat": float(r[0]), "pvalue": float(r[1]), "usedlag": int(r[2]), "nobs": int(r[3]), "crit": r[4]}
     except Exception:
         adf_res = None
     return spread, zscore, adf_res
 
+def compute_pair_dynamics(left: str, right: str):
+    """(rolling beta, rolling OU half-life in seconds) for the pair, shared across sessions per grid version."""
+    feed = current_feed()
+    if feed is None:
+        return pd.Series(dtype=float), pd.Series(dtype=float)
+    al = get_aligner(left, right)
+    key = ("pair_dynamics", al.left, al.right, int(pair_staleness_s), hedge_mode, zscore_mode, hedge_window)
+
+    def _compute():
+        sL, sR = aligned_pair(left, right)
+        beta, _ = rolling_ols(sL, sR, hedge_window)
+        spread, _, _ = compute_pair_metrics(left, right)
+        # half-life comes out in grid steps
+        return beta, rolling_half_life(spread, hedge_window) * (al.grid_ms or 1000) / 1000.0
+    return feed.memo(key, al.version, _compute)
+
 # ---------- metrics provider for alerts ----------
 def metrics_provider(rule):
     metric = rule.get("metric")
     sym_field = (rule.get("symbol") or "").strip().upper()
     try:
+        if metric in BOOK_METRICS:
+            sym = sym_field or (symbols.split(",")[0].strip().upper() if symbols else None)
+            book = current_feed().books.get(sym) if current_feed() and sym else None
+            return float(book[metric]) if book else None
+        if metric in VOL_METRICS:
+            sym = sym_field or (symbols.split(",")[0].strip().upper() if symbols else None)
+            if not sym or current_feed() is None:
+                return None
+            v = get_vol(sym, max(2, int(rule.get("window", vol_window))))[1][metric[4:]]
+            return v if not math.isnan(v) else None
         if metric == "price":
             sym = sym_field or (symbols.split(",")[0].strip().upper() if symbols else None)
             if not sym:
@@ -238,6 +415,17 @@ def metrics_provider(rule):
                 return v if not (v is None or math.isnan(v)) else None
             if metric == "adf":
                 return float(adf_res['adf_stat']) if adf_res else None
+        if metric in ("beta", "half_life"):
+            if ":" in sym_field:
+                left,right = [p.strip().upper() for p in sym_field.split(":",1)]
+            else:
+                syms = [s.strip().upper() for s in symbols.split(",") if s.strip()]
+                if len(syms) < 2:
+                    return None
+                left,right = syms[0], syms[1]
+            beta, half_life = compute_pair_dynamics(left, right)
+            s = (beta if metric == "beta" else half_life).dropna()
+            return float(s.iloc[-1]) if not s.empty else None
         if metric == "rolling_corr":
             if ":" in sym_field:
                 left,right = [p.strip().upper() for p in sym_field.split(":",1)]
@@ -246,23 +434,45 @@ def metrics_provider(rule):
                 if len(syms) < 2:
                     return None
                 left,right = syms[0], syms[1]
-            sL = fetch_price_series(left).resample('1S').last().ffill()
-            sR = fetch_price_series(right).resample('1S').last().ffill()
+            sL, sR = aligned_pair(left, right)
             corr = rolling_correlation(sL,sR,window=rule.get("window",50))
             return float(corr.iloc[-1]) if not corr.empty else None
     except Exception:
         return None
     return None
 
+# ---------- percentile thresholds ----------
+MIN_QUANTILE_OBS = 100
+
+def adaptive_threshold(rule):
+    """Percentile of the rule's spread / z-score over its lookback, from the pair's shared sketch."""
+    feed = current_feed()
+    syms = backtest.rule_symbols(rule, [s.strip().upper() for s in symbols.split(",") if s.strip()])
+    if feed is None or len(syms) < 2:
+        return None
+    window = int(rule.get("window", 50))
+    compute_pair_metrics(syms[0], syms[1], window=window)  # feeds the sketches up to the newest point
+    sk = feed.quantiles(pair_sketch_key(rule.get("metric"), syms[0], syms[1], window))
+    lookback_s = float(rule.get("lookback_h", 6.0)) * 3600
+    # another session's compute_pair_metrics may be feeding the same sketch
+    n, v = feed.read(lambda: (sk.count(lookback_s), sk.quantile(float(rule.get("quantile", 99.0)) / 100.0, lookback_s)))
+    if n < MIN_QUANTILE_OBS:
+        return None
+    return None if math.isnan(v) else v
+
 # ---------- evaluate rules ----------
 def evaluate_and_record():
     rules = st.session_state.alert_rules
     if not rules:
         return []
-    events = alert_engine.evaluate_rules(rules, metrics_provider)
+    with PROFILER.section("evaluate_rules"):
+        events = alert_engine.evaluate_rules(rules, metrics_provider, adaptive_threshold)
     if events:
+        # persist + deliver in the background; never waits on disk or network
+        dispatcher.submit(events, alert_sinks)
         # push events into session history
         st.session_state.alert_events.extend(events)
+        st.session_state.alert_seq += len(events)
         # Cap alert history
         MAX_ALERT_HISTORY = 500
         if len(st.session_state.alert_events) > MAX_ALERT_HISTORY:
@@ -273,32 +483,35 @@ def evaluate_and_record():
 
 
 def stop_ingestor():
-    if not st.session_state.ingestor:
+    if not st.session_state.attached:
         return
     
-    st.session_state.ingestor.stop(wait_seconds=1.0)
-    st.session_state.ingestor = None
+    # ingestion only stops when the last session on this feed detaches
+    hub.detach(st.session_state.session_id, current_feed())
+    st.session_state.attached = False
     take_snapshot() # save last state
     st.rerun()
 
 def clear_all():
-    if st.session_state.ingestor:
-        st.session_state.ingestor.stop(wait_seconds=0.5)
-        st.session_state.ingestor = None
+    if st.session_state.attached:
+        hub.detach(st.session_state.session_id, current_feed())
+        st.session_state.attached = False
     
-    st.session_state.buffer = []
+    st.session_state.feed = None
+    st.session_state.cursor = 0
     st.session_state.snapshot = {}
     st.session_state.display_paused = False
     st.session_state.started_at = None
     st.session_state.alert_events = [] # also clear alerts
+    st.session_state.charts = {}
     
-    if st.session_state.db_clear_requested:
-        try:
-            os.remove("ticks.db")
-        except Exception:
-            pass
-            
-            pass
+    # other sessions may still be writing to the DB
+    if st.session_state.db_clear_requested and not hub.any_running():
+        for p in tick_db_paths("ticks.db"):
+            try:
+                os.remove(p)
+            except Exception:
+                pass
             
     st.rerun()
 
@@ -308,21 +521,28 @@ if start_btn:
     if not syms:
         st.warning("Enter at least one symbol")
     else:
-        # Stop existing if running
-        if st.session_state.ingestor:
-             st.session_state.ingestor.stop(wait_seconds=0.5)
-             st.session_state.ingestor = None
+        # Leave the previous feed (stops it only if no other session uses it)
+        if st.session_state.attached:
+             hub.detach(st.session_state.session_id, current_feed())
+             st.session_state.attached = False
              
-        st.session_state.q = queue.Queue()
-        st.session_state.buffer = []
         st.session_state.snapshot = {}
         st.session_state.alert_events = []
+        st.session_state.charts = {}
         st.session_state.started_at = time.time()
         
-        ing = BinanceIngestor(symbols=syms, out_queue=st.session_state.q, db_path="ticks.db")
-        ing.enable_demo_mode(bool(demo_mode_chk))
-        st.session_state.ingestor = ing
-        ing.start()
+        # joins the running feed for this symbol set if another session already started it;
+        # "Feed service" subscribes to a running `python feed.py` instead of ingesting here
+        st.session_state.feed = hub.attach(
+            st.session_state.session_id, syms,
+            source="feed" if data_source == "Feed service" else "local",
+            address=feed_address, demo=bool(demo_mode_chk),
+            retention_s=float(retention_hours) * 3600 or None,
+            warm_start_minutes=float(warm_start_minutes) if warm_start_chk else None,
+            depth=bool(depth_chk), coalesce=COALESCE_MODES[coalesce_label], reorder_ms=reorder_ms,
+            ws_base_url=ws_base_url.strip() or None, sim=sim_cfg, storage_shards=storage_shards)
+        st.session_state.attached = True
+        st.session_state.cursor = 0
         time.sleep(0.1) # brief wait for thread start
         st.rerun()
 
@@ -332,155 +552,307 @@ if stop_btn:
 if clear_btn:
     clear_all()
 if inject_demo_btn:
-    if st.session_state.ingestor:
-        threading.Thread(target=lambda: st.session_state.ingestor.inject_demo_tick_sync(), daemon=True).start()
+    ingestor = current_feed().ingestor if current_feed() else None
+    if ingestor and hasattr(ingestor, "inject_demo_tick_sync"):
+        threading.Thread(target=lambda: ingestor.inject_demo_tick_sync(), daemon=True).start()
         st.success("Injected demo tick (background)")
     else:
         st.warning("Start ingestor first")
 
 
 
-drain_queue(st.session_state.q, st.session_state.buffer, max_append=200)
+hub.reap()
+drain_queue()
+# a full run rebuilds every panel; fragment reruns only rebuild panels that have new data
+st.session_state.render_marks = {}
 
 
 
 if st.session_state.display_paused and (not st.session_state.snapshot):
     take_snapshot()
 
+# ---------- panel refresh ----------
+# Each panel is an st.fragment with its own interval instead of rerunning the whole script.
+# A fragment rerun clears whatever it drew into its slot last time, so every run draws; figures
+# are only rebuilt when the panel is stale and are otherwise re-emitted from st.session_state.charts.
+CANDLES_REFRESH_S = 1.0
+STATS_REFRESH_S = 2.0
+ALERT_EVAL_S = 1.0
+
+def panel_stale(panel, symbols_shown, extra=None) -> bool:
+    """True if `panel` must rebuild: first run since the full run, new ticks for `symbols_shown`
+    (None = any symbol, [] = none) or a changed `extra` signature. Records the rebuild."""
+    feed = current_feed()
+    seq = feed.seq if feed else 0
+    last = st.session_state.render_marks.get(panel)
+    if last is not None and last[1] == extra and not (feed and feed.changed_since(last[0], symbols_shown)):
+        return False
+    st.session_state.render_marks[panel] = (seq, extra)
+    return True
+
+def panel_view(panel, stale: bool, build):
+    """Cached view (figures + values) for `panel`; `build()` only runs when stale or missing."""
+    key = ("view",) + (panel if isinstance(panel, tuple) else (panel,))
+    charts = st.session_state.charts
+    if stale or key not in charts:
+        charts[key] = build()
+    return charts[key]
+
+def alert_signature():
+    ds = dispatcher.stats()
+    return (st.session_state.alert_seq, ds["stored"], tuple((s["sent"], s["failed"], s["dropped"]) for s in ds["sinks"]))
+
+def alert_history():
+    """(stored count, newest 200 rows) from alerts.db, re-read only when the alert signature changes."""
+    sig = alert_signature()
+    hit = st.session_state.get("alert_history")
+    if hit is None or hit[0] != sig:
+        hit = st.session_state.alert_history = (sig, dispatcher.store.count(), dispatcher.store.recent(200))
+    return hit[1], hit[2]
+
+@st.fragment(run_every=ALERT_EVAL_S)
+@PROFILER.timed_run("fragment:alerts")
+def alerts_panel(render=None, slot=None):
+    """Rule evaluation every ALERT_EVAL_S, then `render` into `slot` (alert history reads are cached)."""
+    drain_queue()
+    evaluate_and_record()
+    if render is None:
+        return
+    with slot.container():
+        render()
 
 
-events_fired = evaluate_and_record()
+def build_profile_view(feed, sym: str):
+    """Session volume-at-price figure with session / rolling VWAP, POC and value area."""
+    with PROFILER.section("volume_profile"):
+        prof, vw = feed.profile(sym), feed.vwap(sym)
 
-# ---------- Main layout ----------
-# Header first (placeholder)
-header_ph = st.empty()
-
-# Horizontal Navigation below header
-page = st.radio("Navigate", ["Graphs", "Statistics", "Alerts", "History"], index=0, horizontal=True, label_visibility="collapsed")
-st.markdown("---")
+        def _read():
+            session_vwap = vw.session_vwap
+            if prof.total <= 0 or session_vwap != session_vwap:
+                return None
+            # bin width in bps of the session VWAP
+            return (session_vwap, vw.rolling(vwap_window_s), prof.to_frame(session_vwap * profile_bin_bps * 1e-4),
+                    prof.value_area(0.7), prof.point_of_control())
+        snap = feed.read(_read)
+        if snap is None:
+            return {"info": "No volume yet for the profile."}
+        session_vwap, rolling_vwap, frame, va, poc = snap
+        fig = volume_profile_figure(frame, {"VWAP": session_vwap, f"VWAP {vwap_window_s}s": rolling_vwap},
+                                    value_area=va, fig=st.session_state.charts.get(("profile", sym)), height=540)
+        st.session_state.charts[("profile", sym)] = fig
+    return {"fig": fig, "session_vwap": session_vwap, "rolling_vwap": rolling_vwap, "poc": poc, "va": va}
+
+def draw_profile_view(v):
+    if "info" in v:
+        st.caption(v["info"])
+        return
+    show_chart(v["fig"])
+    m1, m2 = st.columns(2)
+    m1.metric("Session VWAP", f"{v['session_vwap']:.2f}")
+    m2.metric(f"VWAP {vwap_window_s}s", f"{v['rolling_vwap']:.2f}" if v['rolling_vwap'] == v['rolling_vwap'] else "—")
+    st.caption(f"POC {v['poc']:.2f} · 70% value area {v['va'][0]:.2f}–{v['va'][1]:.2f}")
 
-# Update header with dynamic title
-header_ph.title(f"Realtime Candles — {page}")
 
-if page == "Graphs":
-    st.subheader("Candles & Volume")
-    syms_list = [s.strip().upper() for s in symbols.split(",") if s.strip()]
-    if not syms_list:
-        st.info("Enter symbols and press Start.")
+def build_candles_view(feed, sym: str, paused: bool):
+    """Figures and values for one symbol's candles panel."""
+    if paused and st.session_state.snapshot.get(sym) is not None:
+        ohlcv = st.session_state.snapshot[sym]
     else:
-        tabs = st.tabs(syms_list)
-        for i, tab in enumerate(tabs):
-            sym = syms_list[i]
-            with tab:
-                if st.session_state.display_paused and st.session_state.snapshot.get(sym) is not None:
-                    ohlcv = st.session_state.snapshot[sym]
-                else:
-                    df = pd.DataFrame([t for t in st.session_state.buffer if t['symbol'].upper() == sym])
-                    if df.empty:
-                        st.info("No ticks yet for " + sym)
-                        continue
-                    df['ts'] = pd.to_datetime(df['ts'], utc=True, errors='coerce')
-                    df.dropna(subset=['ts'], inplace=True)
-                    if df.empty:
-                        st.info("No valid timestamps yet.")
-                        continue
-                    df.set_index('ts', inplace=True)
-                    ohlcv = ticks_to_ohlcv(df, timeframe_ms)
-
-                if ohlcv is None or ohlcv.empty:
-                    st.info("Not enough data to render candles.")
-                    continue
-
-                MAX_CANDLES = 200
-                ohlcv_plot = ohlcv.tail(MAX_CANDLES) if len(ohlcv) > MAX_CANDLES else ohlcv
-                fig_candle, fig_vol = ohlcv_to_plotly(ohlcv_plot)
-                if fig_candle:
-                    st.plotly_chart(fig_candle, use_container_width=True)
-                if fig_vol:
-                    st.plotly_chart(fig_vol, use_container_width=True)
-
-        # Pair analytics under charts if >=2 symbols
-        if len(syms_list) >= 2:
-            left_sym, right_sym = syms_list[0], syms_list[1]
-            st.markdown("### Pair analytics (Spread & Z-score)")
-            spread, zscore, adf_res = compute_pair_metrics(left_sym, right_sym, window=50)
-            
-            p_col1, p_col2 = st.columns(2)
-            with p_col1:
-                if not spread.empty:
-                    st.markdown("Spread")
-                    st.line_chart(spread.tail(400))
-                else:
-                    st.info("Not enough pair data for spread chart.")
-            with p_col2:
-                if not zscore.empty:
-                    st.markdown("Z-score")
-                    st.line_chart(zscore.tail(400))
+        if get_cascade(sym).last_ts_ms is None:
+            return {"info": "No ticks yet for " + sym}
+        ohlcv = get_bars(sym)
+    if ohlcv is None or ohlcv.empty:
+        return {"info": "Not enough data to render candles."}
+
+    MAX_CANDLES = 500
+    if paused or bar_kind:
+        # event bars: evenly spaced, rebuilt from the shared builder's cached frame
+        with PROFILER.section("chart.build"):
+            fig_candle, fig_vol = ohlcv_to_plotly(ohlcv, max_bars=MAX_CANDLES, sequential=bool(bar_kind))
+    else:
+        # cached figure per symbol/timeframe, only appended bars are folded in
+        chart_key = ("candles", sym, timeframe_label)
+        if chart_key not in st.session_state.charts:
+            st.session_state.charts[chart_key] = LiveChart(kind="candles", max_points=MAX_CANDLES)
+        with PROFILER.section("chart.build"):
+            fig_candle, fig_vol = st.session_state.charts[chart_key].update(ohlcv)
+    view = {"candle": fig_candle, "vol": fig_vol, "book": None, "ladder": None, "imbalance": None, "compare": [],
+            "profile": build_profile_view(feed, sym) if show_profile and feed is not None else None}
+
+    book = feed.books.get(sym) if feed else None
+    if book:
+        n_lv = min(len(book['bids']), len(book['asks']))
+        view["book"] = book
+        view["ladder"] = pd.DataFrame({
+            "bid_qty": [q for _, q in book['bids'][:n_lv]], "bid": [p for p, _ in book['bids'][:n_lv]],
+            "ask": [p for p, _ in book['asks'][:n_lv]], "ask_qty": [q for _, q in book['asks'][:n_lv]],
+        })
+        bf = feed.book_frame(sym)
+        if not bf.empty:
+            fig = line_figure(bf["imbalance"], 600, fig=st.session_state.charts.get(("imbalance", sym)), height=220)
+            st.session_state.charts[("imbalance", sym)] = fig
+            view["imbalance"] = fig
+
+    # side-by-side timeframes come straight from the cached cascade levels
+    for tf_label in compare_tfs:
+        fig_cmp, _ = ohlcv_to_plotly(feed.read(lambda: feed.cascade(sym).get(tf_map[tf_label])), max_bars=150)
+        if fig_cmp:
+            fig_cmp.update_layout(height=260, xaxis_rangeslider_visible=False)
+        view["compare"].append((tf_label, fig_cmp))
+    return view
+
+def draw_candles_view(v):
+    if "info" in v:
+        st.info(v["info"])
+        return
+    if v["profile"] is not None:
+        chart_col, profile_col = st.columns([3, 1])
+    else:
+        chart_col, profile_col = st.container(), None
+    with chart_col:
+        if v["candle"]:
+            show_chart(v["candle"])
+        if v["vol"]:
+            show_chart(v["vol"])
+    if profile_col is not None:
+        with profile_col:
+            draw_profile_view(v["profile"])
+
+    book = v["book"]
+    if book:
+        st.markdown("Order book")
+        b_cols = st.columns(4)
+        b_cols[0].metric("Mid", f"{book['mid']:.2f}")
+        b_cols[1].metric("Microprice", f"{book['microprice']:.2f}")
+        b_cols[2].metric("Imbalance (top 10)", f"{book['imbalance']:+.3f}")
+        b_cols[3].metric("Spread (bps)", f"{book['spread_bps']:.2f}")
+        ladder_col, bm_col = st.columns([1, 2])
+        with ladder_col:
+            st.dataframe(v["ladder"], hide_index=True, use_container_width=True)
+        with bm_col:
+            if v["imbalance"]:
+                show_chart(v["imbalance"])
+
+    if v["compare"]:
+        cmp_cols = st.columns(len(v["compare"]))
+        for col, (tf_label, fig_cmp) in zip(cmp_cols, v["compare"]):
+            with col:
+                st.markdown(tf_label)
+                if fig_cmp:
+                    show_chart(fig_cmp)
                 else:
-                    st.info("Not enough pair data for zscore chart.")
-        else:
-            st.info("Add a second symbol to see pair analytics")
+                    st.info("No bars yet.")
+
+@st.fragment(run_every=CANDLES_REFRESH_S)
+@PROFILER.timed_run("fragment:candles")
+def candles_panel(sym: str, slot):
+    """Candles, order book and comparison timeframes for one symbol."""
+    drain_queue()
+    feed = current_feed()
+    paused = st.session_state.display_paused
+    book_mark = feed.book_seq if feed and sym in feed.books else 0
+    stale = panel_stale(("candles", sym), [] if paused else [sym], None if paused else book_mark)
+    view = panel_view(("candles", sym), stale, lambda: build_candles_view(feed, sym, paused))
+    with slot.container():
+        draw_candles_view(view)
+
+def build_pair_view(left_sym: str, right_sym: str):
+    spread, zscore, adf_res = compute_pair_metrics(left_sym, right_sym, window=50)
+    MAX_LINE_POINTS = 600
+    view = {"spread": None, "zscore": None}
+    for name, s in (("spread", spread), ("zscore", zscore)):
+        if not s.empty:
+            fig = line_figure(s, MAX_LINE_POINTS, fig=st.session_state.charts.get(name))
+            st.session_state.charts[name] = view[name] = fig
+    return view
+
+@st.fragment(run_every=STATS_REFRESH_S)
+@PROFILER.timed_run("fragment:pair")
+def pair_panel(left_sym: str, right_sym: str, slot):
+    """Spread and z-score charts for the first two symbols."""
+    drain_queue()
+    stale = panel_stale(("pair", left_sym, right_sym), [] if st.session_state.display_paused else [left_sym, right_sym])
+    view = panel_view(("pair", left_sym, right_sym), stale, lambda: build_pair_view(left_sym, right_sym))
+    with slot.container():
+        p_col1, p_col2 = st.columns(2)
+        with p_col1:
+            if view["spread"]:
+                st.markdown("Spread")
+                show_chart(view["spread"])
+            else:
+                st.info("Not enough pair data for spread chart.")
+        with p_col2:
+            if view["zscore"]:
+                st.markdown("Z-score")
+                show_chart(view["zscore"])
+            else:
+                st.info("Not enough pair data for zscore chart.")
 
-    # Scrolling ticker (full width under charts)
-    st.markdown("---")
-    st.markdown("### Alert Ticker")
-    # Build ticker text from last 10 alert events
+def render_ticker():
+    # Build ticker text from last 20 alert events
     ticker_items = []
     for evt in st.session_state.alert_events[-20:]:
         short = f"{evt.get('metric')} {evt.get('symbol') or ''} {evt.get('value'):.4f}"
         ticker_items.append(short)
     ticker_text = "  |  ".join(ticker_items) if ticker_items else "(no alerts)"
-    
-    # CSS Marquee
-    st.markdown("""
-    <style>
-    @keyframes marquee {
-        0%   { transform: translate(100%, 0); }
-        100% { transform: translate(-100%, 0); }
-    }
-    .marquee-container {
-        width: 100%;
-        overflow: hidden;
-        white-space: nowrap;
-        background: #0b1220;
-        border-radius: 6px;
-        padding: 8px;
-        color: #e6eef8;
-        font-family: monospace;
-    }
-    .marquee-content {
-        display: inline-block;
-        padding-left: 100%;
-        animation: marquee 15s linear infinite;
-    }
-    .marquee-content:hover {
-        animation-play-state: paused;
-    }
-    </style>
-    """, unsafe_allow_html=True)
-
     st.markdown(f"""
     <div class="marquee-container">
         <div class="marquee-content">{ticker_text}</div>
     </div>
     """, unsafe_allow_html=True)
 
-elif page == "Statistics":
-    st.subheader("Live Statistics")
-    
+@st.fragment(run_every=STATS_REFRESH_S)
+@PROFILER.timed_run("fragment:stats")
+def stats_panel(slot):
+    """System, last-tick and pair statistics; the pair metrics underneath are memoized per feed version."""
+    drain_queue()
+    with slot.container():
+        render_stats()
+
+def render_stats():
     # Row 1: System Stats
     st.markdown("#### System")
     sys_c1, sys_c2, sys_c3 = st.columns(3)
-    sys_c1.metric("Buffered Ticks", f"{len(st.session_state.buffer)}")
+    feed = current_feed()
+    sys_c1.metric("Buffered Ticks", f"{feed.buffer.count() if feed else 0}")
     sys_c2.metric("Total Alerts", f"{len(st.session_state.alert_events)}")
-    sys_c3.metric("DB Status", "Connected" if st.session_state.ingestor else "Idle")
+    sys_c3.metric("DB Status", "Connected" if feed and feed.is_running() else "Idle")
+    st.caption(f"Shared feeds: {hub.stats()}")
+    if feed and hasattr(feed.ingestor, "coalesce_stats"):
+        cs = feed.ingestor.coalesce_stats()
+        if cs["mode"] != "off":
+            st.caption(f"Trade aggregation ({cs['mode']}): {cs['trades']} trades -> {cs['ticks']} ticks, ratio {cs['ratio']:.2f}x")
+    if feed and hasattr(feed.ingestor, "storage_writer_stats") and feed.ingestor.storage_writer_stats():
+        ws = feed.ingestor.storage_writer_stats()
+        st.caption("Storage shards: " + ", ".join(f"#{i} {w['written']} rows ({w['queued']} queued)" for i, w in enumerate(ws)))
+    if feed and hasattr(feed.ingestor, "reorder_stats"):
+        rs = feed.ingestor.reorder_stats()
+        st.caption(f"Reorder ({rs['delay_ms']} ms): {rs['held']} held, {rs['duplicates']} duplicates, "
+                   f"{rs['late']} late (bars amended), {rs['dropped']} dropped as too late")
+
+    st.markdown("---")
+
+    # Realized volatility, O(1) trackers on the shared cascades
+    st.markdown(f"#### Realized Volatility (annualized, {timeframe_label} bars, window {vol_window})")
+    vol_rows = []
+    for sym in [s.strip().upper() for s in symbols.split(",") if s.strip()]:
+        if feed is None:
+            break
+        n_bars, vols = get_vol(sym, vol_window)
+        vol_rows.append(dict({"symbol": sym, "bars": n_bars}, **vols))
+    if vol_rows:
+        st.dataframe(pd.DataFrame(vol_rows).set_index("symbol").style.format({e: "{:.2%}" for e in VOL_ESTIMATORS}, na_rep="warming up"),
+                     use_container_width=True)
+    else:
+        st.info("Start the ingestor to track realized volatility.")
 
     st.markdown("---")
     
     # Row 2: Last Tick Details
     st.markdown("#### Latest Market Data")
-    if st.session_state.buffer:
-        last = st.session_state.buffer[-1]
+    if feed and feed.buffer.last:
+        last = feed.buffer.last
         t_price = float(last.get('price', 0))
         t_size = float(last.get('size', 0))
         t_sym = last.get('symbol', 'N/A')
@@ -505,9 +877,13 @@ elif page == "Statistics":
         last_spread = float(spread.iloc[-1]) if not spread.empty else None
         last_z = float(zscore.iloc[-1]) if not zscore.empty else None
         
-        pa_c1, pa_c2 = st.columns(2)
+        beta_s, hl_s = compute_pair_dynamics(left_sym, right_sym)
+        beta_s, hl_s = beta_s.dropna(), hl_s.dropna()
+        pa_c1, pa_c2, pa_c3, pa_c4 = st.columns(4)
         pa_c1.metric(f"Spread ({left_sym}-{right_sym})", f"{last_spread:.6f}" if last_spread is not None else "N/A")
-        pa_c2.metric("Z-Score (50-period)", f"{last_z:.4f}" if last_z is not None and not math.isnan(last_z) else "N/A", 
+        pa_c3.metric(f"Rolling beta ({hedge_window})", f"{beta_s.iloc[-1]:.4f}" if not beta_s.empty else "N/A")
+        pa_c4.metric("OU half-life (s)", f"{hl_s.iloc[-1]:.1f}" if not hl_s.empty else "N/A")
+        pa_c2.metric(f"Z-Score ({zscore_mode}, 50)", f"{last_z:.4f}" if last_z is not None and not math.isnan(last_z) else "N/A", 
                      delta="Overbought" if last_z and last_z > 2 else ("Oversold" if last_z and last_z < -2 else "Neutral"))
         
         if adf_res:
@@ -536,9 +912,7 @@ elif page == "Statistics":
     else:
         st.warning(f"Add a second symbol to view pair analytics. Current: {syms_list}")
 
-elif page == "Alerts":
-    st.subheader("Active Alerts")
-    
+def render_alerts():
     col_feed, col_cards = st.columns([1,1])
     
     with col_feed:
@@ -571,27 +945,197 @@ elif page == "Alerts":
             </div>
             """, unsafe_allow_html=True)
 
+    st.markdown("---")
+    st.subheader("Stored Alert History")
+    ds = dispatcher.stats()
+    n_stored, stored = alert_history()
+    st.caption(f"alerts.db: {n_stored} events ({ds['submitted']} submitted, {ds['stored']} written by this process)")
+    if stored:
+        st.dataframe(pd.DataFrame(list(reversed(stored))), use_container_width=True, height=250)
+    else:
+        st.info("No stored alert events.")
+    if ds["sinks"]:
+        st.markdown("**Delivery**")
+        st.dataframe(pd.DataFrame(ds["sinks"])[["name", "sent", "failed", "dropped", "retries", "queued",
+                                                  "last_latency_ms", "last_error"]], use_container_width=True)
+
+# ---------- Main layout ----------
+# page -> (renderer, slot) for the alert fragment at the end of the script
+alert_view = (None, None)
+
+# Header first (placeholder)
+header_ph = st.empty()
+
+# Horizontal Navigation below header
+page = st.radio("Navigate", ["Graphs", "Statistics", "Alerts", "Backtest", "History", "Profiler"], index=0, horizontal=True, label_visibility="collapsed")
+st.markdown("---")
+
+# Update header with dynamic title
+header_ph.title(f"Realtime Candles — {page}")
+
+if page == "Graphs":
+    st.subheader("Candles & Volume")
+    syms_list = [s.strip().upper() for s in symbols.split(",") if s.strip()]
+    if not syms_list:
+        st.info("Enter symbols and press Start.")
+    else:
+        try:
+            # stateful tabs: switching reruns the script and only the open tab's panel runs
+            tabs = st.tabs(syms_list, key="graph_tab", on_change="rerun")
+        except TypeError:
+            tabs = st.tabs(syms_list)
+        for sym, tab in zip(syms_list, tabs):
+            if getattr(tab, "open", None) is False:
+                continue
+            with tab:
+                candles_panel(sym, st.empty())
+
+        # Pair analytics under charts if >=2 symbols
+        if len(syms_list) >= 2:
+            st.markdown("### Pair analytics (Spread & Z-score)")
+            pair_panel(syms_list[0], syms_list[1], st.empty())
+        else:
+            st.info("Add a second symbol to see pair analytics")
+
+    # Scrolling ticker (full width under charts)
+    st.markdown("---")
+    st.markdown("### Alert Ticker")
+    # CSS Marquee
+    st.markdown("""
+    <style>
+    @keyframes marquee {
+        0%   { transform: translate(100%, 0); }
+        100% { transform: translate(-100%, 0); }
+    }
+    .marquee-container {
+        width: 100%;
+        overflow: hidden;
+        white-space: nowrap;
+        background: #0b1220;
+        border-radius: 6px;
+        padding: 8px;
+        color: #e6eef8;
+        font-family: monospace;
+    }
+    .marquee-content {
+        display: inline-block;
+        padding-left: 100%;
+        animation: marquee 15s linear infinite;
+    }
+    .marquee-content:hover {
+        animation-play-state: paused;
+    }
+    </style>
+    """, unsafe_allow_html=True)
+    alert_view = (render_ticker, st.empty())
+
+elif page == "Statistics":
+    st.subheader("Live Statistics")
+    stats_panel(st.empty())
+
+elif page == "Alerts":
+    st.subheader("Active Alerts")
+    alert_view = (render_alerts, st.empty())
+
+elif page == "Backtest":
+    st.subheader("Alert rule backtest")
+    st.caption("Runs the sidebar rules over stored history (price, spread, zscore, rolling_corr). "
+               "Each metric is computed once over the whole range; a fire is the rule turning true.")
+    bt_syms = [s.strip().upper() for s in symbols.split(",") if s.strip()]
+    b_col1, b_col2, b_col3 = st.columns(3)
+    with b_col1:
+        bt_day = st.date_input("Start date (UTC)", value=(pd.Timestamp.utcnow() - pd.Timedelta(days=1)).date(), key="bt_day")
+        bt_days = st.number_input("Range (days)", min_value=0.01, value=1.0, step=1.0, key="bt_days")
+    with b_col2:
+        bt_source = st.selectbox("Source", ["ticks", "bars_1m"], key="bt_source",
+                                 help="bars_1m covers ranges whose ticks were already rolled up by retention.")
+        bt_grid_s = st.number_input("Grid (s)", min_value=1, value=60 if bt_source == "bars_1m" else 1, step=1, key="bt_grid")
+    with b_col3:
+        st.markdown(f"Hedge: **{hedge_mode}** · rules: **{len(st.session_state.alert_rules)}**")
+        run_bt = st.button("Run backtest", disabled=not st.session_state.alert_rules)
+    if not st.session_state.alert_rules:
+        st.info("Add alert rules in the sidebar first.")
+    if run_bt:
+        start = pd.Timestamp(bt_day)
+        end = start + pd.Timedelta(days=float(bt_days))
+        t0 = time.perf_counter()
+        with st.spinner("Loading history..."):
+            grid = backtest.load_price_grid("ticks.db", bt_syms, start.strftime("%Y-%m-%dT%H:%M:%S"),
+                                            end.strftime("%Y-%m-%dT%H:%M:%S"), grid_ms=int(bt_grid_s) * 1000, source=bt_source)
+        t_load = time.perf_counter() - t0
+        res = backtest.backtest_rules(st.session_state.alert_rules, grid, bt_syms,
+                                      hedge="rolling" if hedge_mode == "Rolling OLS" else "static", hedge_window=hedge_window)
+        res["points"], res["load_secs"] = len(grid), t_load
+        st.session_state.backtest_result = res
+    res = st.session_state.get("backtest_result")
+    if res:
+        st.caption(f"{res['points']} grid points · load {res['load_secs']:.2f}s · evaluate {res['secs']:.2f}s · {len(res['events'])} events")
+        st.dataframe(res["summary"], hide_index=True, use_container_width=True)
+        if res["series"]:
+            labels = {f"{k[0]} {'/'.join(k[1])}" + (f" w={k[2]}" if k[2] else ""): k for k in res["series"]}
+            pick = st.selectbox("Metric series", list(labels))
+            s = res["series"][labels[pick]]
+            if not s.empty:
+                fig = line_figure(s, 1500, method="minmax")
+                for r in st.session_state.alert_rules:
+                    if backtest.rule_symbols(r, bt_syms) == labels[pick][1] and r.get("metric") == labels[pick][0]:
+                        thr = res["thresholds"].get(r.get("id") or r.get("name"))
+                        if thr is not None:
+                            # percentile rules move with the trailing window, so draw the threshold as a line
+                            add_line(fig, thr, 1500, name=f"{r.get('name')} ({alert_engine.threshold_label(r)})", method="minmax")
+                        elif not alert_engine.is_adaptive(r):
+                            fig.add_hline(y=float(r.get("threshold", 0.0)), line_dash="dot", annotation_text=r.get("name"))
+                show_chart(fig)
+        if res["events"]:
+            st.dataframe(pd.DataFrame(res["events"][-500:]), hide_index=True, use_container_width=True)
+            nd = "\n".join(json.dumps(x) for x in res["events"])
+            st.download_button("Download backtest events (NDJSON)", data=nd, file_name=f"backtest_{int(time.time())}.ndjson",
+                               mime="application/x-ndjson")
+
 elif page == "History":
     st.subheader("Data History")
     
     # NDJSON history
     st.markdown("### NDJSON Stream (Recent)")
     NDJSON_LIMIT = 300
-    ndjson_lines = [json.dumps(x) for x in st.session_state.buffer[-NDJSON_LIMIT:]]
+    buffered = current_feed().buffer if current_feed() else None
+    ndjson_lines = [json.dumps(x) for x in buffered.recent(NDJSON_LIMIT)] if buffered else []
     ndjson_preview = "\n".join(ndjson_lines) if ndjson_lines else "(empty)"
     st.text_area("Content", value=ndjson_preview, height=300, key="ndjson_preview")
     
     st.markdown("---")
     st.subheader("Downloads")
-    d_col1, d_col2 = st.columns(2)
-    with d_col1:
-        ndjson = "\n".join(json.dumps(x) for x in st.session_state.buffer)
-        st.download_button("Download ticks NDJSON", data=ndjson, file_name=f"ticks_{int(time.time())}.ndjson", mime="application/x-ndjson")
-    with d_col2:
-        if st.session_state.buffer:
-            df_export = pd.DataFrame(st.session_state.buffer)
-            csv_data = df_export.to_csv(index=False).encode('utf-8')
-            st.download_button("Download ticks CSV", data=csv_data, file_name=f"ticks_{int(time.time())}.csv", mime="text/csv")
+    # exports stream from ticks.db in chunks and compress on the fly, only when requested
+    sym_options = [s.strip().upper() for s in symbols.split(",") if s.strip()]
+    e_col1, e_col2, e_col3 = st.columns(3)
+    with e_col1:
+        exp_syms = st.multiselect("Symbols", sym_options, default=sym_options[:1], key="exp_syms")
+        exp_fmt = st.selectbox("Format", exports.FORMATS, key="exp_fmt")
+    with e_col2:
+        exp_day = st.date_input("Start date (UTC)", value=pd.Timestamp.utcnow().date(), key="exp_day")
+        exp_time = st.time_input("Start time (UTC)", value=pd.Timestamp("00:00").time(), key="exp_time")
+    with e_col3:
+        exp_hours = st.number_input("Range (hours)", min_value=0.25, value=24.0, step=1.0, key="exp_hours")
+        exp_comp = st.selectbox("Compression", exports.available_compressions(), key="exp_comp")
+    if st.button("Prepare export") and exp_syms:
+        start = pd.Timestamp.combine(exp_day, exp_time)
+        end = start + pd.Timedelta(hours=float(exp_hours))
+        prev = st.session_state.get("export_ready")
+        if prev and os.path.exists(prev["path"]):
+            os.remove(prev["path"])
+        with st.spinner("Exporting..."):
+            st.session_state.export_ready = exports.export_ticks(
+                "ticks.db", exp_syms, start.strftime("%Y-%m-%dT%H:%M:%S"), end.strftime("%Y-%m-%dT%H:%M:%S"),
+                fmt=exp_fmt, compression=exp_comp)
+    ready = st.session_state.get("export_ready")
+    # export files are pruned after an hour (exports.EXPORT_MAX_AGE_S) even if the session never returns
+    if ready and ready["bytes"] > exports.MAX_DOWNLOAD_BYTES:
+        st.warning(f"{ready['file_name']} is {ready['bytes'] / 2**20:.0f} MB; downloads are held in memory and capped at "
+                   f"{exports.MAX_DOWNLOAD_BYTES / 2**20:.0f} MB. Narrow the range or use a stronger compression.")
+    elif ready and os.path.exists(ready["path"]):
+        with open(ready["path"], "rb") as f:
+            st.download_button(f"Download {ready['file_name']} ({ready['bytes'] / 1024:.0f} KB)", data=f,
+                               file_name=ready["file_name"], mime=ready["mime"])
 
     st.markdown("---")
     st.subheader("Detailed Alert Log")
@@ -606,6 +1150,53 @@ elif page == "History":
         nd = "\n".join(json.dumps(x) for x in st.session_state.alert_events)
         st.download_button("Download alerts.ndjson", data=nd, file_name=f"alerts_{int(time.time())}.ndjson", mime="application/x-ndjson")
 
+elif page == "Profiler":
+    st.subheader("Rerun profiler")
+    st.caption("Wall and CPU time per named section of each rerun, fragment run and ingest-loop window "
+               "(sections are inclusive, nested ones also count in their parent). Process-wide, off by default.")
+    PROFILER.enabled = st.checkbox("Enable profiling", value=PROFILER.enabled)
+    runs = PROFILER.runs()
+    kinds = sorted({r["kind"] for r in runs})
+    pr_c1, pr_c2, pr_c3 = st.columns(3)
+    prof_kind = pr_c1.selectbox("Run kind", ["all"] + kinds)
+    sel_runs = [r for r in runs if prof_kind == "all" or r["kind"] == prof_kind]
+    pr_c2.metric("Runs recorded", f"{len(sel_runs)}")
+    pr_c3.metric("Mean run (ms)", f"{sum(r['wall_ms'] for r in sel_runs) / len(sel_runs):.1f}" if sel_runs else "N/A")
+    if st.button("Clear history"):
+        PROFILER.clear()
+        st.rerun()
+
+    st.markdown("**Top offenders**")
+    prof_summary = PROFILER.summary(None if prof_kind == "all" else prof_kind)
+    if prof_summary.empty:
+        st.info("No profiled runs yet. Enable profiling and let the dashboard refresh.")
+    else:
+        st.dataframe(prof_summary.head(25).style.format({c: "{:.2f}" for c in prof_summary.columns if c.endswith(("_ms", "_pct"))}),
+                     use_container_width=True)
+        if prof_kind != "all":
+            top_sections = prof_summary["section"].head(5).tolist()
+            st.markdown("**Trend (ms per run)**")
+            st.line_chart(PROFILER.trend(prof_kind, top_sections))
+
+    st.markdown("---")
+    st.markdown("**Sampling profiler**")
+    sp_c1, sp_c2 = st.columns(2)
+    sample_s = sp_c1.number_input("Capture seconds", min_value=1.0, max_value=120.0, value=10.0, step=1.0)
+    sample_ms = sp_c2.number_input("Sample interval (ms)", min_value=1.0, max_value=100.0, value=5.0, step=1.0)
+    if st.button("Start capture"):
+        if not PROFILER.capture(sample_s, sample_ms):
+            st.warning("A capture is already running.")
+    if PROFILER.sampling():
+        st.info("Capture running; rerun the page when it has finished.")
+    if PROFILER.captures:
+        cap = PROFILER.captures[-1]
+        st.caption(f"Last capture: {cap['sweeps']} sweeps over {cap['seconds']:.0f} s, every {cap['interval_ms']:.0f} ms, all threads")
+        st.dataframe(PROFILER.top_functions(cap, 30), use_container_width=True)
+        st.download_button("Download folded stacks", data=PROFILER.folded(cap), file_name=f"profile_{int(cap['ts'])}.folded",
+                           mime="text/plain")
+    st.download_button("Download raw profile (JSON)", data=PROFILER.export(), file_name=f"profile_{int(time.time())}.json",
+                       mime="application/json")
+
 
 
 # show clearing status
@@ -614,10 +1205,12 @@ elif page == "History":
 
 
 # ---------- status ----------
-if st.session_state.ingestor and st.session_state.ingestor.is_running():
-    st.sidebar.success("Ingestor running")
+if st.session_state.attached and current_feed() and current_feed().is_running():
+    st.sidebar.success(f"Ingestor running ({len(current_feed().sessions)} session(s) on this feed)")
 else:
     st.sidebar.info("Ingestor stopped")
+if current_feed() and current_feed().warm_start_info:
+    st.sidebar.caption(current_feed().warm_start_info)
 
 # simple CSV download helper (place in your app where appropriate)
 import glob
@@ -629,6 +1222,16 @@ if os.path.isdir(csv_dir):
         for p in files[-10:]:
             name = os.path.basename(p)
             if st.button(f"Download {name}"):
-                with open(p, "rb") as f:
-                    data = f.read()
-                st.download_button(f"Download {name}", data=data, file_name=name, mime="text/csv")
+                # compressed in chunks; the raw file is never read into memory at once
+                packed = exports.compress_file(p, "gzip")
+                if packed["bytes"] > exports.MAX_DOWNLOAD_BYTES:
+                    st.warning(f"{packed['file_name']} is over {exports.MAX_DOWNLOAD_BYTES / 2**20:.0f} MB compressed; "
+                               "use the range export above instead.")
+                else:
+                    with open(packed["path"], "rb") as f:
+                        st.download_button(f"Download {packed['file_name']}", data=f, file_name=packed["file_name"], mime=packed["mime"])
+                os.remove(packed["path"])
+
+# rule evaluation runs on every page; only the Graphs ticker and the Alerts page draw from it
+alerts_panel(*alert_view)
+PROFILER.end()
@@ -9,8 +9,14 @@ from datetime import datetime
 from typing import List, Dict, Any, Optional
 import random
 import queue
+import heapq
+from collections import deque
 
-from storage import AsyncStorage
+from storage import AsyncStorage, ShardedStorage, StorageMaintenance
+from resampling import iso_to_ms
+from simulator import MarketSimulator
+from profiler import PROFILER
+from orderbook import OrderBook, DepthSync, DemoDepthSource, DEFAULT_SNAPSHOT_URL, fetch_snapshot, book_message
 
 logger = logging.getLogger("binance_ingestor")
 logger.setLevel(logging.INFO)
@@ -21,8 +27,155 @@ ch.setFormatter(formatter)
 logger.addHandler(ch)
 
 
+class TickCoalescer:
+    """
+    Merges consecutive trades of one symbol with the same (ms timestamp, price) into one tick.
+    - size is summed and `trades` counts the merged trades, so volume and trade counts stay exact
+    - a pending tick is emitted when a different (ts, price) arrives or on flush()
+    - trades_in / ticks_out is the compression ratio
+    """
+
+    def __init__(self):
+        self._pending: Dict[str, Dict[str, Any]] = {}
+        self.trades_in = 0
+        self.ticks_out = 0
+
+    def add(self, tick: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Returns the previously pending tick of this symbol when it can no longer grow."""
+        self.trades_in += int(tick.get("trades", 1))
+        sym = tick["symbol"]
+        cur = self._pending.get(sym)
+        if cur is not None and cur["ts"] == tick["ts"] and cur["price"] == tick["price"]:
+            cur["size"] += tick.get("size", 0.0)
+            cur["trades"] += int(tick.get("trades", 1))
+            return None
+        self._pending[sym] = dict(tick, trades=int(tick.get("trades", 1)))
+        if cur is not None:
+            self.ticks_out += 1
+        return cur
+
+    def flush(self) -> List[Dict[str, Any]]:
+        out = list(self._pending.values())
+        self._pending.clear()
+        self.ticks_out += len(out)
+        return out
+
+    def stats(self) -> Dict[str, float]:
+        return {"trades": self.trades_in, "ticks": self.ticks_out,
+                "ratio": self.trades_in / self.ticks_out if self.ticks_out else 1.0}
+
+
+DEFAULT_WS_BASE = "wss://fstream.binance.com/ws"
+
+
+class ReorderBuffer:
+    """
+    Bounded per-symbol reorder stage keyed on (exchange ts, trade id).
+    - ticks are held until the watermark (newest ts seen - delay_ms) passes them, or for at most
+      delay_ms of wall time, then released in (ts, id) order; delay_ms=0 only dedupes
+    - duplicate trade ids (reconnect replays, overlapping sockets) are dropped
+    - a tick older than what was already released is passed on at once with "late": True when it is
+      within allowed_lateness_ms (bar builders amend the bar it belongs to), otherwise dropped
+    """
+
+    def __init__(self, delay_ms: int = 250, allowed_lateness_ms: int = 60000, max_held: int = 100000, max_ids: int = 100000):
+        self.delay_ms = int(delay_ms)
+        self.allowed_lateness_ms = int(allowed_lateness_ms)
+        self.max_held = max_held
+        self.max_ids = max_ids
+        self._heaps: Dict[str, list] = {}
+        self._max_ts: Dict[str, int] = {}
+        self._released_ts: Dict[str, int] = {}
+        self._ids: Dict[str, set] = {}
+        self._id_order: Dict[str, deque] = {}
+        self._seq = 0
+        self.received = 0
+        self.released = 0
+        self.duplicates = 0
+        self.late = 0
+        self.dropped = 0
+
+    def _seen(self, sym: str, tid) -> bool:
+        ids = self._ids.get(sym)
+        if ids is None:
+            ids = self._ids[sym] = set()
+            self._id_order[sym] = deque()
+        if tid in ids:
+            return True
+        ids.add(tid)
+        order = self._id_order[sym]
+        order.append(tid)
+        if len(order) > self.max_ids:
+            ids.discard(order.popleft())
+        return False
+
+    def add(self, tick: Dict[str, Any], ts_ms: int, now: Optional[float] = None) -> List[Dict[str, Any]]:
+        """Returns the ticks that can be released now (usually zero or one, in order)."""
+        self.received += 1
+        sym = tick["symbol"]
+        tid = tick.get("id")
+        if tid is not None and self._seen(sym, tid):
+            self.duplicates += 1
+            return []
+        rel = self._released_ts.get(sym)
+        if rel is not None and ts_ms < rel:
+            if rel - ts_ms > self.allowed_lateness_ms:
+                self.dropped += 1
+                return []
+            self.late += 1
+            self.released += 1
+            return [dict(tick, late=True)]
+        now = time.monotonic() if now is None else now
+        heap = self._heaps.get(sym)
+        if heap is None:
+            heap = self._heaps[sym] = []
+        self._seq += 1
+        heapq.heappush(heap, (ts_ms, tid if tid is not None else 0, self._seq, now, tick))
+        if ts_ms > self._max_ts.get(sym, ts_ms - 1):
+            self._max_ts[sym] = ts_ms
+        return self._release(sym, now)
+
+    def _release(self, sym: str, now: float, force: bool = False) -> List[Dict[str, Any]]:
+        heap = self._heaps.get(sym)
+        out = []
+        if not heap:
+            return out
+        watermark = self._max_ts[sym] - self.delay_ms
+        max_wait = self.delay_ms / 1000.0
+        while heap and (force or heap[0][0] <= watermark or now - heap[0][3] >= max_wait or len(heap) > self.max_held):
+            ts_ms, _, _, _, tick = heapq.heappop(heap)
+            if ts_ms > self._released_ts.get(sym, ts_ms - 1):
+                self._released_ts[sym] = ts_ms
+            out.append(tick)
+        self.released += len(out)
+        return out
+
+    def release_due(self, now: Optional[float] = None) -> List[Dict[str, Any]]:
+        """Wall-clock release, so a quiet symbol is not held back waiting for a newer tick."""
+        now = time.monotonic() if now is None else now
+        out = []
+        for sym in list(self._heaps):
+            out.extend(self._release(sym, now))
+        return out
+
+    def flush(self) -> List[Dict[str, Any]]:
+        out = []
+        for sym in list(self._heaps):
+            out.extend(self._release(sym, 0.0, force=True))
+        return out
+
+    def stats(self) -> Dict[str, int]:
+        return {"delay_ms": self.delay_ms, "received": self.received, "released": self.released,
+                "held": sum(len(h) for h in self._heaps.values()), "duplicates": self.duplicates,
+                "late": self.late, "dropped": self.dropped}
+
+
 class BinanceIngestor:
-    def __init__(self, symbols: List[str], out_queue: "queue.Queue[Dict[str,Any]]", db_path: Optional[str] = None, csv_dir: Optional[str] = "csv_data", reconnect_secs: float = 3.0):
+    def __init__(self, symbols: List[str], out_queue: "queue.Queue[Dict[str,Any]]", db_path: Optional[str] = None, csv_dir: Optional[str] = "csv_data", reconnect_secs: float = 3.0,
+                 retention_s: Optional[float] = None, retention_overrides: Optional[Dict[str, Optional[float]]] = None,
+                 depth: bool = False, snapshot_url: str = DEFAULT_SNAPSHOT_URL, book_top_n: int = 10, book_publish_ms: int = 250,
+                 coalesce: str = "off", coalesce_flush_ms: int = 25, reorder_ms: int = 250, allowed_lateness_ms: int = 60000,
+                 ws_base_url: str = DEFAULT_WS_BASE, sim: Optional[Dict[str, Any]] = None, storage_shards: int = 1):
         self.symbols = [s.lower() for s in symbols]
         self.out_queue = out_queue
         self.reconnect_secs = reconnect_secs
@@ -30,11 +183,39 @@ class BinanceIngestor:
         self._thread: Optional[threading.Thread] = None
         self.running = False
         # pass csv_dir so storage writes CSVs where we want
-        self._storage = AsyncStorage(db_path or "ticks.db", csv_dir=csv_dir)
+        if storage_shards > 1:
+            # K files, one writer thread each; symbols hashed across them
+            self._storage = ShardedStorage(db_path or "ticks.db", shards=storage_shards, csv_dir=csv_dir,
+                                           retention_s=retention_s, retention_overrides=retention_overrides)
+        else:
+            maintenance = None
+            if retention_s or retention_overrides:
+                maintenance = StorageMaintenance(db_path or "ticks.db", retention_s=retention_s, retention_overrides=retention_overrides)
+            self._storage = AsyncStorage(db_path or "ticks.db", csv_dir=csv_dir, maintenance=maintenance)
         self._demo_mode = False
         self._loop: Optional[asyncio.AbstractEventLoop] = None
         self._ws_tasks: List[asyncio.Task] = []
         self._log_lines: List[str] = []
+        # L2 books are maintained here at full depth-update rate; only throttled
+        # metric snapshots ({"type": "book", ...}) go to out_queue
+        self.depth = depth
+        self.snapshot_url = snapshot_url
+        self.book_publish_ms = book_publish_ms
+        self.books: Dict[str, OrderBook] = {s.upper(): OrderBook(s, top_n=book_top_n) for s in self.symbols} if depth else {}
+        self.depth_syncs: Dict[str, DepthSync] = {k: DepthSync(b) for k, b in self.books.items()}
+        self._book_published: Dict[str, float] = {}
+        # "off": one tick per trade; "merge": TickCoalescer on @trade; "aggtrade": subscribe to @aggTrade
+        self.coalesce = coalesce
+        self.coalesce_flush_ms = coalesce_flush_ms
+        self._coalescer = TickCoalescer()
+        # watermark reorder + trade-id dedupe in front of coalescing, storage and out_queue
+        self._reorder = ReorderBuffer(reorder_ms, allowed_lateness_ms)
+        # ws_base_url may point at a local simulator.py server; `sim` configures the
+        # in-process demo source (MarketSimulator kwargs: rate, arrivals, seed, ...)
+        self.ws_base_url = ws_base_url.rstrip("/")
+        self._sim_kwargs = dict(sim or {})
+        self._sim_kwargs.setdefault("rate", 10.0 * len(self.symbols))
+        self.simulator: Optional[MarketSimulator] = None
 
     def is_running(self) -> bool:
         return bool(self.running)
@@ -91,9 +272,16 @@ class BinanceIngestor:
         for s in self.symbols:
             t = asyncio.create_task(self._run_symbol_loop(s))
             self._ws_tasks.append(t)
+            if self.depth:
+                self._ws_tasks.append(asyncio.create_task(self._run_depth_loop(s)))
+
+        if self.coalesce == "merge":
+            self._ws_tasks.append(asyncio.create_task(self._coalesce_flusher()))
+        if self._reorder.delay_ms > 0:
+            self._ws_tasks.append(asyncio.create_task(self._reorder_flusher()))
 
         if self._demo_mode:
-            self._ws_tasks.append(asyncio.create_task(self._demo_injector(0.1)))
+            self._start_demo_tasks()
 
         try:
             while not self._stop_event.is_set():
@@ -111,7 +299,8 @@ class BinanceIngestor:
             self._log("Async main exiting")
 
     async def _run_symbol_loop(self, symbol: str):
-        url = f"wss://fstream.binance.com/ws/{symbol}@trade"
+        stream = "aggTrade" if self.coalesce == "aggtrade" else "trade"
+        url = f"{self.ws_base_url}/{symbol}@{stream}"
         backoff = self.reconnect_secs
         while not self._stop_event.is_set() and not self._demo_mode:
             try:
@@ -122,13 +311,14 @@ class BinanceIngestor:
                     async for message in ws:
                         if self._stop_event.is_set():
                             break
-                        try:
-                            j = json.loads(message)
-                        except Exception:
-                            continue
-                        tick = self._normalize(j)
+                        with PROFILER.section("ws.parse"):
+                            try:
+                                j = json.loads(message)
+                            except Exception:
+                                continue
+                            tick = self._normalize(j)
                         if tick:
-                            await self._handle_tick(tick)
+                            await self._ingest(tick)
             except asyncio.CancelledError:
                 self._log(f"Symbol task cancelled {symbol}")
                 break
@@ -139,6 +329,118 @@ class BinanceIngestor:
                 continue
         self._log(f"Exiting ws loop for {symbol}")
 
+    async def _ingest(self, tick: Dict[str, Any]):
+        try:
+            ts_ms = iso_to_ms(tick["ts"])
+        except Exception:
+            return
+        with PROFILER.section("ingest.reorder"):
+            released = self._reorder.add(tick, ts_ms)
+        for t in released:
+            await self._emit(t)
+
+    async def _reorder_flusher(self):
+        interval = max(0.01, self._reorder.delay_ms / 4000.0)
+        while not self._stop_event.is_set():
+            await asyncio.sleep(interval)
+            for tick in self._reorder.release_due():
+                await self._emit(tick)
+
+    def reorder_stats(self) -> Dict[str, int]:
+        return self._reorder.stats()
+
+    async def _emit(self, tick: Dict[str, Any]):
+        if self.coalesce == "merge":
+            tick = self._coalescer.add(tick)
+            if tick is None:
+                return
+        elif self.coalesce == "aggtrade":
+            self._coalescer.trades_in += tick.get("trades", 1)
+            self._coalescer.ticks_out += 1
+        await self._handle_tick(tick)
+
+    async def _coalesce_flusher(self):
+        """Bounds the extra latency of a pending merged tick to ~coalesce_flush_ms."""
+        while not self._stop_event.is_set():
+            await asyncio.sleep(self.coalesce_flush_ms / 1000.0)
+            for tick in self._coalescer.flush():
+                await self._handle_tick(tick)
+
+    def coalesce_stats(self) -> Dict[str, float]:
+        return dict(self._coalescer.stats(), mode=self.coalesce)
+
+    async def _run_depth_loop(self, symbol: str):
+        url = f"{self.ws_base_url}/{symbol}@depth@100ms"
+        sync = self.depth_syncs[symbol.upper()]
+        backoff = self.reconnect_secs
+        while not self._stop_event.is_set() and not self._demo_mode:
+            snapshot_task: Optional[asyncio.Task] = None
+            try:
+                self._log(f"Connecting depth {symbol} -> {url}")
+                async with websockets.connect(url, ping_interval=20, ping_timeout=10) as ws:
+                    backoff = self.reconnect_secs
+                    # a fresh connection always starts from a new snapshot
+                    sync.synced = False
+                    async for message in ws:
+                        if self._stop_event.is_set():
+                            break
+                        try:
+                            j = json.loads(message)
+                        except Exception:
+                            continue
+                        sync.on_event(j.get("data", j))
+                        if sync.needs_snapshot and snapshot_task is None:
+                            snapshot_task = asyncio.create_task(asyncio.to_thread(fetch_snapshot, symbol, self.snapshot_url))
+                        if snapshot_task is not None and snapshot_task.done():
+                            try:
+                                sync.on_snapshot(snapshot_task.result())
+                            except Exception as e:
+                                self._log(f"Depth snapshot error {symbol}: {e}")
+                            snapshot_task = None
+                        self._publish_book(sync.book)
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                self._log(f"Depth WS error {symbol}: {e}")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 1.5, 30.0)
+            finally:
+                if snapshot_task is not None:
+                    snapshot_task.cancel()
+        self._log(f"Exiting depth loop for {symbol}")
+
+    async def _demo_depth(self, symbol: str, interval_secs: float = 0.01):
+        """Depth diffs from a local stand-in, through the same buffer/snapshot/sequence checks."""
+        base = 90000 if symbol.lower().startswith("btc") else (3000 if symbol.lower().startswith("eth") else 100)
+        src = DemoDepthSource(symbol, base)
+        sync = self.depth_syncs[symbol.upper()]
+        sync.synced = False
+        n = 0
+        while not self._stop_event.is_set() and self._demo_mode:
+            sync.on_event(src.next_event(int(time.time() * 1000)))
+            n += 1
+            if sync.needs_snapshot and n % 5 == 0:
+                sync.on_snapshot(src.snapshot())
+            self._publish_book(sync.book)
+            await asyncio.sleep(interval_secs)
+
+    def _publish_book(self, book: OrderBook):
+        now = time.monotonic()
+        if (now - self._book_published.get(book.symbol, 0.0)) * 1000 < self.book_publish_ms:
+            return
+        msg = book_message(book)
+        if msg is None:
+            return
+        self._book_published[book.symbol] = now
+        try:
+            self.out_queue.put_nowait(msg)
+        except queue.Full:
+            pass
+
+    def book_stats(self) -> Dict[str, Dict[str, Any]]:
+        return {sym: {"levels": len(b.bids) + len(b.asks), "updates": b.updates, "resyncs": self.depth_syncs[sym].resyncs,
+                      "synced": self.depth_syncs[sym].synced} for sym, b in self.books.items()}
+
     def _normalize(self, msg: Dict[str, Any]) -> Optional[Dict[str, Any]]:
         try:
             ts_ms = int(msg.get("E", msg.get("T", time.time() * 1000)))
@@ -162,44 +464,70 @@ class BinanceIngestor:
                     except Exception:
                         continue
             iso_ts = datetime.utcfromtimestamp(ts_ms / 1000.0).isoformat() + "Z"
-            return {"symbol": symbol.upper(), "ts": iso_ts, "price": price_f, "size": size_f}
+            # aggTrade messages cover trade ids f..l
+            trades = int(msg["l"]) - int(msg["f"]) + 1 if "f" in msg and "l" in msg else 1
+            tick = {"symbol": symbol.upper(), "ts": iso_ts, "price": price_f, "size": size_f, "trades": trades}
+            # trade id (@trade "t", @aggTrade "a") for dedupe across reconnects
+            tid = msg.get("t", msg.get("a"))
+            if tid is not None:
+                tick["id"] = int(tid)
+            return tick
         except Exception:
             return None
 
     async def _handle_tick(self, tick: Dict[str, Any]):
-        try:
-            self.out_queue.put_nowait(tick)
-        except queue.Full:
+        with PROFILER.section("ingest.publish"):
             try:
-                self.out_queue.put(tick, timeout=0.1)
-            except Exception:
-                pass
+                self.out_queue.put_nowait(tick)
+            except queue.Full:
+                try:
+                    self.out_queue.put(tick, timeout=0.1)
+                except Exception:
+                    pass
         try:
-            await self._storage.enqueue_tick(tick)
+            # synchronous put: a section around an await would be charged for other coroutines' CPU
+            with PROFILER.section("storage.enqueue"):
+                self._storage.enqueue_tick_nowait(tick)
         except Exception as e:
             self._log(f"Storage enqueue error: {e}")
 
     async def _demo_injector(self, interval_secs: float = 0.2):
+        """Demo source: MarketSimulator trades (cointegrated pairs, Poisson/bursty arrivals) in real time."""
         self._log("Demo injector started")
+        if self.simulator is None:
+            self.simulator = MarketSimulator(self.symbols, **self._sim_kwargs)
+        step_ms = min(int(interval_secs * 1000), 50)
+        t = int(time.time() * 1000)
         while not self._stop_event.is_set() and self._demo_mode:
-            for sym in self.symbols:
-                now_ms = int(time.time() * 1000)
-                base = 90000 if sym.lower().startswith("btc") else (3000 if sym.lower().startswith("eth") else 100)
-                price = base + (random.random() - 0.5) * (base * 0.002)
-                tick = {"symbol": sym.upper(), "ts": datetime.utcfromtimestamp(now_ms / 1000.0).isoformat() + "Z", "price": round(price, 2), "size": round(random.random() * 0.5, 6)}
-                try:
-                    await self._handle_tick(tick)
-                except Exception:
-                    pass
-            await asyncio.sleep(interval_secs)
+            await asyncio.sleep(step_ms / 1000.0)
+            now = int(time.time() * 1000)
+            # fixed-length steps: the RNG draws (and so a seeded run) do not depend on scheduler timing
+            while t + step_ms <= now:
+                with PROFILER.section("sim.generate"):
+                    batch = self.simulator.generate(t, step_ms)
+                    ticks = self.simulator.ticks(batch)
+                t += step_ms
+                for tick in ticks:
+                    try:
+                        await self._ingest(tick)
+                    except Exception:
+                        pass
         self._log("Demo injector exiting")
 
+    def _start_demo_tasks(self):
+        # runs on the ingest loop: trades, plus depth diffs when depth is on
+        self._ws_tasks.append(asyncio.create_task(self._demo_injector(0.1)))
+        if self.depth:
+            for s in self.symbols:
+                self._ws_tasks.append(asyncio.create_task(self._demo_depth(s)))
+
     def enable_demo_mode(self, enable: bool = True):
+        was = self._demo_mode
         self._demo_mode = bool(enable)
         self._log(f"Demo mode set to {self._demo_mode}")
-        if self._demo_mode and self._loop and self._loop.is_running():
+        if self._demo_mode and not was and self._loop and self._loop.is_running():
             try:
-                asyncio.run_coroutine_threadsafe(self._demo_injector(0.15), self._loop)
+                self._loop.call_soon_threadsafe(self._start_demo_tasks)
             except Exception:
                 pass
 
@@ -231,6 +559,13 @@ class BinanceIngestor:
         self._ws_tasks.clear()
         self._demo_mode = False
         await asyncio.sleep(0.05)
+        try:
+            for tick in self._reorder.flush():
+                await self._emit(tick)
+            for tick in self._coalescer.flush():
+                await self._handle_tick(tick)
+        except Exception as e:
+            self._log(f"Shutdown flush error: {e}")
         try:
             await self._storage.close()
         except Exception as e:
@@ -243,3 +578,16 @@ class BinanceIngestor:
 
     def get_logs(self, last_n: int = 200):
         return self._log_lines[-last_n:]
+
+    def fetch_recent(self, limit: int = 500, symbol: Optional[str] = None, timeout: float = 5.0) -> List[Dict[str, Any]]:
+        """Thread-safe read through the storage read pool (runs on the ingestor loop, never on the writer connection)."""
+        if not (self._loop and self._loop.is_running()):
+            return []
+        fut = asyncio.run_coroutine_threadsafe(self._storage.fetch_recent(limit, symbol), self._loop)
+        return fut.result(timeout=timeout)
+
+    def storage_query_stats(self) -> Dict[str, Dict[str, float]]:
+        return self._storage.query_stats()
+
+    def storage_writer_stats(self) -> List[Dict[str, Any]]:
+        return self._storage.writer_stats() if isinstance(self._storage, ShardedStorage) else []
@@ -0,0 +1,165 @@
+# backtest.py
+import os
+import sqlite3
+import time
+from typing import Dict, Any, Optional, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+from storage import tick_db_paths
+from alerts import match_rule_array, make_event, is_adaptive, threshold_label
+from analytics import ols_hedge_ratio, rolling_spread, rolling_zscore, rolling_correlation
+
+BACKTEST_METRICS = ("price", "spread", "zscore", "rolling_corr")
+
+# the (symbol, ts) index returns rows in order; gridding happens in numpy, which beats GROUP BY in SQLite
+_TICKS_SQL = "SELECT ts, price FROM ticks WHERE symbol = ? AND ts >= ? AND ts < ? ORDER BY ts"
+_BARS_SQL = "SELECT ts, close FROM bars_1m WHERE symbol = ? AND ts >= ? AND ts < ? ORDER BY ts"
+
+
+def load_price_grid(db_path: str, symbols: List[str], start_ts: str, end_ts: str, grid_ms: int = 1000,
+                    source: str = "ticks", chunk_rows: int = 200000) -> pd.DataFrame:
+    """
+    Last-price grid (one column per symbol, forward-filled) over [start_ts, end_ts) from storage.
+    source='ticks' reads raw ticks, 'bars_1m' reads rolled-up minute closes (for ranges past tick retention).
+    A sharded store is read file by file and each symbol's rows are re-sorted by ts.
+    """
+    paths = tick_db_paths(db_path)
+    if not paths:
+        return pd.DataFrame()
+    conns = [sqlite3.connect(f"file:{os.path.abspath(p)}?mode=ro", uri=True, timeout=5.0) for p in paths]
+    cols: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+    try:
+        for sym in symbols:
+            sql, params = (_BARS_SQL, (sym.upper(), start_ts[:16], end_ts[:16])) if source == "bars_1m" \
+                else (_TICKS_SQL, (sym.upper(), start_ts, end_ts))
+            ts_parts, px_parts = [], []
+            for conn in conns:
+                cur = conn.execute(sql, params)
+                while True:
+                    rows = cur.fetchmany(chunk_rows)
+                    if not rows:
+                        break
+                    ts_parts.append(np.array([r[0].rstrip("Z") for r in rows], dtype="datetime64[ms]").astype(np.int64))
+                    px_parts.append(np.array([r[1] for r in rows], dtype=float))
+            if ts_parts:
+                ts, px = np.concatenate(ts_parts), np.concatenate(px_parts)
+                if len(conns) > 1:
+                    order = np.argsort(ts, kind="stable")
+                    ts, px = ts[order], px[order]
+                cols[sym.upper()] = (ts, px)
+    finally:
+        for conn in conns:
+            conn.close()
+    if not cols:
+        return pd.DataFrame()
+    lo = min(ts[0] for ts, _ in cols.values())
+    hi = max(ts[-1] for ts, _ in cols.values())
+    grid = np.arange(lo - lo % grid_ms, hi + 1, grid_ms, dtype=np.int64)
+    data = {}
+    for sym, (ts, px) in cols.items():
+        # as-of: last observation at or before the end of each grid interval
+        pos = np.searchsorted(ts, grid + grid_ms - 1, side="right") - 1
+        data[sym] = np.where(pos >= 0, px[np.maximum(pos, 0)], np.nan)
+    return pd.DataFrame(data, index=pd.to_datetime(grid, unit="ms", utc=True))
+
+
+def rule_symbols(rule: Dict[str, Any], default_symbols: List[str]) -> Tuple[str, ...]:
+    """Symbols a rule reads, resolved like the live metrics provider ('A:B' or the first two symbols)."""
+    sym_field = (rule.get("symbol") or "").strip().upper()
+    if rule.get("metric") == "price":
+        return (sym_field or (default_symbols[0] if default_symbols else ""),)
+    if ":" in sym_field:
+        return tuple(p.strip().upper() for p in sym_field.split(":", 1))
+    return tuple(default_symbols[:2])
+
+
+def metric_series(metric: str, grid: pd.DataFrame, syms: Tuple[str, ...], window: int = 50,
+                  hedge: str = "static", hedge_window: int = 300, cache: Optional[Dict[Tuple, Any]] = None) -> pd.Series:
+    """One metric over the whole grid (vectorised / rolling, O(n)).
+    `cache` shares the aligned pair and its spread between metrics of the same symbols."""
+    cache = {} if cache is None else cache
+    if metric == "price":
+        return grid[syms[0]].dropna() if syms and syms[0] in grid else pd.Series(dtype=float)
+    if len(syms) < 2 or syms[0] not in grid or syms[1] not in grid:
+        return pd.Series(dtype=float)
+    if ("pair", syms) not in cache:
+        cache[("pair", syms)] = grid[[syms[0], syms[1]]].dropna()
+    pair = cache[("pair", syms)]
+    y, x = pair.iloc[:, 0], pair.iloc[:, 1]
+    if metric == "rolling_corr":
+        return rolling_correlation(y, x, window=window)
+    if ("spread", syms) not in cache:
+        if hedge == "rolling":
+            cache[("spread", syms)] = rolling_spread(y, x, hedge_window).dropna()
+        else:
+            cache[("spread", syms)] = y - ols_hedge_ratio(y, x) * x
+    spread = cache[("spread", syms)]
+    if metric == "spread":
+        return spread
+    if metric == "zscore":
+        return rolling_zscore(spread, window)
+    raise ValueError(f"metric {metric} cannot be backtested")
+
+
+def backtest_rules(rules: List[Dict[str, Any]], grid: pd.DataFrame, default_symbols: List[str],
+                   hedge: str = "static", hedge_window: int = 300, max_events: int = 100000) -> Dict[str, Any]:
+    """
+    Evaluate a rule set over a historical grid.
+    Each distinct (metric, symbols, window) series is computed once; every rule is then a single
+    vectorised comparison. A rule "fires" when its condition turns true (rising edge), which is what
+    a live rule re-evaluated every refresh would report as a new alert.
+    Returns {"summary": DataFrame, "events": [event dicts], "series": {key: Series},
+    "thresholds": {rule id: Series}, "secs": float}; "thresholds" holds the per-point threshold of each
+    percentile rule, aligned with its metric series.
+    """
+    t0 = time.perf_counter()
+    series: Dict[Tuple, pd.Series] = {}
+    shared: Dict[Tuple, Any] = {}
+    thresholds: Dict[str, pd.Series] = {}
+    summary, events = [], []
+    for r in rules:
+        metric = r.get("metric")
+        row = {"rule": r.get("name"), "metric": metric, "symbol": r.get("symbol"), "side": r.get("side"),
+               "threshold": threshold_label(r), "fires": 0, "active_pct": 0.0,
+               "first_fire": None, "last_fire": None, "note": ""}
+        if metric not in BACKTEST_METRICS:
+            row["note"] = "not backtestable"
+            summary.append(row)
+            continue
+        syms = rule_symbols(r, default_symbols)
+        key = (metric, syms, int(r.get("window", 50)) if metric in ("zscore", "rolling_corr") else 0)
+        if key not in series:
+            series[key] = metric_series(metric, grid, syms, key[2] or 50, hedge, hedge_window, cache=shared)
+        s = series[key]
+        if s.empty:
+            row["note"] = "no data"
+            summary.append(row)
+            continue
+        vals = s.values.astype(float)
+        thr = None
+        if is_adaptive(r):
+            # percentile of the trailing lookback, the batch equivalent of the live sketch
+            thr = s.rolling(pd.Timedelta(hours=float(r.get("lookback_h", 6.0))), min_periods=100) \
+                .quantile(float(r.get("quantile", 99.0)) / 100.0).values
+            thresholds[r.get("id") or r.get("name")] = pd.Series(thr, index=s.index)
+        hit = match_rule_array(r, vals, thr)
+        edges = np.flatnonzero(hit & ~np.r_[False, hit[:-1]])
+        row["fires"] = int(len(edges))
+        row["active_pct"] = float(hit.mean() * 100.0)
+        if len(edges):
+            fire_ts = s.index[edges]
+            row["first_fire"], row["last_fire"] = fire_ts[0], fire_ts[-1]
+            room = max_events - len(events)
+            if room > 0:
+                iso = np.datetime_as_string(fire_ts[:room].tz_convert(None).values.astype("datetime64[ms]"), unit="ms")
+                if thr is None:
+                    events.extend(make_event(r, v, t + "Z") for v, t in zip(vals[edges[:room]], iso))
+                else:
+                    events.extend(make_event(dict(r, threshold=th), v, t + "Z")
+                                  for v, th, t in zip(vals[edges[:room]], thr[edges[:room]], iso))
+        summary.append(row)
+    events.sort(key=lambda e: e["ts"])
+    return {"summary": pd.DataFrame(summary), "events": events, "series": series,
+            "thresholds": thresholds, "secs": time.perf_counter() - t0}
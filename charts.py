@@ -0,0 +1,280 @@
+# charts.py
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+from typing import Optional, List
+
+DEFAULT_MAX_POINTS = 1000
+CANDLE_COLORS = dict(increasing_line_color='#26a69a', decreasing_line_color='#ef5350')
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    """Largest-Triangle-Three-Buckets: indices of the n_out points that best keep the visual shape."""
+    n = len(y)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    # bucket edges for the n - 2 interior points
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    out = np.empty(n_out, dtype=np.int64)
+    out[0] = 0
+    out[-1] = n - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        # average of the next bucket (or the last point)
+        nlo, nhi = hi, edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[nlo:nhi].mean() if nhi > nlo else x[-1]
+        avg_y = y[nlo:nhi].mean() if nhi > nlo else y[-1]
+        area = np.abs((x[a] - avg_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y - y[a]))
+        a = lo + int(np.nanargmax(area)) if len(area) and not np.all(np.isnan(area)) else lo
+        out[i + 1] = a
+    return out
+
+
+def minmax_indices(y: np.ndarray, n_out: int) -> np.ndarray:
+    """Keep the min and max of each of n_out // 2 equal buckets (preserves spikes)."""
+    n = len(y)
+    if n_out >= n or n_out < 2:
+        return np.arange(n)
+    n_buckets = max(1, n_out // 2)
+    y = np.asarray(y, dtype=float)
+    edges = np.linspace(0, n, n_buckets + 1).astype(int)
+    keep = []
+    for lo, hi in zip(edges[:-1], edges[1:]):
+        if hi <= lo:
+            continue
+        seg = y[lo:hi]
+        if np.all(np.isnan(seg)):
+            keep.append(lo)
+            continue
+        i_min, i_max = lo + int(np.nanargmin(seg)), lo + int(np.nanargmax(seg))
+        keep.extend(sorted({i_min, i_max}))
+    return np.asarray(keep, dtype=np.int64)
+
+
+def decimate_series(s: pd.Series, max_points: int = DEFAULT_MAX_POINTS, method: str = "lttb") -> pd.Series:
+    """Downsample a series to at most max_points using LTTB or min/max decimation."""
+    s = s.dropna()
+    if len(s) <= max_points:
+        return s
+    if method == "minmax":
+        idx = minmax_indices(s.values, max_points)
+    else:
+        x = s.index.asi8 if isinstance(s.index, pd.DatetimeIndex) else np.arange(len(s))
+        idx = lttb_indices(x, s.values, max_points)
+    return s.iloc[idx]
+
+
+def decimate_ohlcv(ohlcv: pd.DataFrame, max_bars: int = DEFAULT_MAX_POINTS) -> pd.DataFrame:
+    """Merge consecutive bars into coarser ones so at most max_bars remain (OHLC stays exact)."""
+    if ohlcv is None or len(ohlcv) <= max_bars:
+        return ohlcv
+    group = int(np.ceil(len(ohlcv) / max_bars))
+    # align groups to the end so the newest bar is never split
+    keys = (np.arange(len(ohlcv))[::-1] // group)[::-1]
+    g = ohlcv.groupby(keys, sort=False)
+    out = pd.DataFrame({
+        "open": g["open"].first().values,
+        "high": g["high"].max().values,
+        "low": g["low"].min().values,
+        "close": g["close"].last().values,
+        "volume": g["volume"].sum().values,
+    }, index=ohlcv.index[np.unique(keys, return_index=True)[1]])
+    return out.sort_index()
+
+
+def line_figure(s: pd.Series, max_points: int = DEFAULT_MAX_POINTS, fig: Optional[go.Figure] = None,
+                height: int = 260, method: str = "lttb") -> go.Figure:
+    """Decimated WebGL line chart; reuses `fig` (updating its trace in place) when given."""
+    d = decimate_series(s, max_points, method=method)
+    if fig is None or len(fig.data) != 1:
+        fig = go.Figure(data=[go.Scattergl(mode="lines")])
+        fig.update_layout(margin=dict(l=10, r=10, t=10, b=20), height=height, template='plotly_dark')
+    with fig.batch_update():
+        fig.data[0].x = d.index
+        fig.data[0].y = d.values
+    return fig
+
+
+def add_line(fig: go.Figure, s: pd.Series, max_points: int = DEFAULT_MAX_POINTS, name: Optional[str] = None,
+             method: str = "lttb", dash: str = "dot") -> go.Figure:
+    """Overlay a decimated series (e.g. a moving threshold) on an existing line chart."""
+    d = decimate_series(s.dropna(), max_points, method=method)
+    fig.add_trace(go.Scattergl(x=d.index, y=d.values, mode="lines", name=name, line=dict(dash=dash)))
+    return fig
+
+def volume_profile_figure(profile: pd.DataFrame, levels: Optional[dict] = None, value_area: Optional[tuple] = None,
+                          fig: Optional[go.Figure] = None, height: int = 420) -> go.Figure:
+    """Horizontal volume-at-price bars with named price lines (e.g. VWAPs, POC); reuses `fig` when given."""
+    levels = {k: v for k, v in (levels or {}).items() if v == v}
+    if fig is None:
+        fig = go.Figure(data=[go.Bar(orientation="h", marker_color="#5b8def", name="volume")])
+        fig.update_layout(margin=dict(l=10, r=10, t=20, b=20), height=height, template='plotly_dark',
+                          showlegend=False, bargap=0.05)
+    if value_area and value_area[0] == value_area[0]:
+        inside = (profile["price"] >= value_area[0]) & (profile["price"] <= value_area[1])
+        colors = np.where(inside, "#5b8def", "#34495e")
+    else:
+        colors = "#5b8def"
+    with fig.batch_update():
+        fig.data[0].x = profile["volume"].values
+        fig.data[0].y = profile["price"].values
+        fig.data[0].marker.color = colors
+        if len(profile) > 1:
+            fig.data[0].width = float(np.diff(profile["price"].values).min()) * 0.95
+        shapes, notes = [], []
+        for (name, price), color in zip(levels.items(), ("#f1c40f", "#e67e22", "#ecf0f1", "#2ecc71")):
+            shapes.append(dict(type="line", xref="paper", x0=0, x1=1, yref="y", y0=price, y1=price,
+                               line=dict(color=color, width=1, dash="dot")))
+            notes.append(dict(xref="paper", x=1, yref="y", y=price, text=name, showarrow=False,
+                              xanchor="right", yanchor="bottom", font=dict(color=color, size=10)))
+        fig.layout.shapes = shapes
+        fig.layout.annotations = notes
+    return fig
+
+
+class _OHLCBuckets:
+    """
+    Fixed-budget streaming decimator.
+    Each closed bucket holds `width` consecutive input points folded into
+    [x, open, high, low, close, volume, x_low, x_high]. When the bucket count
+    exceeds the budget, neighbouring buckets are merged pairwise and `width`
+    doubles, so memory and output size stay bounded at any history length.
+    The newest (open) bucket keeps its raw points so the last point can be revised.
+    """
+
+    def __init__(self, max_buckets: int):
+        self.max_buckets = max(4, int(max_buckets))
+        self.width = 1
+        self.closed: List[list] = []
+        self.pending: List[tuple] = []  # raw (x, o, h, l, c, v) of the open bucket
+        self.last_x = None
+
+    @staticmethod
+    def _fold(points):
+        lows = [p[3] for p in points]
+        highs = [p[2] for p in points]
+        i_lo, i_hi = int(np.argmin(lows)), int(np.argmax(highs))
+        return [points[0][0], points[0][1], highs[i_hi], lows[i_lo], points[-1][4],
+                sum(p[5] for p in points), points[i_lo][0], points[i_hi][0]]
+
+    @staticmethod
+    def _merge(a, b):
+        lo = a if a[3] <= b[3] else b
+        hi = a if a[2] >= b[2] else b
+        return [a[0], a[1], hi[2], lo[3], b[4], a[5] + b[5], lo[6], hi[7]]
+
+    def push(self, x, o, h, l, c, v):
+        if self.last_x is not None and x == self.last_x and self.pending:
+            self.pending[-1] = (x, o, h, l, c, v)
+            return
+        self.last_x = x
+        self.pending.append((x, o, h, l, c, v))
+        if len(self.pending) > self.width:
+            self.closed.append(self._fold(self.pending[:-1]))
+            self.pending = self.pending[-1:]
+        if len(self.closed) > self.max_buckets:
+            pairs = len(self.closed) // 2 * 2
+            merged = [self._merge(self.closed[i], self.closed[i + 1]) for i in range(0, pairs, 2)]
+            self.closed = merged + self.closed[pairs:]
+            self.width *= 2
+
+    def buckets(self) -> List[list]:
+        if self.pending:
+            return self.closed + [self._fold(self.pending)]
+        return list(self.closed)
+
+
+class LiveChart:
+    """
+    Cached, incrementally updated chart.
+    - update(data) consumes only rows newer than the last refresh (the last row may be revised)
+    - history is decimated into a bounded number of buckets (min/max for lines, exact OHLC for candles)
+    - the plotly figure is built once and its traces are updated in place
+    kind: 'line' (pd.Series) or 'candles' (OHLCV DataFrame, returns (fig, fig_vol))
+    """
+
+    def __init__(self, kind: str = "line", max_points: int = DEFAULT_MAX_POINTS, height: int = 420):
+        self.kind = kind
+        self.height = height
+        # line buckets emit two points each (min and max)
+        self._buckets = _OHLCBuckets(max_points // 2 if kind == "line" else max_points)
+        self._max_points = max_points
+        self._fig: Optional[go.Figure] = None
+        self._fig_vol: Optional[go.Figure] = None
+
+    def reset(self):
+        self._buckets = _OHLCBuckets(self._max_points // 2 if self.kind == "line" else self._max_points)
+
+    def _consume(self, data):
+        if data is None or len(data) == 0:
+            return
+        idx = data.index
+        last = self._buckets.last_x
+        if last is not None and idx[-1] < last:
+            # source was cleared/restarted
+            self.reset()
+            last = None
+        start = 0 if last is None else int(idx.searchsorted(last, side="left"))
+        tail = data.iloc[start:]
+        if self.kind == "line":
+            for x, y in zip(tail.index, tail.values):
+                if y is None or y != y:
+                    continue
+                self._buckets.push(x, y, y, y, y, 0.0)
+        else:
+            cols = [tail[c].values for c in ("open", "high", "low", "close")]
+            vols = tail["volume"].values if "volume" in tail.columns else np.zeros(len(tail))
+            for i, x in enumerate(tail.index):
+                self._buckets.push(x, cols[0][i], cols[1][i], cols[2][i], cols[3][i], float(vols[i]))
+
+    def update(self, data):
+        self._consume(data)
+        b = self._buckets.buckets()
+        if self.kind == "line":
+            return self._render_line(b)
+        return self._render_candles(b)
+
+    def _render_line(self, b):
+        xs, ys = [], []
+        for bk in b:
+            # emit min and max in time order
+            if bk[6] == bk[7]:
+                pts = [(bk[6], bk[3])]
+            elif bk[6] < bk[7]:
+                pts = [(bk[6], bk[3]), (bk[7], bk[2])]
+            else:
+                pts = [(bk[7], bk[2]), (bk[6], bk[3])]
+            for px, py in pts:
+                xs.append(px)
+                ys.append(py)
+        if self._fig is None:
+            self._fig = go.Figure(data=[go.Scattergl(mode="lines")])
+            self._fig.update_layout(margin=dict(l=10, r=10, t=10, b=20), height=self.height, template='plotly_dark')
+        with self._fig.batch_update():
+            self._fig.data[0].x = xs
+            self._fig.data[0].y = ys
+        return self._fig
+
+    def _render_candles(self, b):
+        if not b:
+            return None, None
+        x = [bk[0] for bk in b]
+        if self._fig is None:
+            self._fig = go.Figure(data=[go.Candlestick(**CANDLE_COLORS)])
+            self._fig.update_layout(margin=dict(l=10, r=10, t=20, b=20), height=self.height, template='plotly_dark')
+            self._fig_vol = go.Figure(data=[go.Bar()])
+            self._fig_vol.update_layout(margin=dict(l=10, r=10, t=10, b=20), height=120, template='plotly_dark')
+        with self._fig.batch_update():
+            c = self._fig.data[0]
+            c.x = x
+            c.open = [bk[1] for bk in b]
+            c.high = [bk[2] for bk in b]
+            c.low = [bk[3] for bk in b]
+            c.close = [bk[4] for bk in b]
+        with self._fig_vol.batch_update():
+            self._fig_vol.data[0].x = x
+            self._fig_vol.data[0].y = [bk[5] for bk in b]
+        return self._fig, self._fig_vol
@@ -0,0 +1,214 @@
+# exports.py
+import csv
+import gzip
+import io
+import json
+import os
+import sqlite3
+import tempfile
+import time
+import heapq
+from typing import Dict, Any, Optional, List, Iterator, Tuple
+
+from storage import tick_db_paths
+
+try:
+    import zstandard  # optional: zstd compression
+except ImportError:
+    zstandard = None
+
+EXPORT_COLUMNS = ["symbol", "ts", "price", "size"]
+COMPRESSIONS = ["gzip", "zstd", "none"]
+FORMATS = ["csv", "ndjson"]
+# export temp files live in one directory that prune_exports() keeps bounded: a session can end
+# without ever replacing or deleting its last export
+EXPORT_DIR = os.path.join(tempfile.gettempdir(), "gemscap_exports")
+EXPORT_MAX_AGE_S = 3600.0
+EXPORT_MAX_BYTES = 2 << 30
+# st.download_button holds the whole file in server memory while the session keeps it
+MAX_DOWNLOAD_BYTES = 200 << 20
+
+
+def available_compressions() -> List[str]:
+    return [c for c in COMPRESSIONS if c != "zstd" or zstandard is not None]
+
+
+def iter_tick_rows(db_path: str, symbols: List[str], start_ts: str, end_ts: str,
+                   chunk_rows: int = 20000) -> Iterator[List[Tuple]]:
+    """
+    Yield (symbol, ts, price, size) rows in chunks, per symbol in time order; never loads the range at once.
+    With a sharded store every file is read and the cursors are merged by ts.
+    """
+    paths = tick_db_paths(db_path)
+    if not paths:
+        return
+    conns = [sqlite3.connect(f"file:{os.path.abspath(p)}?mode=ro", uri=True, timeout=5.0) for p in paths]
+    try:
+        for sym in symbols:
+            cursors = [c.execute(
+                "SELECT symbol, ts, price, size FROM ticks WHERE symbol = ? AND ts >= ? AND ts < ? ORDER BY ts",
+                (sym.upper(), start_ts, end_ts)) for c in conns]
+            rows_iter = cursors[0] if len(cursors) == 1 else heapq.merge(*cursors, key=lambda r: r[1])
+            chunk = []
+            for row in rows_iter:
+                chunk.append(row)
+                if len(chunk) >= chunk_rows:
+                    yield chunk
+                    chunk = []
+            if chunk:
+                yield chunk
+    finally:
+        for c in conns:
+            c.close()
+
+
+def _encode_rows(rows: List[Tuple], fmt: str, header: bool) -> bytes:
+    if fmt == "ndjson":
+        return "".join(json.dumps(dict(zip(EXPORT_COLUMNS, r))) + "\n" for r in rows).encode("utf-8")
+    buf = io.StringIO()
+    w = csv.writer(buf)
+    if header:
+        w.writerow(EXPORT_COLUMNS)
+    w.writerows(rows)
+    return buf.getvalue().encode("utf-8")
+
+
+class _Compressor:
+    """Incremental compressor with a common compress()/flush() interface."""
+
+    def __init__(self, compression: str, level: Optional[int] = None):
+        self.compression = compression
+        if compression == "gzip":
+            self._buf = io.BytesIO()
+            self._gz = gzip.GzipFile(fileobj=self._buf, mode="wb", compresslevel=level or 6)
+        elif compression == "zstd":
+            if zstandard is None:
+                raise RuntimeError("zstd export needs the 'zstandard' package")
+            self._z = zstandard.ZstdCompressor(level=level or 3).compressobj()
+        elif compression not in ("none", None):
+            raise ValueError(f"unknown compression {compression}")
+
+    def _drain(self) -> bytes:
+        out = self._buf.getvalue()
+        self._buf.seek(0)
+        self._buf.truncate()
+        return out
+
+    def compress(self, data: bytes) -> bytes:
+        if self.compression == "gzip":
+            self._gz.write(data)
+            return self._drain()
+        if self.compression == "zstd":
+            return self._z.compress(data)
+        return data
+
+    def flush(self) -> bytes:
+        if self.compression == "gzip":
+            self._gz.close()
+            return self._drain()
+        if self.compression == "zstd":
+            return self._z.flush()
+        return b""
+
+
+def stream_ticks(db_path: str, symbols: List[str], start_ts: str, end_ts: str, fmt: str = "csv",
+                 compression: str = "gzip", chunk_rows: int = 20000) -> Iterator[bytes]:
+    """Generator of (compressed) export bytes; memory stays bounded by one chunk."""
+    comp = _Compressor(compression)
+    header = True
+    for rows in iter_tick_rows(db_path, symbols, start_ts, end_ts, chunk_rows):
+        out = comp.compress(_encode_rows(rows, fmt, header))
+        header = False
+        if out:
+            yield out
+    if header and fmt == "csv":
+        # empty range: still a valid CSV
+        out = comp.compress(_encode_rows([], fmt, True))
+        if out:
+            yield out
+    tail = comp.flush()
+    if tail:
+        yield tail
+
+
+def export_file_name(symbols: List[str], start_ts: str, fmt: str, compression: str) -> str:
+    ext = {"gzip": ".gz", "zstd": ".zst"}.get(compression, "")
+    day = start_ts[:10].replace("-", "")
+    return f"ticks_{'-'.join(s.upper() for s in symbols)}_{day}.{fmt}{ext}"
+
+
+def prune_exports(out_dir: Optional[str] = None, max_age_s: float = EXPORT_MAX_AGE_S,
+                  max_bytes: int = EXPORT_MAX_BYTES) -> int:
+    """Delete export files older than max_age_s, then the oldest until the rest fit in max_bytes; returns the count."""
+    out_dir = out_dir or EXPORT_DIR
+    try:
+        entries = []
+        for name in os.listdir(out_dir):
+            if name.startswith("export_"):
+                p = os.path.join(out_dir, name)
+                st = os.stat(p)
+                entries.append((st.st_mtime, st.st_size, p))
+    except OSError:
+        return 0
+    entries.sort()
+    now = time.time()
+    total = sum(e[1] for e in entries)
+    removed = 0
+    for mtime, size, p in entries:
+        if now - mtime <= max_age_s and total <= max_bytes:
+            break
+        try:
+            os.remove(p)
+            removed += 1
+        except OSError:
+            pass
+        total -= size
+    return removed
+
+
+def _export_dir(out_dir: Optional[str]) -> str:
+    out_dir = out_dir or EXPORT_DIR
+    os.makedirs(out_dir, exist_ok=True)
+    prune_exports(out_dir)
+    return out_dir
+
+
+def export_ticks(db_path: str, symbols: List[str], start_ts: str, end_ts: str, fmt: str = "csv",
+                 compression: str = "gzip", out_dir: Optional[str] = None) -> Dict[str, Any]:
+    """Stream an export into a temp file; returns {'path', 'file_name', 'bytes', 'mime'}."""
+    name = export_file_name(symbols, start_ts, fmt, compression)
+    fd, path = tempfile.mkstemp(prefix="export_", suffix="_" + name, dir=_export_dir(out_dir))
+    size = 0
+    with os.fdopen(fd, "wb") as f:
+        for chunk in stream_ticks(db_path, symbols, start_ts, end_ts, fmt, compression):
+            f.write(chunk)
+            size += len(chunk)
+    return {"path": path, "file_name": name, "bytes": size, "mime": export_mime(fmt, compression)}
+
+
+def compress_file(path: str, compression: str = "gzip", chunk_bytes: int = 1 << 20, out_dir: Optional[str] = None) -> Dict[str, Any]:
+    """Compress an existing file in chunks (e.g. the csv_data files) into a temp file."""
+    comp = _Compressor(compression)
+    name = os.path.basename(path) + {"gzip": ".gz", "zstd": ".zst"}.get(compression, "")
+    fd, out_path = tempfile.mkstemp(prefix="export_", suffix="_" + name, dir=_export_dir(out_dir))
+    size = 0
+    with open(path, "rb") as src, os.fdopen(fd, "wb") as dst:
+        while True:
+            block = src.read(chunk_bytes)
+            if not block:
+                break
+            out = comp.compress(block)
+            dst.write(out)
+            size += len(out)
+        tail = comp.flush()
+        dst.write(tail)
+        size += len(tail)
+    return {"path": out_path, "file_name": name, "bytes": size, "mime": export_mime("csv", compression)}
+
+
+def export_mime(fmt: str, compression: str) -> str:
+    if compression == "gzip":
+        return "application/gzip"
+    if compression == "zstd":
+        return "application/zstd"
+    return "application/x-ndjson" if fmt == "ndjson" else "text/csv"
@@ -0,0 +1,377 @@
+# feed.py
+import argparse
+import asyncio
+import json
+import logging
+import os
+import queue
+import threading
+from datetime import datetime
+from typing import Dict, Any, Optional, List, Set, Tuple
+
+from resampling import BarCascade, TIMEFRAMES_MS, iso_to_ms
+from profiler import PROFILER
+
+logger = logging.getLogger("tick_feed")
+
+DEFAULT_ADDRESS = "127.0.0.1:8765"
+
+
+def parse_address(address: str) -> Tuple[str, Any]:
+    """'unix:/path/to.sock' -> ('unix', path); 'host:port' -> ('tcp', (host, port))."""
+    if address.startswith("unix:"):
+        return "unix", address[len("unix:"):]
+    host, _, port = address.rpartition(":")
+    return "tcp", (host or "127.0.0.1", int(port))
+
+
+class _Subscriber:
+    def __init__(self, writer: asyncio.StreamWriter, maxsize: int):
+        self.writer = writer
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self.symbols: Set[str] = set()   # empty = all symbols
+        self.bars: Set[str] = set()      # bar timeframes wanted, e.g. {"1m"}
+        self.ticks = True
+        self.book = False
+        self.dropped = 0
+        self.drop_streak = 0
+        self.sent = 0
+        self.task: Optional[asyncio.Task] = None
+
+    def wants(self, msg: Dict[str, Any]) -> bool:
+        if self.symbols and msg.get("symbol") not in self.symbols:
+            return False
+        if msg.get("type") == "bar":
+            return msg.get("tf") in self.bars
+        if msg.get("type") == "book":
+            return self.book
+        return self.ticks
+
+
+class FeedServer:
+    """
+    Local pub/sub fan-out of normalized ticks and closed bars (NDJSON over TCP or a Unix socket).
+    Clients send one subscribe line, e.g.
+        {"op": "subscribe", "symbols": ["BTCUSDT"], "bars": ["1m"], "ticks": true, "book": false}
+    and then receive {"type": "tick", ...} / {"type": "bar", "tf": "1m", ...} / {"type": "book", ...} lines.
+    A bar changed by a late tick after it closed is sent again with "amended": true.
+    Slow consumers: each subscriber has a bounded queue; when it is full the oldest
+    message is dropped (and counted). A subscriber that drops more than `max_drops`
+    messages in a row is disconnected so it can't hold memory or stall publishing.
+    """
+
+    def __init__(self, address: str = DEFAULT_ADDRESS, queue_size: int = 10000, max_drops: int = 50000):
+        self.address = address
+        self.queue_size = queue_size
+        self.max_drops = max_drops
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._subs: List[_Subscriber] = []
+        self.published = 0
+
+    async def start(self):
+        kind, target = parse_address(self.address)
+        if kind == "unix":
+            if os.path.exists(target):
+                os.remove(target)
+            self._server = await asyncio.start_unix_server(self._on_client, path=target)
+        else:
+            self._server = await asyncio.start_server(self._on_client, host=target[0], port=target[1])
+        logger.info(f"Feed listening on {self.address}")
+
+    async def close(self):
+        for sub in list(self._subs):
+            self._drop(sub)
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _on_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        sub = _Subscriber(writer, self.queue_size)
+        try:
+            line = await asyncio.wait_for(reader.readline(), timeout=10.0)
+            req = json.loads(line or b"{}")
+            sub.symbols = {s.upper() for s in req.get("symbols") or []}
+            sub.bars = set(req.get("bars") or [])
+            sub.ticks = bool(req.get("ticks", True))
+            sub.book = bool(req.get("book", False))
+        except Exception:
+            writer.close()
+            return
+        self._subs.append(sub)
+        sub.task = asyncio.create_task(self._send_loop(sub))
+        logger.info(f"Subscriber connected symbols={sorted(sub.symbols) or 'ALL'} bars={sorted(sub.bars)}")
+        # block until the client goes away (reads are only used to detect disconnect)
+        try:
+            while await reader.read(1024):
+                pass
+        except Exception:
+            pass
+        self._drop(sub)
+
+    async def _send_loop(self, sub: _Subscriber):
+        try:
+            while True:
+                line = await sub.queue.get()
+                batch = [line]
+                while len(batch) < 500:
+                    try:
+                        batch.append(sub.queue.get_nowait())
+                    except asyncio.QueueEmpty:
+                        break
+                # lines were encoded once in publish(); nothing per-subscriber here but the write
+                sub.writer.write(b"".join(batch))
+                await sub.writer.drain()
+                sub.sent += len(batch)
+                sub.drop_streak = 0
+        except asyncio.CancelledError:
+            pass
+        except Exception:
+            self._drop(sub)
+
+    def _drop(self, sub: _Subscriber):
+        if sub in self._subs:
+            self._subs.remove(sub)
+        if sub.task and not sub.task.done() and sub.task is not asyncio.current_task():
+            sub.task.cancel()
+        try:
+            sub.writer.close()
+        except Exception:
+            pass
+
+    def publish(self, msg: Dict[str, Any]):
+        """Fan a message out to every matching subscriber without ever blocking the publisher.
+        The message is encoded once (on the first match) and the same bytes are queued for every subscriber."""
+        self.published += 1
+        line: Optional[bytes] = None
+        for sub in list(self._subs):
+            if not sub.wants(msg):
+                continue
+            if line is None:
+                line = json.dumps(msg).encode() + b"\n"
+            try:
+                sub.queue.put_nowait(line)
+                continue
+            except asyncio.QueueFull:
+                pass
+            try:
+                sub.queue.get_nowait()
+                sub.queue.put_nowait(line)
+            except Exception:
+                pass
+            sub.dropped += 1
+            sub.drop_streak += 1
+            if sub.drop_streak > self.max_drops:
+                logger.info("Disconnecting slow subscriber")
+                self._drop(sub)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "published": self.published,
+            "subscribers": [{"symbols": sorted(s.symbols), "queued": s.queue.qsize(), "sent": s.sent, "dropped": s.dropped}
+                            for s in self._subs],
+        }
+
+
+class FeedService:
+    """
+    Headless ingestion: one BinanceIngestor + AsyncStorage stack, no Streamlit.
+    Ticks from the ingestor queue are published as-is; closed bars for `bar_timeframes`
+    are published from a per-symbol BarCascade.
+    """
+
+    def __init__(self, symbols: List[str], address: str = DEFAULT_ADDRESS, db_path: str = "ticks.db",
+                 bar_timeframes: Optional[List[str]] = None, demo: bool = False, **ingestor_kwargs):
+        from backend import BinanceIngestor
+        self.q: "queue.Queue[Dict[str,Any]]" = queue.Queue(maxsize=100000)
+        self.ingestor = BinanceIngestor(symbols=symbols, out_queue=self.q, db_path=db_path, **ingestor_kwargs)
+        self.ingestor.enable_demo_mode(demo)
+        self.server = FeedServer(address)
+        self.bar_timeframes = bar_timeframes or ["1s", "1m"]
+        self._cascades: Dict[str, BarCascade] = {}
+        self._stop = threading.Event()
+
+    async def run(self):
+        await self.server.start()
+        self.ingestor.start()
+        try:
+            while not self._stop.is_set():
+                batch = await asyncio.to_thread(self._take_batch)
+                for tick in batch:
+                    self._publish_tick(tick)
+                # let subscriber send loops run between batches
+                await asyncio.sleep(0)
+        finally:
+            self.ingestor.stop()
+            await self.server.close()
+
+    def stop(self):
+        self._stop.set()
+
+    def _take_batch(self, max_items: int = 2000) -> List[Dict[str, Any]]:
+        try:
+            batch = [self.q.get(timeout=0.5)]
+        except queue.Empty:
+            return []
+        while len(batch) < max_items:
+            try:
+                batch.append(self.q.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _publish_tick(self, tick: Dict[str, Any]):
+        if tick.get("type") == "book":
+            self.server.publish(tick)
+            return
+        self.server.publish(dict(tick, type="tick"))
+        sym = tick["symbol"].upper()
+        cascade = self._cascades.get(sym)
+        if cascade is None:
+            cascade = self._cascades[sym] = BarCascade([TIMEFRAMES_MS[tf] for tf in self.bar_timeframes])
+        try:
+            ts_ms = iso_to_ms(tick["ts"])
+            if cascade.last_ts_ms is not None and ts_ms < cascade.last_ts_ms:
+                # late tick: republish the closed bars it changed, flagged as amendments
+                tf_names = {TIMEFRAMES_MS[tf]: tf for tf in self.bar_timeframes}
+                for tf_ms, b in cascade.amend_tick(ts_ms, tick["price"], tick.get("size", 0.0)):
+                    if tf_ms in tf_names:
+                        self._publish_bar(tf_names[tf_ms], sym, b, amended=True)
+                return
+            before = [cascade.last_closed(TIMEFRAMES_MS[tf])[0] for tf in self.bar_timeframes]
+            cascade.add_tick(ts_ms, tick["price"], tick.get("size", 0.0))
+        except Exception:
+            return
+        for tf, v in zip(self.bar_timeframes, before):
+            version, b = cascade.last_closed(TIMEFRAMES_MS[tf])
+            if version != v and b is not None:
+                self._publish_bar(tf, sym, b)
+
+    def _publish_bar(self, tf: str, sym: str, b: list, amended: bool = False):
+        msg = {"type": "bar", "tf": tf, "symbol": sym, "ts": datetime.utcfromtimestamp(b[0] / 1000.0).isoformat() + "Z",
+               "open": b[1], "high": b[2], "low": b[3], "close": b[4], "volume": b[5]}
+        if amended:
+            msg["amended"] = True
+        self.server.publish(msg)
+
+
+class FeedClient:
+    """
+    Subscriber that looks like a BinanceIngestor to the dashboard:
+    ticks from a FeedServer are pushed into `out_queue` (start/stop/is_running/get_logs).
+    Reconnects with backoff if the service restarts.
+    """
+
+    def __init__(self, symbols: List[str], out_queue: "queue.Queue[Dict[str,Any]]", address: str = DEFAULT_ADDRESS,
+                 bars: Optional[List[str]] = None, reconnect_secs: float = 2.0, book: bool = False):
+        self.symbols = [s.upper() for s in symbols]
+        self.out_queue = out_queue
+        self.address = address
+        self.bars = bars or []
+        self.book = book
+        self.reconnect_secs = reconnect_secs
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._log_lines: List[str] = []
+        self.running = False
+        self.received = 0
+
+    def is_running(self) -> bool:
+        return bool(self.running)
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=lambda: asyncio.run(self._main()), daemon=True)
+        self._thread.start()
+        self.running = True
+        self._log(f"Feed client started -> {self.address}")
+
+    def stop(self, wait_seconds: float = 2.0):
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=wait_seconds)
+        self.running = False
+        self._log("Feed client stopped")
+
+    async def _main(self):
+        kind, target = parse_address(self.address)
+        while not self._stop_event.is_set():
+            try:
+                if kind == "unix":
+                    reader, writer = await asyncio.open_unix_connection(target, limit=2 ** 22)
+                else:
+                    reader, writer = await asyncio.open_connection(target[0], target[1], limit=2 ** 22)
+                req = {"op": "subscribe", "symbols": self.symbols, "bars": self.bars, "ticks": True, "book": self.book}
+                writer.write(json.dumps(req).encode() + b"\n")
+                await writer.drain()
+                self._log("Subscribed")
+                while not self._stop_event.is_set():
+                    try:
+                        line = await asyncio.wait_for(reader.readline(), timeout=0.5)
+                    except asyncio.TimeoutError:
+                        continue
+                    if not line:
+                        raise ConnectionError("feed closed")
+                    msg = json.loads(line)
+                    # ticks go to the dashboard in the ingestor's plain tick format
+                    if msg.get("type") == "tick":
+                        del msg["type"]
+                    try:
+                        self.out_queue.put_nowait(msg)
+                        self.received += 1
+                    except queue.Full:
+                        pass
+                writer.close()
+            except Exception as e:
+                self._log(f"Feed connection error: {e}")
+                await asyncio.sleep(self.reconnect_secs)
+        self.running = False
+
+    def _log(self, msg: str):
+        self._log_lines.append(f"{datetime.utcnow().isoformat()} {msg}")
+        logger.info(msg)
+
+    def get_logs(self, last_n: int = 200):
+        return self._log_lines[-last_n:]
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Headless tick ingestion with local pub/sub fan-out")
+    ap.add_argument("--symbols", default="btcusdt,ethusdt")
+    ap.add_argument("--address", default=DEFAULT_ADDRESS, help="host:port or unix:/path/to.sock")
+    ap.add_argument("--db", default="ticks.db")
+    ap.add_argument("--shards", type=int, default=1, help="split storage over K SQLite files with parallel writers")
+    ap.add_argument("--bars", default="1s,1m", help="bar timeframes to publish")
+    ap.add_argument("--demo", action="store_true", help="use the demo tick source instead of Binance")
+    ap.add_argument("--sim-rate", type=float, default=None, help="demo: simulated trades per second across all symbols")
+    ap.add_argument("--sim-arrivals", choices=["poisson", "bursty"], default="poisson")
+    ap.add_argument("--seed", type=int, default=None, help="demo: simulator seed for reproducible runs")
+    ap.add_argument("--ws-base", default=None, help="websocket base URL, e.g. ws://127.0.0.1:9443/ws for simulator.py")
+    ap.add_argument("--coalesce", choices=["off", "merge", "aggtrade"], default="off",
+                    help="merge same-ms/same-price trades, or subscribe to aggTrade instead of trade")
+    ap.add_argument("--reorder-ms", type=int, default=250,
+                    help="watermark delay for reordering / de-duplicating ticks by exchange time and trade id (0 = dedupe only)")
+    ap.add_argument("--depth", action="store_true", help="also maintain L2 books and publish book metrics")
+    ap.add_argument("--snapshot-url", default=None, help="depth snapshot URL template ({symbol}, {limit}), e.g. a local stand-in")
+    ap.add_argument("--profile", default=None, metavar="PATH", help="profile the ingest loop and write the raw profile JSON here on exit")
+    args = ap.parse_args()
+    PROFILER.enabled = bool(args.profile)
+    logging.basicConfig(level=logging.INFO, format="[%(asctime)s] %(levelname)s: %(message)s")
+    svc = FeedService([s.strip() for s in args.symbols.split(",") if s.strip()], address=args.address,
+                      db_path=args.db, bar_timeframes=[b for b in args.bars.split(",") if b], demo=args.demo,
+                      depth=args.depth, coalesce=args.coalesce, reorder_ms=args.reorder_ms, storage_shards=args.shards,
+                      sim={k: v for k, v in (("rate", args.sim_rate), ("arrivals", args.sim_arrivals), ("seed", args.seed)) if v is not None},
+                      **({"ws_base_url": args.ws_base} if args.ws_base else {}), **({"snapshot_url": args.snapshot_url} if args.snapshot_url else {}))
+    try:
+        asyncio.run(svc.run())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if args.profile:
+            PROFILER.export(args.profile)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,414 @@
+# hub.py
+import queue
+import threading
+import time
+from collections import deque
+from typing import Dict, Any, Optional, List, Tuple, Callable
+
+import numpy as np
+import pandas as pd
+
+from backend import BinanceIngestor
+from feed import FeedClient
+from resampling import BarCascade, PairAligner, EventBarBuilder, iso_to_ms
+from storage import load_recent_ticks
+from analytics import WindowedQuantiles, IncrementalVWAP, VolumeProfile
+
+
+class TickBuffer:
+    """
+    Columnar, bounded per-symbol tick store.
+    Each symbol keeps numpy arrays (ts_ms, price, size) of its last `max_ticks` ticks,
+    appended in place (amortised O(1), compacted when the backing arrays fill up).
+    """
+
+    def __init__(self, max_ticks: int = 5000):
+        self.max_ticks = int(max_ticks)
+        self._cols: Dict[str, Dict[str, Any]] = {}
+        self.last: Optional[Dict[str, Any]] = None
+
+    def _col(self, sym: str) -> Dict[str, Any]:
+        c = self._cols.get(sym)
+        if c is None:
+            cap = 2 * self.max_ticks
+            c = self._cols[sym] = {"ts_ms": np.empty(cap, dtype=np.int64), "price": np.empty(cap), "size": np.empty(cap), "n": 0}
+        return c
+
+    def extend(self, sym: str, ts_ms: np.ndarray, price: np.ndarray, size: np.ndarray):
+        sym = sym.upper()
+        ts_ms, price, size = ts_ms[-self.max_ticks:], price[-self.max_ticks:], size[-self.max_ticks:]
+        k = len(ts_ms)
+        if k == 0:
+            return
+        c = self._col(sym)
+        n = c["n"]
+        if n + k > len(c["ts_ms"]):
+            keep = min(n, self.max_ticks - k)
+            for name in ("ts_ms", "price", "size"):
+                c[name][:keep] = c[name][n - keep:n]
+            n = keep
+        c["ts_ms"][n:n + k] = ts_ms
+        c["price"][n:n + k] = price
+        c["size"][n:n + k] = size
+        c["n"] = n + k
+
+    def append(self, tick: Dict[str, Any], ts_ms: int):
+        sym = tick["symbol"].upper()
+        c = self._cols.get(sym)
+        late = c is not None and c["n"] > 0 and ts_ms < c["ts_ms"][c["n"] - 1]
+        self.extend(sym, np.array([ts_ms], dtype=np.int64), np.array([float(tick["price"])]),
+                    np.array([float(tick.get("size") or 0.0)]))
+        if late:
+            # keep columns time-ordered: shift the (short) newer tail right by one
+            c = self._cols[sym]
+            n = c["n"]
+            lo = max(0, n - self.max_ticks)
+            i = lo + int(np.searchsorted(c["ts_ms"][lo:n - 1], ts_ms, side="right"))
+            for name in ("ts_ms", "price", "size"):
+                col = c[name]
+                v = col[n - 1]
+                col[i + 1:n] = col[i:n - 1].copy()
+                col[i] = v
+        else:
+            self.last = tick
+
+    def symbols(self) -> List[str]:
+        return list(self._cols)
+
+    def arrays(self, sym: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        c = self._cols.get(sym.upper())
+        if c is None:
+            e = np.empty(0)
+            return e.astype(np.int64), e, e
+        lo = max(0, c["n"] - self.max_ticks)
+        return c["ts_ms"][lo:c["n"]], c["price"][lo:c["n"]], c["size"][lo:c["n"]]
+
+    def series(self, sym: str) -> pd.Series:
+        ts, px, _ = self.arrays(sym)
+        return pd.Series(px.copy(), index=pd.to_datetime(ts, unit="ms", utc=True), dtype=float)
+
+    def count(self) -> int:
+        return sum(min(c["n"], self.max_ticks) for c in self._cols.values())
+
+    def recent(self, n: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Newest n ticks across symbols as tick dicts, oldest first (n=None: everything buffered)."""
+        parts = []
+        for sym in self._cols:
+            ts, px, sz = self.arrays(sym)
+            if n is not None:
+                ts, px, sz = ts[-n:], px[-n:], sz[-n:]
+            parts.append((ts, px, sz, np.full(len(ts), sym, dtype=object)))
+        if not parts:
+            return []
+        ts = np.concatenate([p[0] for p in parts])
+        order = np.argsort(ts, kind="stable")
+        if n is not None:
+            order = order[-n:]
+        px = np.concatenate([p[1] for p in parts])[order]
+        sz = np.concatenate([p[2] for p in parts])[order]
+        syms = np.concatenate([p[3] for p in parts])[order]
+        iso = np.datetime_as_string(ts[order].astype("datetime64[ms]"), unit="ms")
+        return [{"symbol": s, "ts": t + "Z", "price": float(p), "size": float(z)} for s, t, p, z in zip(syms, iso, px, sz)]
+
+
+class SharedFeed:
+    """
+    One ingestion source for one symbol set, plus everything derived from it:
+    the columnar tick buffer, per-symbol bar cascades and pair aligners.
+    Shared by every session that attaches with the same symbol set; sessions only
+    keep a read cursor (`seq`) and their own view settings.
+    """
+
+    def __init__(self, key: Tuple, symbols: List[str], source: str = "local", address: Optional[str] = None,
+                 demo: bool = False, retention_s: Optional[float] = None, db_path: str = "ticks.db",
+                 max_ticks: int = 5000, min_pump_interval_s: float = 0.2, depth: bool = False, coalesce: str = "off",
+                 reorder_ms: int = 250, ws_base_url: Optional[str] = None, sim: Optional[Dict[str, Any]] = None,
+                 storage_shards: int = 1):
+        self.key = key
+        self.symbols = [s.upper() for s in symbols]
+        self.db_path = db_path
+        self.q: "queue.Queue[Dict[str,Any]]" = queue.Queue()
+        if source == "feed":
+            self.ingestor = FeedClient(symbols=symbols, out_queue=self.q, address=address, book=depth)
+        else:
+            self.ingestor = BinanceIngestor(symbols=symbols, out_queue=self.q, db_path=db_path, retention_s=retention_s,
+                                            depth=depth, coalesce=coalesce, reorder_ms=reorder_ms, sim=sim,
+                                            storage_shards=storage_shards,
+                                            **({"ws_base_url": ws_base_url} if ws_base_url else {}))
+            self.ingestor.enable_demo_mode(demo)
+        self.buffer = TickBuffer(max_ticks)
+        self.cascades: Dict[str, BarCascade] = {}
+        self.aligners: Dict[Tuple, PairAligner] = {}
+        self.event_builders: Dict[Tuple, EventBarBuilder] = {}
+        self.max_event_builders = 16
+        # per-metric time-windowed quantile sketches (adaptive alert thresholds)
+        self.sketches: Dict[Tuple, WindowedQuantiles] = {}
+        self.max_sketches = 32
+        # per-symbol session/rolling VWAP and session volume-at-price profile
+        self.vwaps: Dict[str, IncrementalVWAP] = {}
+        self.profiles: Dict[str, VolumeProfile] = {}
+        # latest book message per symbol + history of (ts_ms, mid, microprice, imbalance, spread_bps)
+        self.books: Dict[str, Dict[str, Any]] = {}
+        self.book_history: Dict[str, deque] = {}
+        self.book_seq = 0
+        self.sessions: Dict[str, float] = {}
+        self.seq = 0
+        self.symbol_seq: Dict[str, int] = {}
+        self.started_at: Optional[float] = None
+        self.warm_start_info: Optional[str] = None
+        self.min_pump_interval_s = min_pump_interval_s
+        self._last_pump = 0.0
+        self._lock = threading.RLock()
+        self._memo: Dict[Tuple, Tuple[Any, Any]] = {}
+
+    # ---- lifecycle ----
+    def start(self, warm_start_minutes: Optional[float] = None):
+        if warm_start_minutes:
+            try:
+                self.warm_start(warm_start_minutes)
+            except Exception as e:
+                self.warm_start_info = f"Warm start failed: {e}"
+        self.ingestor.start()
+        self.started_at = time.time()
+
+    def stop(self, wait_seconds: float = 1.0):
+        self.ingestor.stop(wait_seconds=wait_seconds)
+
+    def is_running(self) -> bool:
+        return self.ingestor.is_running()
+
+    # ---- state ----
+    def cascade(self, sym: str) -> BarCascade:
+        sym = sym.upper()
+        with self._lock:
+            if sym not in self.cascades:
+                self.cascades[sym] = BarCascade()
+            return self.cascades[sym]
+
+    def vwap(self, sym: str) -> IncrementalVWAP:
+        sym = sym.upper()
+        with self._lock:
+            if sym not in self.vwaps:
+                self.vwaps[sym] = IncrementalVWAP()
+            return self.vwaps[sym]
+
+    def profile(self, sym: str) -> VolumeProfile:
+        sym = sym.upper()
+        with self._lock:
+            if sym not in self.profiles:
+                self.profiles[sym] = VolumeProfile()
+            return self.profiles[sym]
+
+    def aligner(self, left: str, right: str, staleness_s: int = 0) -> PairAligner:
+        key = (left.upper(), right.upper(), int(staleness_s))
+        with self._lock:
+            if key not in self.aligners:
+                al = PairAligner(left, right, grid_ms=1000, max_staleness_ms=int(staleness_s) * 1000 or None)
+                # seed once from the buffer; afterwards pump() appends new ticks only
+                tl, pl, _ = self.buffer.arrays(al.left)
+                tr, pr, _ = self.buffer.arrays(al.right)
+                al.load(tl, pl, tr, pr)
+                self.aligners[key] = al
+            return self.aligners[key]
+
+    def event_builder(self, sym: str, kind: str, threshold: float) -> EventBarBuilder:
+        """Tick/volume/dollar/imbalance bars for a symbol; seeded once from the buffer, then fed by pump()."""
+        key = (sym.upper(), kind, float(threshold))
+        with self._lock:
+            if key not in self.event_builders:
+                b = EventBarBuilder(kind, threshold)
+                b.load_ticks(*self.buffer.arrays(sym))
+                self.event_builders[key] = b
+                # every threshold a user tries creates a builder; keep only the newest few
+                while len(self.event_builders) > self.max_event_builders:
+                    del self.event_builders[next(iter(self.event_builders))]
+            return self.event_builders[key]
+
+    def quantiles(self, key: Tuple) -> WindowedQuantiles:
+        """Sliding 24h quantile sketch for a metric series, shared by every session and rule reading it."""
+        with self._lock:
+            if key not in self.sketches:
+                self.sketches[key] = WindowedQuantiles()
+                while len(self.sketches) > self.max_sketches:
+                    del self.sketches[next(iter(self.sketches))]
+            return self.sketches[key]
+
+    def memo(self, key: Tuple, version: Any, fn: Callable[[], Any]) -> Any:
+        """Compute once per version and share the result across sessions.
+        fn() runs under the feed lock: it reads aligners / cascades and may feed the sketches, which
+        pump() on another session's thread would otherwise mutate mid-read."""
+        with self._lock:
+            hit = self._memo.get(key)
+            if hit is not None and hit[0] == version:
+                return hit[1]
+            val = fn()
+            self._memo[key] = (version, val)
+            return val
+
+    def read(self, fn: Callable[[], Any]) -> Any:
+        """Run a read of the shared state (buffer, cascades, builders, sketches, VWAP / profile) under the feed lock."""
+        with self._lock:
+            return fn()
+
+    def pump(self, max_items: int = 20000) -> int:
+        """Drain the ingest queue into the shared state (at most once per min_pump_interval_s)."""
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_pump < self.min_pump_interval_s:
+                return 0
+            self._last_pump = now
+            n = 0
+            while n < max_items:
+                try:
+                    item = self.q.get_nowait()
+                except queue.Empty:
+                    break
+                n += 1
+                try:
+                    ts_ms = iso_to_ms(item['ts'])
+                    sym = item['symbol'].upper()
+                    if item.get('type') == 'book':
+                        self._add_book(sym, ts_ms, item)
+                        continue
+                    # late ticks (item['late']) are inserted in time order by the buffer and amend
+                    # their bars in the cascade; aligners keep last-price semantics and skip them
+                    self.buffer.append(item, ts_ms)
+                    self.cascade(sym).add_tick(ts_ms, item['price'], item.get('size', 0.0))
+                    self.vwap(sym).add_tick(ts_ms, item['price'], item.get('size', 0.0))
+                    self.profile(sym).add_tick(ts_ms, item['price'], item.get('size', 0.0))
+                    for al in self.aligners.values():
+                        if sym in (al.left, al.right):
+                            al.add_tick(sym, ts_ms, item['price'])
+                    for (b_sym, _, _), b in self.event_builders.items():
+                        if b_sym == sym:
+                            b.add_tick(ts_ms, item['price'], item.get('size', 0.0))
+                    self.seq += 1
+                    self.symbol_seq[sym] = self.seq
+                except Exception:
+                    continue
+            return n
+
+    def _add_book(self, sym: str, ts_ms: int, msg: Dict[str, Any]):
+        self.books[sym] = msg
+        hist = self.book_history.get(sym)
+        if hist is None:
+            hist = self.book_history[sym] = deque(maxlen=self.buffer.max_ticks)
+        hist.append((ts_ms, msg['mid'], msg['microprice'], msg['imbalance'], msg['spread_bps']))
+        self.book_seq += 1
+
+    def book_frame(self, sym: str) -> pd.DataFrame:
+        """Book metric history for one symbol (UTC index; mid, microprice, imbalance, spread_bps)."""
+        with self._lock:
+            rows = list(self.book_history.get(sym.upper(), ()))
+        if not rows:
+            return pd.DataFrame(columns=["mid", "microprice", "imbalance", "spread_bps"], dtype=float)
+        a = np.asarray(rows, dtype=float)
+        return pd.DataFrame(a[:, 1:], columns=["mid", "microprice", "imbalance", "spread_bps"],
+                            index=pd.to_datetime(a[:, 0].astype(np.int64), unit="ms", utc=True))
+
+    def changed_since(self, cursor: int, symbols: Optional[List[str]] = None) -> bool:
+        if symbols is None:
+            return self.seq > cursor
+        return any(self.symbol_seq.get(s.upper(), 0) > cursor for s in symbols)
+
+    def warm_start(self, minutes: float):
+        """Seed buffer, bar cascades, VWAP/profile and the first pair grid from the last `minutes` stored per symbol."""
+        t0 = time.perf_counter()
+        data = load_recent_ticks(self.db_path, self.symbols, minutes)
+        with self._lock:
+            for sym, cols in data.items():
+                self.cascade(sym).load_ticks(cols["ts_ms"], cols["price"], cols["size"])
+                self.vwap(sym).add_ticks(cols["ts_ms"], cols["price"], cols["size"])
+                self.profile(sym).add_ticks(cols["ts_ms"], cols["price"], cols["size"])
+                self.buffer.extend(sym, cols["ts_ms"], cols["price"], cols["size"])
+            if len(self.symbols) >= 2 and self.symbols[0] in data and self.symbols[1] in data:
+                lcols, rcols = data[self.symbols[0]], data[self.symbols[1]]
+                al = PairAligner(self.symbols[0], self.symbols[1], grid_ms=1000)
+                al.load(lcols["ts_ms"], lcols["price"], rcols["ts_ms"], rcols["price"])
+                self.aligners[(self.symbols[0], self.symbols[1], 0)] = al
+            self.seq += 1
+        n_ticks = sum(len(c["ts_ms"]) for c in data.values())
+        self.warm_start_info = f"Warm start: {n_ticks} ticks in {(time.perf_counter() - t0) * 1000:.0f} ms"
+
+
+class DataHub:
+    """
+    Process-wide registry of SharedFeeds (hold it in a cache_resource singleton).
+    - attach(): join (or start) the feed for a symbol set/source; N sessions -> one ingestor
+    - detach(): leave it; the last session out stops ingestion
+    - reap(): detach sessions that stopped sending heartbeats (closed tabs)
+    """
+
+    def __init__(self, db_path: str = "ticks.db", session_timeout_s: float = 120.0):
+        self.db_path = db_path
+        self.session_timeout_s = session_timeout_s
+        self._feeds: Dict[Tuple, SharedFeed] = {}
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def feed_key(symbols: List[str], source: str = "local", address: Optional[str] = None, demo: bool = False,
+                 depth: bool = False, coalesce: str = "off", reorder_ms: int = 250, ws_base_url: Optional[str] = None,
+                 sim: Optional[Dict[str, Any]] = None, storage_shards: int = 1) -> Tuple:
+        local = source != "feed"
+        return (source, address if not local else None, bool(demo) if local else False,
+                tuple(sorted(s.upper() for s in symbols)), bool(depth), coalesce if local else "off",
+                int(reorder_ms) if local else 0, ws_base_url if local else None,
+                tuple(sorted((sim or {}).items())) if local and demo else (), int(storage_shards) if local else 1)
+
+    def attach(self, session_id: str, symbols: List[str], source: str = "local", address: Optional[str] = None,
+               demo: bool = False, retention_s: Optional[float] = None, warm_start_minutes: Optional[float] = None,
+               depth: bool = False, coalesce: str = "off", reorder_ms: int = 250, ws_base_url: Optional[str] = None,
+               sim: Optional[Dict[str, Any]] = None, storage_shards: int = 1) -> SharedFeed:
+        key = self.feed_key(symbols, source, address, demo, depth, coalesce, reorder_ms, ws_base_url, sim, storage_shards)
+        with self._lock:
+            feed = self._feeds.get(key)
+            if feed is None or not feed.is_running():
+                feed = SharedFeed(key, symbols, source=source, address=address, demo=demo,
+                                  retention_s=retention_s, db_path=self.db_path, depth=depth, coalesce=coalesce,
+                                  reorder_ms=reorder_ms, ws_base_url=ws_base_url, sim=sim, storage_shards=storage_shards)
+                self._feeds[key] = feed
+                feed.start(warm_start_minutes)
+            feed.sessions[session_id] = time.time()
+            return feed
+
+    def _release(self, session_id: str, feed: SharedFeed) -> bool:
+        """Drop a session (caller holds _lock); True when it was the feed's last one and the feed is unregistered."""
+        feed.sessions.pop(session_id, None)
+        if feed.sessions:
+            return False
+        if self._feeds.get(feed.key) is feed:
+            del self._feeds[feed.key]
+        return True
+
+    def detach(self, session_id: str, feed: Optional[SharedFeed]):
+        if feed is None:
+            return
+        with self._lock:
+            last = self._release(session_id, feed)
+        # stopping joins the ingest thread; do it outside the lock so other sessions' attach/reap don't wait
+        if last:
+            feed.stop(wait_seconds=1.0)
+
+    def touch(self, session_id: str, feed: Optional[SharedFeed]):
+        if feed is not None and session_id in feed.sessions:
+            feed.sessions[session_id] = time.time()
+
+    def reap(self):
+        cutoff = time.time() - self.session_timeout_s
+        to_stop = []
+        with self._lock:
+            for feed in list(self._feeds.values()):
+                for sid, seen in list(feed.sessions.items()):
+                    if seen < cutoff and self._release(sid, feed):
+                        to_stop.append(feed)
+        for feed in to_stop:
+            feed.stop(wait_seconds=1.0)
+
+    def any_running(self) -> bool:
+        with self._lock:
+            return any(f.is_running() for f in self._feeds.values())
+
+    def stats(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [{"symbols": f.symbols, "source": f.key[0], "sessions": len(f.sessions), "ticks": f.seq,
+                     "running": f.is_running()} for f in self._feeds.values()]
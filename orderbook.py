@@ -0,0 +1,314 @@
+# orderbook.py
+import json
+import random
+import urllib.request
+from array import array
+from datetime import datetime
+from bisect import bisect_left
+from typing import Dict, Any, Optional, List, Tuple
+
+from analytics import microprice, depth_imbalance, spread_bps
+
+DEFAULT_SNAPSHOT_URL = "https://fapi.binance.com/fapi/v1/depth?symbol={symbol}&limit={limit}"
+
+
+class BookSide:
+    """
+    One side of an L2 book as two parallel, sorted array('d') columns (key, qty).
+    Keys are ascending with the best level at the END (bids: key = price, asks: key = -price),
+    so the hot top-of-book is read in O(1) and inserts/deletes near the top only shift a few
+    elements. Level lookup is a binary search (O(log n)); quantity changes are in place.
+    """
+
+    def __init__(self, is_bid: bool, max_levels: int = 5000):
+        self.is_bid = is_bid
+        self.max_levels = max_levels
+        self._keys = array("d")
+        self._qty = array("d")
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def clear(self):
+        self._keys = array("d")
+        self._qty = array("d")
+
+    def load(self, levels: List[Tuple[float, float]]):
+        pairs = sorted(((p if self.is_bid else -p), q) for p, q in levels if q > 0)
+        self._keys = array("d", [k for k, _ in pairs])
+        self._qty = array("d", [q for _, q in pairs])
+        self._trim()
+
+    def update(self, price: float, qty: float) -> int:
+        """Set a level (qty 0 removes it); returns its depth from the top (0 = best) or -1 for a no-op."""
+        keys = self._keys
+        k = price if self.is_bid else -price
+        i = bisect_left(keys, k)
+        n = len(keys)
+        if i < n and keys[i] == k:
+            if qty > 0:
+                self._qty[i] = qty
+            else:
+                del keys[i]
+                del self._qty[i]
+            return n - 1 - i
+        if qty <= 0:
+            return -1
+        keys.insert(i, k)
+        self._qty.insert(i, qty)
+        if n + 1 > 2 * self.max_levels:
+            self._trim()
+        return n - i
+
+    def _trim(self):
+        # far levels are dropped in one slice; diffs carry absolute sizes, so they come back on change
+        excess = len(self._keys) - self.max_levels
+        if excess > 0:
+            del self._keys[:excess]
+            del self._qty[:excess]
+
+    def best(self) -> Optional[Tuple[float, float]]:
+        if not self._keys:
+            return None
+        k = self._keys[-1]
+        return (k if self.is_bid else -k), self._qty[-1]
+
+    def top_qty(self, n: int) -> float:
+        return sum(self._qty[-n:]) if n > 0 else 0.0
+
+    def top(self, n: int) -> List[Tuple[float, float]]:
+        """Best n levels as (price, qty), best first."""
+        keys, qty = self._keys[-n:], self._qty[-n:]
+        sign = 1.0 if self.is_bid else -1.0
+        return [(sign * keys[j], qty[j]) for j in range(len(keys) - 1, -1, -1)]
+
+
+class OrderBook:
+    """
+    Per-symbol L2 book with incrementally maintained metrics.
+    - apply(bids, asks): diff levels as [price, qty] (strings or floats), qty 0 = delete
+    - top-N depth sums are only recomputed when an update lands inside the top N levels
+    - metrics(): mid, microprice, top-N imbalance, spread in bps (O(1) after an update)
+    """
+
+    def __init__(self, symbol: str, top_n: int = 10, max_levels: int = 5000):
+        self.symbol = symbol.upper()
+        self.top_n = top_n
+        self.bids = BookSide(True, max_levels)
+        self.asks = BookSide(False, max_levels)
+        self.last_update_id: Optional[int] = None
+        self.ts_ms: Optional[int] = None
+        self.updates = 0
+        self._bid_depth = 0.0
+        self._ask_depth = 0.0
+        self._metrics: Dict[str, Any] = {}
+
+    def load_snapshot(self, bids, asks, last_update_id: int, ts_ms: Optional[int] = None):
+        self.bids.load([(float(p), float(q)) for p, q in bids])
+        self.asks.load([(float(p), float(q)) for p, q in asks])
+        self.last_update_id = int(last_update_id)
+        self.ts_ms = ts_ms
+        self._bid_depth = self.bids.top_qty(self.top_n)
+        self._ask_depth = self.asks.top_qty(self.top_n)
+        self._recompute()
+
+    def apply(self, bids, asks, ts_ms: Optional[int] = None, update_id: Optional[int] = None):
+        n = self.top_n
+        bid_dirty = ask_dirty = False
+        for p, q in bids:
+            d = self.bids.update(float(p), float(q))
+            bid_dirty |= 0 <= d < n
+        for p, q in asks:
+            d = self.asks.update(float(p), float(q))
+            ask_dirty |= 0 <= d < n
+        if bid_dirty:
+            self._bid_depth = self.bids.top_qty(n)
+        if ask_dirty:
+            self._ask_depth = self.asks.top_qty(n)
+        if update_id is not None:
+            self.last_update_id = int(update_id)
+        if ts_ms is not None:
+            self.ts_ms = ts_ms
+        self.updates += 1
+        if bid_dirty or ask_dirty:
+            self._recompute()
+
+    def _recompute(self):
+        bb, ba = self.bids.best(), self.asks.best()
+        if bb is None or ba is None:
+            self._metrics = {}
+            return
+        (bid, bid_q), (ask, ask_q) = bb, ba
+        self._metrics = {
+            "bid": bid, "ask": ask, "bid_qty": bid_q, "ask_qty": ask_q,
+            "mid": (bid + ask) / 2.0,
+            "microprice": microprice(bid, bid_q, ask, ask_q),
+            "imbalance": depth_imbalance(self._bid_depth, self._ask_depth),
+            "spread_bps": spread_bps(bid, ask),
+        }
+
+    def clear(self):
+        self.bids.clear()
+        self.asks.clear()
+        self._bid_depth = self._ask_depth = 0.0
+        self._metrics = {}
+
+    def metrics(self) -> Dict[str, Any]:
+        return self._metrics
+
+    def top(self, n: int = 10) -> Dict[str, List[Tuple[float, float]]]:
+        return {"bids": self.bids.top(n), "asks": self.asks.top(n)}
+
+
+class DepthSync:
+    """
+    Binance diff-depth synchronisation for one OrderBook.
+    1. buffer diff events while no snapshot is loaded (needs_snapshot is True)
+    2. on_snapshot(): load it, drop buffered events with u < lastUpdateId, replay the rest; the first
+       applied event must bridge the snapshot: U <= lastUpdateId <= u (futures, events carry `pu`),
+       or U <= lastUpdateId + 1 (spot)
+    3. every following event must continue the sequence: pu == previous u (futures),
+       or U == previous u + 1 (spot); a gap resets the book and asks for a new snapshot
+    """
+
+    def __init__(self, book: OrderBook, max_buffer: int = 10000):
+        self.book = book
+        self.max_buffer = max_buffer
+        self.synced = False
+        self.resyncs = 0
+        self._prev_u: Optional[int] = None
+        self._buffer: List[Dict[str, Any]] = []
+
+    @property
+    def needs_snapshot(self) -> bool:
+        return not self.synced
+
+    def on_event(self, evt: Dict[str, Any]) -> bool:
+        """Returns True when the event changed the book."""
+        if not self.synced:
+            self._buffer.append(evt)
+            if len(self._buffer) > self.max_buffer:
+                del self._buffer[:len(self._buffer) - self.max_buffer]
+            return False
+        return self._apply(evt)
+
+    def on_snapshot(self, snap: Dict[str, Any]) -> bool:
+        last_id = int(snap["lastUpdateId"])
+        self.book.load_snapshot(snap.get("bids", []), snap.get("asks", []), last_id, snap.get("E") or snap.get("T"))
+        self.synced = True
+        self._prev_u = None
+        pending, self._buffer = self._buffer, []
+        for evt in pending:
+            self._apply(evt)
+            if not self.synced:
+                # snapshot is older than the buffered stream can bridge; wait for a fresh one
+                return False
+        return True
+
+    def _apply(self, evt: Dict[str, Any]) -> bool:
+        U, u = int(evt["U"]), int(evt["u"])
+        if self._prev_u is None:
+            last_id = self.book.last_update_id or 0
+            if u < last_id:
+                return False
+            if "pu" in evt:
+                # futures: the event must straddle the snapshot (or continue it exactly)
+                if U > last_id and int(evt["pu"]) != last_id:
+                    return self._gap(evt)
+            elif U > last_id + 1:
+                return self._gap(evt)
+        elif "pu" in evt:
+            if int(evt["pu"]) != self._prev_u:
+                return self._gap(evt)
+        elif U != self._prev_u + 1:
+            return self._gap(evt)
+        self.book.apply(evt.get("b", []), evt.get("a", []), ts_ms=evt.get("E"), update_id=u)
+        self._prev_u = u
+        return True
+
+    def _gap(self, evt: Dict[str, Any]) -> bool:
+        self.synced = False
+        self.resyncs += 1
+        self._prev_u = None
+        self._buffer = [evt]
+        self.book.clear()
+        return False
+
+
+def fetch_snapshot(symbol: str, url: str = DEFAULT_SNAPSHOT_URL, limit: int = 1000, timeout: float = 10.0) -> Dict[str, Any]:
+    """Blocking REST snapshot (run it in a thread); `url` may point at a local stand-in."""
+    with urllib.request.urlopen(url.format(symbol=symbol.upper(), limit=limit), timeout=timeout) as resp:
+        return json.loads(resp.read())
+
+
+class DemoDepthSource:
+    """
+    Local stand-in for the depth endpoints: keeps a synthetic book around a random-walk mid
+    and emits Binance-shaped diff events ({"e": "depthUpdate", U, u, pu, b, a}) plus
+    REST-shaped snapshots, so the sync path can run without network access.
+    """
+
+    def __init__(self, symbol: str, base: float, tick: Optional[float] = None, levels: int = 50, seed: Optional[int] = None):
+        self.symbol = symbol.upper()
+        self.tick = tick or max(0.01, round(base * 1e-5, 2))
+        self.levels = levels
+        self._rng = random.Random(seed)
+        self._mid_ticks = int(base / self.tick)
+        self._book: Dict[int, float] = {}
+        self._update_id = 1000
+        for i in range(1, levels + 1):
+            self._book[-(self._mid_ticks - i)] = self._size()
+            self._book[self._mid_ticks + i] = self._size()
+
+    def _size(self) -> float:
+        return round(self._rng.expovariate(1.0) * 2.0 + 0.001, 3)
+
+    def _levels(self, bid: bool) -> List[List[str]]:
+        out = [(-k if bid else k, q) for k, q in self._book.items() if (k < 0) == bid]
+        out.sort(key=lambda x: -x[0] if bid else x[0])
+        return [[f"{p * self.tick:.8f}", f"{q:.3f}"] for p, q in out]
+
+    def snapshot(self, limit: int = 1000) -> Dict[str, Any]:
+        return {"lastUpdateId": self._update_id, "bids": self._levels(True)[:limit], "asks": self._levels(False)[:limit]}
+
+    def next_event(self, ts_ms: int, changes: int = 6) -> Dict[str, Any]:
+        prev = self._update_id
+        b, a = [], []
+        # occasionally move the mid and rebuild the inside levels
+        if self._rng.random() < 0.1:
+            step = self._rng.choice((-1, 1))
+            self._mid_ticks += step
+            if step > 0:
+                self._set(-(self._mid_ticks - 1), self._size(), b)
+                self._set(self._mid_ticks, 0.0, a)
+            else:
+                self._set(self._mid_ticks + 1, self._size(), a)
+                self._set(-self._mid_ticks, 0.0, b)
+        for _ in range(changes):
+            bid = self._rng.random() < 0.5
+            dist = min(self.levels, int(self._rng.expovariate(0.3)) + 1)
+            if bid:
+                self._set(-(self._mid_ticks - dist), self._size() if self._rng.random() < 0.85 else 0.0, b)
+            else:
+                self._set(self._mid_ticks + dist, self._size() if self._rng.random() < 0.85 else 0.0, a)
+        self._update_id = prev + 1 + self._rng.randint(0, 3)
+        return {"e": "depthUpdate", "E": ts_ms, "s": self.symbol, "U": prev + 1, "u": self._update_id, "pu": prev, "b": b, "a": a}
+
+    def _set(self, key: int, qty: float, out: List[List[str]]):
+        if qty > 0:
+            self._book[key] = qty
+        else:
+            self._book.pop(key, None)
+        out.append([f"{abs(key) * self.tick:.8f}", f"{qty:.3f}"])
+
+
+def book_message(book: OrderBook, levels: int = 10) -> Optional[Dict[str, Any]]:
+    """Queue/feed message for a book update (metrics + top levels); None while the book is empty."""
+    m = book.metrics()
+    if not m:
+        return None
+    ts_ms = book.ts_ms or 0
+    msg = {"type": "book", "symbol": book.symbol, "ts": datetime.utcfromtimestamp(ts_ms / 1000.0).isoformat() + "Z"}
+    msg.update(m)
+    msg.update(book.top(levels))
+    return msg
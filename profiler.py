@@ -0,0 +1,281 @@
+# profiler.py
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque, Counter
+from contextlib import nullcontext
+from typing import Dict, Any, Optional, List
+
+import numpy as np
+import pandas as pd
+
+_NOOP = nullcontext()
+
+
+class _Section:
+    __slots__ = ("prof", "name", "w0", "c0")
+
+    def __init__(self, prof: "Profiler", name: str):
+        self.prof = prof
+        self.name = name
+
+    def __enter__(self):
+        self.w0 = time.perf_counter()
+        self.c0 = time.thread_time()
+        return self
+
+    def __exit__(self, *exc):
+        self.prof._record(self.name, time.perf_counter() - self.w0, time.thread_time() - self.c0)
+        return False
+
+
+class _Run:
+    __slots__ = ("prof", "kind", "inner")
+
+    def __init__(self, prof: "Profiler", kind: str):
+        self.prof = prof
+        self.kind = kind
+
+    def __enter__(self):
+        # inside an open run (a fragment executing as part of the full rerun) this is just a section
+        self.inner = _Section(self.prof, self.kind) if getattr(self.prof._local, "run", None) is not None else None
+        if self.inner is not None:
+            self.inner.__enter__()
+        else:
+            self.prof.begin(self.kind)
+        return self
+
+    def __exit__(self, *exc):
+        if self.inner is not None:
+            self.inner.__exit__(*exc)
+        else:
+            self.prof.end()
+        return False
+
+
+class Profiler:
+    """
+    Opt-in, process-wide section profiler.
+    - begin(kind) / end() (or `with run(kind)`) brackets one rerun / fragment run in the calling thread;
+      `with run(kind)` while a run is open just counts as a section of the outer one
+    - `with section(name)` adds wall (perf_counter) and CPU (thread_time) time to the open run; sections
+      outside a run (ingest loop threads) are summed per thread and closed as a run every loop_window_s
+    - finished runs go into a rolling history: summary() = top offenders, trend() = per-run series
+    - capture(seconds) runs a sampling profiler over every thread's stack; top_functions() and
+      folded() (flamegraph.pl / speedscope) read a capture, export() writes history + captures as JSON
+    When disabled, section() / run() return a shared no-op context manager.
+    """
+
+    def __init__(self, history: int = 600, loop_window_s: float = 1.0, enabled: bool = False):
+        self.enabled = enabled
+        self.loop_window_s = loop_window_s
+        self.history: deque = deque(maxlen=history)
+        self.captures: deque = deque(maxlen=5)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._sampler: Optional[threading.Thread] = None
+
+    # ---------- sections ----------
+    def section(self, name: str):
+        return _Section(self, name) if self.enabled else _NOOP
+
+    def run(self, kind: str):
+        return _Run(self, kind) if self.enabled else _NOOP
+
+    def timed(self, name: str):
+        """Decorator form of section()."""
+        def wrap(fn):
+            @functools.wraps(fn)
+            def inner(*a, **kw):
+                if not self.enabled:
+                    return fn(*a, **kw)
+                with _Section(self, name):
+                    return fn(*a, **kw)
+            return inner
+        return wrap
+
+    def timed_run(self, kind: str):
+        """Decorator form of run(), e.g. for a fragment that reruns on its own."""
+        def wrap(fn):
+            # functools.wraps keeps __module__ / __qualname__: st.fragment derives its id from them
+            @functools.wraps(fn)
+            def inner(*a, **kw):
+                if not self.enabled:
+                    return fn(*a, **kw)
+                with _Run(self, kind):
+                    return fn(*a, **kw)
+            return inner
+        return wrap
+
+    def begin(self, kind: str):
+        if not self.enabled:
+            return
+        # a run left open by an interrupted script (st.rerun / st.stop) is dropped
+        self._local.run = {"kind": kind, "ts": time.time(), "w0": time.perf_counter(), "c0": time.thread_time(), "sections": {}}
+
+    def end(self):
+        run = getattr(self._local, "run", None)
+        if run is None:
+            return
+        self._local.run = None
+        self._finish(run)
+
+    def _finish(self, run: Dict[str, Any]):
+        run["wall_ms"] = (time.perf_counter() - run.pop("w0")) * 1000.0
+        run["cpu_ms"] = (time.thread_time() - run.pop("c0")) * 1000.0
+        run["thread"] = threading.current_thread().name
+        with self._lock:
+            self.history.append(run)
+
+    @staticmethod
+    def _add(sections: Dict[str, List[float]], name: str, wall: float, cpu: float):
+        s = sections.get(name)
+        if s is None:
+            sections[name] = [wall * 1000.0, cpu * 1000.0, 1]
+        else:
+            s[0] += wall * 1000.0
+            s[1] += cpu * 1000.0
+            s[2] += 1
+
+    def _record(self, name: str, wall: float, cpu: float):
+        loc = self._local
+        run = getattr(loc, "run", None)
+        if run is not None:
+            self._add(run["sections"], name, wall, cpu)
+            return
+        # loop threads: aggregate into a window-sized run
+        win = getattr(loc, "window", None)
+        now = time.perf_counter()
+        if win is None:
+            win = loc.window = {"kind": "ingest", "ts": time.time(), "w0": now, "c0": time.thread_time(), "sections": {}}
+        self._add(win["sections"], name, wall, cpu)
+        if now - win["w0"] >= self.loop_window_s:
+            loc.window = None
+            self._finish(win)
+
+    # ---------- history ----------
+    def clear(self):
+        with self._lock:
+            self.history.clear()
+
+    def runs(self, kind: Optional[str] = None) -> List[Dict[str, Any]]:
+        with self._lock:
+            runs = list(self.history)
+        return [r for r in runs if kind is None or r["kind"] == kind]
+
+    def summary(self, kind: Optional[str] = None) -> pd.DataFrame:
+        """Per (kind, section): runs seen in, calls, total / mean / p95 / max wall ms per run, CPU ms, share of run wall."""
+        rows: Dict[tuple, Dict[str, Any]] = {}
+        run_wall: Dict[str, float] = {}
+        for r in self.runs(kind):
+            run_wall[r["kind"]] = run_wall.get(r["kind"], 0.0) + r["wall_ms"]
+            for name, (wall, cpu, calls) in r["sections"].items():
+                row = rows.setdefault((r["kind"], name), {"kind": r["kind"], "section": name, "walls": [], "cpu_ms": 0.0, "calls": 0})
+                row["walls"].append(wall)
+                row["cpu_ms"] += cpu
+                row["calls"] += calls
+        out = []
+        for row in rows.values():
+            w = np.array(row.pop("walls"))
+            total = float(w.sum())
+            out.append(dict(row, runs=len(w), wall_ms=total, mean_ms=float(w.mean()), p95_ms=float(np.percentile(w, 95)),
+                            max_ms=float(w.max()), cpu_pct=100.0 * row["cpu_ms"] / total if total else 0.0,
+                            share_pct=100.0 * total / run_wall[row["kind"]] if run_wall[row["kind"]] else 0.0))
+        cols = ["kind", "section", "runs", "calls", "wall_ms", "mean_ms", "p95_ms", "max_ms", "cpu_ms", "cpu_pct", "share_pct"]
+        if not out:
+            return pd.DataFrame(columns=cols)
+        return pd.DataFrame(out)[cols].sort_values("wall_ms", ascending=False).reset_index(drop=True)
+
+    def trend(self, kind: str, sections: Optional[List[str]] = None) -> pd.DataFrame:
+        """Wall ms per run (rows, UTC index) for each section plus the run total."""
+        runs = self.runs(kind)
+        if not runs:
+            return pd.DataFrame()
+        names = sections or sorted({n for r in runs for n in r["sections"]})
+        data = {"total": [r["wall_ms"] for r in runs]}
+        for n in names:
+            data[n] = [r["sections"].get(n, (0.0,))[0] for r in runs]
+        return pd.DataFrame(data, index=pd.to_datetime([r["ts"] for r in runs], unit="s", utc=True))
+
+    # ---------- sampling ----------
+    def capture(self, seconds: float = 5.0, interval_ms: float = 5.0) -> bool:
+        """Sample every thread's stack for `seconds` in the background. False if a capture is already running."""
+        if self._sampler is not None and self._sampler.is_alive():
+            return False
+        self._sampler = threading.Thread(target=self._sample, args=(seconds, interval_ms), name="profiler-sampler", daemon=True)
+        self._sampler.start()
+        return True
+
+    def sampling(self) -> bool:
+        return self._sampler is not None and self._sampler.is_alive()
+
+    def _sample(self, seconds: float, interval_ms: float):
+        me = threading.get_ident()
+        names = {t.ident: t.name for t in threading.enumerate()}
+        stacks: Counter = Counter()
+        n = 0
+        t0 = time.time()
+        end = time.perf_counter() + seconds
+        while time.perf_counter() < end:
+            for tid, frame in sys._current_frames().items():
+                if tid == me:
+                    continue
+                parts = []
+                f = frame
+                while f is not None:
+                    co = f.f_code
+                    parts.append(f"{co.co_name} ({os.path.basename(co.co_filename)}:{co.co_firstlineno})")
+                    f = f.f_back
+                if tid not in names:
+                    names = {t.ident: t.name for t in threading.enumerate()}
+                parts.append(names.get(tid, str(tid)))
+                stacks[";".join(reversed(parts))] += 1
+            n += 1
+            time.sleep(interval_ms / 1000.0)
+        with self._lock:
+            self.captures.append({"ts": t0, "seconds": seconds, "interval_ms": interval_ms, "sweeps": n, "stacks": stacks})
+
+    def top_functions(self, capture: Optional[Dict[str, Any]] = None, n: int = 25) -> pd.DataFrame:
+        """Per function: samples on top of the stack (self) and anywhere on it (total), as % of all samples."""
+        capture = capture or (self.captures[-1] if self.captures else None)
+        if not capture:
+            return pd.DataFrame(columns=["function", "self", "total", "self_pct", "total_pct"])
+        own: Counter = Counter()
+        total: Counter = Counter()
+        n_samples = sum(capture["stacks"].values())
+        for stack, count in capture["stacks"].items():
+            frames = stack.split(";")[1:]
+            if not frames:
+                continue
+            own[frames[-1]] += count
+            for fn in set(frames):
+                total[fn] += count
+        df = pd.DataFrame({"function": list(total), "self": [own[f] for f in total], "total": list(total.values())})
+        df["self_pct"] = 100.0 * df["self"] / n_samples
+        df["total_pct"] = 100.0 * df["total"] / n_samples
+        return df.sort_values(["self", "total"], ascending=False).head(n).reset_index(drop=True)
+
+    def folded(self, capture: Optional[Dict[str, Any]] = None) -> str:
+        """Capture in collapsed-stack format ("thread;outer;...;inner count" per line)."""
+        capture = capture or (self.captures[-1] if self.captures else None)
+        if not capture:
+            return ""
+        return "\n".join(f"{stack} {count}" for stack, count in capture["stacks"].most_common()) + "\n"
+
+    def export(self, path: Optional[str] = None) -> str:
+        """Raw runs and captures as JSON; written to `path` if given."""
+        with self._lock:
+            doc = {"runs": list(self.history),
+                   "captures": [dict(c, stacks=dict(c["stacks"])) for c in self.captures]}
+        text = json.dumps(doc, default=str)
+        if path:
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(text)
+        return text
+
+
+# process-wide instance; the ingest threads and every dashboard session record into it
+PROFILER = Profiler()
@@ -1,7 +1,14 @@
 # resampling.py
+import math
+import numpy as np
 import pandas as pd
 import plotly.graph_objects as go
-from typing import Tuple
+from collections import deque
+from datetime import datetime, timezone
+from typing import Tuple, Optional, List, Dict, Any
+
+from charts import decimate_ohlcv, CANDLE_COLORS
+from analytics import RollingVol
 
 def ticks_to_ohlcv(df: pd.DataFrame, timeframe_ms: int) -> pd.DataFrame:
     if df is None or df.empty:
@@ -26,18 +33,718 @@ def ticks_to_ohlcv(df: pd.DataFrame, timeframe_ms: int) -> pd.DataFrame:
     ohlcv.dropna(subset=["open"], inplace=True)
     return ohlcv
 
-def ohlcv_to_plotly(ohlcv):
+def ohlcv_to_plotly(ohlcv, max_bars: Optional[int] = None, sequential: bool = False):
+    """Candles + volume figures. sequential=True spaces bars evenly (category axis), which suits
+    event-driven bars whose durations vary."""
     if ohlcv is None or ohlcv.empty:
         return None, None
+    if max_bars:
+        ohlcv = decimate_ohlcv(ohlcv, max_bars)
     x = ohlcv.index
     fig = go.Figure(data=[go.Candlestick(x=x,
                                          open=ohlcv["open"],
                                          high=ohlcv["high"],
                                          low=ohlcv["low"],
                                          close=ohlcv["close"],
-                                         increasing_line_color='#26a69a', decreasing_line_color='#ef5350')])
+                                         **CANDLE_COLORS)])
     fig.update_layout(margin=dict(l=10,r=10,t=20,b=20), height=420, template='plotly_dark')
     fig_vol = go.Figure()
     fig_vol.add_trace(go.Bar(x=x, y=ohlcv["volume"]))
     fig_vol.update_layout(margin=dict(l=10,r=10,t=10,b=20), height=120, template='plotly_dark')
+    if sequential:
+        for f in (fig, fig_vol):
+            f.update_xaxes(type="category", nticks=8)
     return fig, fig_vol
+
+# ---------- multi-timeframe bar cascade ----------
+TIMEFRAMES_MS = {
+    "1s": 1000, "15s": 15000, "1m": 60000, "5m": 300000,
+    "15m": 900000, "1h": 3600000, "4h": 14400000,
+}
+
+def iso_to_ms(ts: str) -> int:
+    """Parse the ingestor's ISO timestamp ('...Z') into epoch milliseconds."""
+    dt = datetime.fromisoformat(str(ts).replace("Z", "+00:00"))
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp() * 1000)
+
+def bars_to_ohlcv(ohlcv: pd.DataFrame, timeframe_ms: int) -> pd.DataFrame:
+    """Aggregate already-built bars into a coarser timeframe (no tick access needed)."""
+    if ohlcv is None or ohlcv.empty:
+        return pd.DataFrame()
+    # epoch-aligned like _Level.update (bar start = ts - ts % tf), not pandas' default start_day
+    res = ohlcv.resample(f"{int(timeframe_ms)}ms", origin="epoch").agg(
+        {"open": "first", "high": "max", "low": "min", "close": "last", "volume": "sum"})
+    return res.dropna(subset=["open"])
+
+
+def _merge_bar(acc: Optional[list], bar: list, start_ms: int) -> list:
+    if acc is None:
+        return [start_ms, bar[1], bar[2], bar[3], bar[4], bar[5]]
+    return [acc[0], acc[1], max(acc[2], bar[2]), min(acc[3], bar[3]), bar[4], acc[5] + bar[5]]
+
+
+def _bar_index(bars: deque, start_ms: int) -> Tuple[Optional[int], int]:
+    """(index of the bar starting at start_ms or None, insert position); scans from the newest end."""
+    i = len(bars) - 1
+    while i >= 0 and bars[i][0] > start_ms:
+        i -= 1
+    if i >= 0 and bars[i][0] == start_ms:
+        return i, i
+    return None, i + 1
+
+
+def _put_bar(bars: deque, bar: list) -> bool:
+    """Replace or insert a closed bar in time order; False when it is older than the kept history."""
+    idx, pos = _bar_index(bars, bar[0])
+    if idx is not None:
+        bars[idx] = bar
+        return True
+    if pos == 0 and bars.maxlen is not None and len(bars) == bars.maxlen:
+        return False
+    if bars.maxlen is not None and len(bars) == bars.maxlen:
+        bars.popleft()
+        pos -= 1
+    bars.insert(pos, bar)
+    return True
+
+
+class _Level:
+    """
+    One timeframe of the cascade.
+    Receives child bars as (bar, final). Final child bars are folded into
+    `partial`; the child's still-open bar is overlaid on top to form `current`.
+    """
+
+    def __init__(self, timeframe_ms: int, max_bars: int):
+        self.timeframe_ms = int(timeframe_ms)
+        self.bars: deque = deque(maxlen=max_bars)
+        self.partial: Optional[list] = None
+        self.current: Optional[list] = None
+        self.version = 0
+        self._frame: Optional[pd.DataFrame] = None
+        self._frame_version = -1
+        # RollingVol trackers fed each bar as it closes
+        self.trackers: List[RollingVol] = []
+
+    def update(self, bar: list, final: bool) -> List[Tuple[list, bool]]:
+        """Fold a child bar in; returns the (bar, final) events to pass to the next level."""
+        out = []
+        bucket = bar[0] - bar[0] % self.timeframe_ms
+        if self.current is not None and bucket > self.current[0]:
+            self.bars.append(self.current)
+            self.version += 1
+            for tr in self.trackers:
+                tr.add_bar(*self.current[1:5])
+            out.append((self.current, True))
+            self.partial = None
+            self.current = None
+        elif self.current is not None and bucket < self.current[0]:
+            # late child data: fold into the open bar's range/volume only
+            bucket = self.current[0]
+            bar = [bucket, self.current[1], bar[2], bar[3], self.current[4], bar[5]]
+        if final:
+            self.partial = _merge_bar(self.partial, bar, bucket)
+            self.current = list(self.partial)
+        else:
+            self.current = _merge_bar(self.partial, bar, bucket)
+        out.append((self.current, False))
+        return out
+
+    def seed(self, ohlcv: pd.DataFrame):
+        """Load history from an aggregated frame (last row becomes the open bar)."""
+        if ohlcv is None or ohlcv.empty:
+            return
+        starts = ohlcv.index.as_unit("ms").asi8
+        rows = [[int(t), o, h, l, c, v] for t, o, h, l, c, v in zip(
+            starts, ohlcv["open"].values, ohlcv["high"].values, ohlcv["low"].values,
+            ohlcv["close"].values, ohlcv["volume"].values)]
+        self.bars.extend(rows[:-1])
+        self.partial = list(rows[-1])
+        self.current = list(rows[-1])
+        self.version += 1
+
+    def to_frame(self) -> pd.DataFrame:
+        if self._frame_version != self.version:
+            rows = list(self.bars)
+            self._frame = _bars_frame(rows)
+            self._frame_version = self.version
+        if self.current is None:
+            return self._frame
+        return pd.concat([self._frame, _bars_frame([self.current])]) if not self._frame.empty else _bars_frame([self.current])
+
+
+def _aggregate_bars(starts: np.ndarray, o: np.ndarray, h: np.ndarray, l: np.ndarray, c: np.ndarray,
+                    v: np.ndarray, timeframe_ms: int) -> List[list]:
+    """Vectorised fold of time-ordered bars (or ticks, with o=h=l=c) into timeframe buckets."""
+    if len(starts) == 0:
+        return []
+    buckets = starts - starts % timeframe_ms
+    first = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    last = np.r_[first[1:] - 1, len(buckets) - 1]
+    arr = np.column_stack([
+        buckets[first].astype(float), o[first], np.maximum.reduceat(h, first),
+        np.minimum.reduceat(l, first), c[last], np.add.reduceat(v, first),
+    ])
+    rows = arr.tolist()
+    for row in rows:
+        row[0] = int(row[0])
+    return rows
+
+
+def _bars_frame(rows: List[list]) -> pd.DataFrame:
+    if not rows:
+        return pd.DataFrame(columns=["open", "high", "low", "close", "volume"])
+    arr = np.asarray(rows, dtype=float)
+    idx = pd.to_datetime(arr[:, 0].astype(np.int64), unit="ms", utc=True)
+    return pd.DataFrame(arr[:, 1:], index=idx, columns=["open", "high", "low", "close", "volume"])
+
+
+class BarCascade:
+    """
+    Per-symbol multi-timeframe bar state.
+    - ticks are folded once into base-resolution bars
+    - every higher timeframe is aggregated from the level below it (bars, not ticks),
+      updated incrementally on each tick in O(number of levels)
+    - any other timeframe that is a multiple of the base is added on first request,
+      seeded from the finest cached level that divides it, then kept up to date
+    - a tick older than the newest one seen (a late tick) amends the bar covering it on every
+      level instead of being folded into the open bar; no history is recomputed
+    - vol(timeframe_ms, window) attaches a RollingVol to a level: seeded once from the closed bars,
+      then updated in O(1) as bars close (amended bars are not re-fed)
+    Methods:
+      - add_tick(ts_ms, price, size)
+      - amend_tick(ts_ms, price, size) -> [(timeframe_ms, amended closed bar)]
+      - get(timeframe_ms) -> OHLCV DataFrame (cached between calls)
+      - vol(timeframe_ms, window) -> RollingVol
+    """
+
+    def __init__(self, timeframes_ms: Optional[List[int]] = None, max_bars: int = 5000):
+        tfs = sorted(set(int(t) for t in (timeframes_ms or TIMEFRAMES_MS.values())))
+        self.max_bars = max_bars
+        self.base_ms = tfs[0]
+        self._levels: Dict[int, _Level] = {tf: _Level(tf, max_bars) for tf in tfs}
+        self._parent: Dict[int, int] = {}
+        for tf in tfs[1:]:
+            self._parent[tf] = self._best_child(tf)
+        self.last_ts_ms: Optional[int] = None
+        # first/last tick time of recent base bars, so a late tick knows whether it sets open/close
+        self._spans: Dict[int, list] = {}
+        self.max_spans = 4096
+        self.late_ticks = 0
+        self._vols: Dict[Tuple[int, int], RollingVol] = {}
+
+    def load_ticks(self, ts_ms: np.ndarray, price: np.ndarray, size: np.ndarray):
+        """Bulk-seed an empty cascade from time-ordered tick arrays (vectorised, no per-tick work)."""
+        if len(ts_ms) == 0:
+            return
+        ts_ms = np.asarray(ts_ms, dtype=np.int64)
+        p = np.asarray(price, dtype=float)
+        v = np.nan_to_num(np.asarray(size, dtype=float))
+        for tf in self.timeframes():
+            level = self._levels[tf]
+            # every level straight from the ticks, so each keeps its full history depth
+            rows = _aggregate_bars(ts_ms, p, p, p, p, v, tf)
+            level.bars.extend(rows[-level.bars.maxlen - 1:-1] if level.bars.maxlen else rows[:-1])
+            level.current = list(rows[-1])
+            child = self._parent.get(tf)
+            if child is None:
+                level.partial = list(rows[-1])
+            else:
+                # `partial` excludes the child's open bar, which keeps arriving as a non-final update
+                m = (ts_ms >= rows[-1][0]) & (ts_ms < self._levels[child].current[0])
+                part = _aggregate_bars(ts_ms[m], p[m], p[m], p[m], p[m], v[m], tf)
+                level.partial = list(part[0]) if part else None
+            level.version += 1
+        self.last_ts_ms = int(ts_ms[-1])
+
+    def _best_child(self, tf: int) -> int:
+        divisors = [c for c in self._levels if c < tf and tf % c == 0]
+        return max(divisors) if divisors else self.base_ms
+
+    def timeframes(self) -> List[int]:
+        return sorted(self._levels)
+
+    def add_tick(self, ts_ms: int, price: float, size: float = 0.0):
+        ts_ms = int(ts_ms)
+        if self.last_ts_ms is not None and ts_ms < self.last_ts_ms:
+            self.amend_tick(ts_ms, price, size)
+            return
+        p = float(price)
+        self._propagate(self.base_ms, [ts_ms, p, p, p, p, float(size or 0.0)], True)
+        for tr in self._vols.values():
+            tr.add_tick(p)
+        self.last_ts_ms = ts_ms
+        b = ts_ms - ts_ms % self.base_ms
+        span = self._spans.get(b)
+        if span is None:
+            self._spans[b] = [ts_ms, ts_ms]
+            if len(self._spans) > self.max_spans:
+                del self._spans[next(iter(self._spans))]
+        else:
+            span[1] = ts_ms
+
+    def amend_tick(self, ts_ms: int, price: float, size: float = 0.0) -> List[Tuple[int, list]]:
+        """
+        Fold a late tick into the base bar covering it, then rebuild only the bar containing it on
+        each higher level from that level's child bars. Returns the (timeframe_ms, bar copy) of every
+        closed bar that changed (open bars are not included); empty when the bar is older than the
+        kept history.
+        """
+        ts_ms, p, v = int(ts_ms), float(price), float(size or 0.0)
+        base = self._levels[self.base_ms]
+        b = ts_ms - ts_ms % self.base_ms
+        span = self._spans.get(b)
+        if base.current is not None and base.current[0] == b:
+            bar, closed = base.current, False
+        else:
+            idx, _ = _bar_index(base.bars, b)
+            bar, closed = (base.bars[idx] if idx is not None else None), True
+        amended: List[Tuple[int, list]] = []
+        if bar is None:
+            bar = [b, p, p, p, p, v]
+            if not _put_bar(base.bars, bar):
+                return amended
+            self._spans[b] = [ts_ms, ts_ms]
+        else:
+            bar[2] = max(bar[2], p)
+            bar[3] = min(bar[3], p)
+            bar[5] += v
+            # without a span (e.g. a warm-started bar) open/close are left as they are
+            if span is not None:
+                if ts_ms < span[0]:
+                    bar[1], span[0] = p, ts_ms
+                if ts_ms >= span[1]:
+                    bar[4], span[1] = p, ts_ms
+        if closed:
+            base.version += 1
+            amended.append((self.base_ms, list(bar)))
+        else:
+            base.partial = list(base.current)
+        for tf in self.timeframes():
+            if tf == self.base_ms:
+                continue
+            level, child = self._levels[tf], self._levels[self._parent[tf]]
+            start = ts_ms - ts_ms % tf
+            parts = []
+            i = len(child.bars) - 1
+            while i >= 0 and child.bars[i][0] >= start:
+                if child.bars[i][0] < start + tf:
+                    parts.append(child.bars[i])
+                i -= 1
+            partial = None
+            for cb in reversed(parts):
+                partial = _merge_bar(partial, cb, start)
+            if level.current is not None and level.current[0] == start:
+                level.partial = partial
+                cur = child.current
+                if cur is not None and start <= cur[0] < start + tf:
+                    level.current = _merge_bar(partial, cur, start)
+                elif partial is not None:
+                    level.current = list(partial)
+            elif partial is not None and _put_bar(level.bars, partial):
+                level.version += 1
+                amended.append((tf, list(partial)))
+        self.late_ticks += 1
+        return amended
+
+    def _propagate(self, tf: int, bar: list, final: bool):
+        events = self._levels[tf].update(bar, final)
+        for child_tf, parent in self._parent.items():
+            if parent != tf:
+                continue
+            for b, f in events:
+                self._propagate(child_tf, b, f)
+
+    def add_ticks(self, ticks: List[Dict[str, Any]]):
+        for t in ticks:
+            try:
+                self.add_tick(iso_to_ms(t["ts"]), t["price"], t.get("size", 0.0))
+            except Exception:
+                continue
+
+    def last_closed(self, timeframe_ms: int) -> Tuple[int, Optional[list]]:
+        """(version, newest closed bar) of a cached level; the version changes whenever a bar closes."""
+        level = self._levels[int(timeframe_ms)]
+        return level.version, (level.bars[-1] if level.bars else None)
+
+    def vol(self, timeframe_ms: int, window: int = 30) -> RollingVol:
+        """Rolling realized-vol tracker for a timeframe (annualized, see analytics.RollingVol)."""
+        key = (int(timeframe_ms), int(window))
+        tr = self._vols.get(key)
+        if tr is None:
+            self.get(key[0])
+            level = self._levels[key[0]]
+            tr = RollingVol(key[1], bar_ms=key[0])
+            for b in list(level.bars)[-(key[1] + 1):]:
+                tr.add_bar(*b[1:5])
+            # copy-on-write: pump() may be iterating these from another thread
+            level.trackers = level.trackers + [tr]
+            self._vols = {**self._vols, key: tr}
+        return tr
+
+    def get(self, timeframe_ms: int) -> pd.DataFrame:
+        tf = int(timeframe_ms)
+        if tf not in self._levels:
+            if tf % self.base_ms != 0:
+                raise ValueError(f"timeframe {tf}ms is not a multiple of base {self.base_ms}ms")
+            child = self._best_child(tf)
+            level = _Level(tf, self.max_bars)
+            level.seed(bars_to_ohlcv(self._levels[child].to_frame(), tf))
+            # `partial` must exclude the child's open bar, which keeps arriving as a non-final update
+            if self._levels[child].current is not None and level.current is not None:
+                level.partial = _rebuild_partial(self._levels[child], tf)
+            self._levels[tf] = level
+            self._parent[tf] = child
+        return self._levels[tf].to_frame()
+
+
+def _rebuild_partial(child: _Level, tf: int) -> Optional[list]:
+    """Fold the child's closed bars that fall in the newest parent bucket (the open child bar is excluded)."""
+    bucket = child.current[0] - child.current[0] % tf
+    closed = []
+    for b in reversed(child.bars):
+        if b[0] - b[0] % tf != bucket:
+            break
+        closed.append(b)
+    acc = None
+    for b in reversed(closed):
+        acc = _merge_bar(acc, b, bucket)
+    return acc
+
+
+# ---------- event-driven (information) bars ----------
+EVENT_BAR_KINDS = ("tick", "volume", "dollar", "imbalance")
+EVENT_BAR_COLUMNS = ["open", "high", "low", "close", "volume", "ticks", "dollar"]
+
+
+def tick_rule(price: np.ndarray, prev_price: Optional[float] = None, prev_sign: float = 1.0) -> np.ndarray:
+    """Aggressor sign per tick: +1 uptick, -1 downtick, unchanged price keeps the previous sign."""
+    p = np.asarray(price, dtype=float)
+    if len(p) == 0:
+        return p
+    d = np.sign(np.diff(p, prepend=p[0] if prev_price is None else prev_price))
+    pos = np.where(d != 0, np.arange(len(d)), -1)
+    np.maximum.accumulate(pos, out=pos)
+    return np.where(pos >= 0, d[np.maximum(pos, 0)], prev_sign)
+
+
+def _event_measure(kind: str, price: np.ndarray, size: np.ndarray) -> np.ndarray:
+    if kind == "tick":
+        return np.ones(len(price))
+    if kind == "volume":
+        return size
+    if kind == "dollar":
+        return price * size
+    raise ValueError(f"unknown event bar kind {kind}")
+
+
+def _imbalance_ids(x: np.ndarray, threshold: float, acc: float = 0.0) -> Tuple[np.ndarray, float, bool]:
+    """Bar ids for signed flow `x`: a bar closes on the tick where |sum since its open| >= threshold.
+    The running sum resets at every close, so bars are found one at a time, each with a vectorised
+    look-ahead window that grows until it contains the crossing.
+    Returns (ids, running sum after the last tick, whether the last tick closed its bar)."""
+    n = len(x)
+    ids = np.empty(n, dtype=np.int64)
+    i = bar = 0
+    w = 256
+    closed = False
+    while i < n:
+        # sequential cumsum seeded with acc: identical rounding to the streaming builder
+        cs = np.cumsum(np.r_[acc, x[i:i + w]])[1:]
+        hit = np.flatnonzero(np.abs(cs) >= threshold)
+        if len(hit):
+            j = i + int(hit[0])
+            ids[i:j + 1] = bar
+            bar += 1
+            acc = 0.0
+            i = j + 1
+            w = 256
+            closed = i == n
+        elif i + w >= n:
+            ids[i:] = bar
+            acc = float(cs[-1])
+            i = n
+        else:
+            w *= 4
+    return ids, acc, closed
+
+
+def _fold_event_bars(ids: np.ndarray, ts_ms: np.ndarray, p: np.ndarray, v: np.ndarray) -> List[list]:
+    first = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]])
+    last = np.r_[first[1:] - 1, len(ids) - 1]
+    arr = np.column_stack([
+        ts_ms[first].astype(float), p[first], np.maximum.reduceat(p, first), np.minimum.reduceat(p, first),
+        p[last], np.add.reduceat(v, first), np.diff(np.r_[first, len(ids)]).astype(float),
+        np.add.reduceat(p * v, first), ts_ms[last].astype(float),
+    ])
+    rows = arr.tolist()
+    for row in rows:
+        row[0], row[8] = int(row[0]), int(row[8])
+    return rows
+
+
+def _event_frame(rows: List[list]) -> pd.DataFrame:
+    if not rows:
+        return pd.DataFrame(columns=EVENT_BAR_COLUMNS + ["close_ts"])
+    arr = np.asarray(rows, dtype=float)
+    df = pd.DataFrame(arr[:, 1:8], columns=EVENT_BAR_COLUMNS,
+                      index=pd.to_datetime(arr[:, 0].astype(np.int64), unit="ms", utc=True))
+    df["close_ts"] = pd.to_datetime(arr[:, 8].astype(np.int64), unit="ms", utc=True)
+    return df
+
+
+def event_bars(ts_ms: np.ndarray, price: np.ndarray, size: np.ndarray, kind: str, threshold: float) -> pd.DataFrame:
+    """
+    Batch tick / volume / dollar / imbalance bars from time-ordered tick arrays.
+    tick/volume/dollar: a bar closes on the tick where its cumulative count/size/notional
+    reaches the next multiple of `threshold` (bucketed from one global cumsum).
+    imbalance: a bar closes when |sum of tick-rule signed size| since its open reaches `threshold`.
+    Index is the bar's first tick; the last bar may still be open. Renders with ohlcv_to_plotly.
+    """
+    b = EventBarBuilder(kind, threshold, max_bars=None)
+    b.load_ticks(ts_ms, price, size)
+    return b.to_frame()
+
+
+class EventBarBuilder:
+    """
+    Streaming counterpart of event_bars(): add_tick() is O(1) and produces the same bars
+    as the batch path (load_ticks() seeds it vectorised, then ticks continue the same state).
+    Rows are [open_ms, open, high, low, close, volume, ticks, dollar, close_ms].
+    """
+
+    def __init__(self, kind: str, threshold: float, max_bars: Optional[int] = 5000):
+        if kind not in EVENT_BAR_KINDS:
+            raise ValueError(f"unknown event bar kind {kind}")
+        if threshold <= 0:
+            raise ValueError("threshold must be positive")
+        self.kind = kind
+        self.threshold = float(threshold)
+        self.bars: deque = deque(maxlen=max_bars)
+        self.current: Optional[list] = None
+        self.version = 0
+        self._cum = 0.0          # global cumulative measure (tick/volume/dollar)
+        self._acc = 0.0          # signed flow since the open of the current bar (imbalance)
+        self._last_price: Optional[float] = None
+        self._sign = 1.0
+        self._frame: Optional[pd.DataFrame] = None
+        self._frame_version = -1
+
+    def load_ticks(self, ts_ms: np.ndarray, price: np.ndarray, size: np.ndarray):
+        """Seed an empty builder from tick arrays (vectorised cumsum bucketing)."""
+        if len(ts_ms) == 0:
+            return
+        ts_ms = np.asarray(ts_ms, dtype=np.int64)
+        p = np.asarray(price, dtype=float)
+        v = np.nan_to_num(np.asarray(size, dtype=float))
+        T = self.threshold
+        if self.kind == "imbalance":
+            signs = tick_rule(p, self._last_price, self._sign)
+            ids, self._acc, last_closed = _imbalance_ids(signs * v, T, self._acc)
+            self._sign = float(signs[-1])
+        else:
+            cum = np.cumsum(np.r_[self._cum, _event_measure(self.kind, p, v)])
+            # a tick belongs to the bar its *preceding* cumulative total falls in
+            ids = np.floor(cum[:-1] / T).astype(np.int64)
+            self._cum = float(cum[-1])
+            last_closed = self._cum >= (ids[-1] + 1) * T
+        rows = _fold_event_bars(ids, ts_ms, p, v)
+        if not last_closed:
+            self.current = rows.pop()
+        self.bars.extend(rows)
+        self._last_price = float(p[-1])
+        self.version += 1
+
+    def add_tick(self, ts_ms: int, price: float, size: float = 0.0) -> Optional[list]:
+        """Fold one tick; returns the bar it closed, if any."""
+        p, v, ts_ms = float(price), float(size or 0.0), int(ts_ms)
+        cur = self.current
+        if cur is None:
+            cur = self.current = [ts_ms, p, p, p, p, 0.0, 0.0, 0.0, ts_ms]
+        else:
+            cur[2] = max(cur[2], p)
+            cur[3] = min(cur[3], p)
+            cur[4] = p
+        cur[5] += v
+        cur[6] += 1.0
+        cur[7] += p * v
+        cur[8] = ts_ms
+        if self.kind == "imbalance":
+            if self._last_price is not None and p != self._last_price:
+                self._sign = 1.0 if p > self._last_price else -1.0
+            self._acc += self._sign * v
+            closed = abs(self._acc) >= self.threshold
+            if closed:
+                self._acc = 0.0
+        else:
+            bar_id = math.floor(self._cum / self.threshold)
+            self._cum += 1.0 if self.kind == "tick" else (v if self.kind == "volume" else p * v)
+            closed = self._cum >= (bar_id + 1) * self.threshold
+        self._last_price = p
+        self.version += 1
+        if closed:
+            self.bars.append(cur)
+            self.current = None
+            return cur
+        return None
+
+    def add_ticks(self, ticks: List[Dict[str, Any]]):
+        for t in ticks:
+            try:
+                self.add_tick(iso_to_ms(t["ts"]), t["price"], t.get("size", 0.0))
+            except Exception:
+                continue
+
+    def to_frame(self) -> pd.DataFrame:
+        """Closed bars plus the open one (OHLCV + ticks, dollar, close_ts), cached per version."""
+        if self._frame_version != self.version:
+            rows = list(self.bars) + ([self.current] if self.current is not None else [])
+            self._frame = _event_frame(rows)
+            self._frame_version = self.version
+        return self._frame
+
+
+# ---------- streaming pair alignment ----------
+class PairAligner:
+    """
+    Streaming as-of alignment of two symbols onto one synchronized grid.
+    - grid_ms set: fixed-interval grid, each point holds the last price seen up to
+      that interval (same as resample(grid).last().ffill() on both legs + dropna)
+    - grid_ms None: event-driven as-of join, one point per tick of either leg
+    - max_staleness_ms: a leg older than this is not forward-filled (point is skipped)
+    Only new grid points are appended; the newest fixed-grid point stays provisional
+    until its interval closes. Arrays are bounded to the last max_points.
+    """
+
+    def __init__(self, left: str, right: str, grid_ms: Optional[int] = 1000,
+                 max_staleness_ms: Optional[int] = None, max_points: int = 5000):
+        self.left = left.upper()
+        self.right = right.upper()
+        self.grid_ms = int(grid_ms) if grid_ms else None
+        self.max_staleness_ms = int(max_staleness_ms) if max_staleness_ms else None
+        self.max_points = int(max_points)
+        cap = 2 * self.max_points
+        self._ts = np.empty(cap, dtype=np.int64)
+        self._vals = np.empty((cap, 2), dtype=float)
+        self._n = 0
+        # per leg: last price, last tick time
+        self._last_px = [np.nan, np.nan]
+        self._last_ts = [None, None]
+        self._open_bin: Optional[int] = None
+        self.version = 0
+
+    def _append(self, ts: np.ndarray, vals: np.ndarray):
+        k = len(ts)
+        if k == 0:
+            return
+        if k >= self.max_points:
+            ts, vals, k = ts[-self.max_points:], vals[-self.max_points:], self.max_points
+        if self._n + k > len(self._ts):
+            # compact: keep the newest points at the front (amortised O(1) per point)
+            keep = self.max_points - k
+            self._ts[:keep] = self._ts[self._n - keep:self._n]
+            self._vals[:keep] = self._vals[self._n - keep:self._n]
+            self._n = keep
+        self._ts[self._n:self._n + k] = ts
+        self._vals[self._n:self._n + k] = vals
+        self._n += k
+        self.version += 1
+
+    def _row_at(self, t: np.ndarray) -> np.ndarray:
+        """Both legs' forward-filled values for grid times t (NaN where stale/unseen)."""
+        out = np.empty((len(t), 2), dtype=float)
+        for i in (0, 1):
+            out[:, i] = self._last_px[i]
+            if self._last_ts[i] is None:
+                out[:, i] = np.nan
+            elif self.max_staleness_ms is not None:
+                out[t - self._last_ts[i] > self.max_staleness_ms, i] = np.nan
+        return out
+
+    def add_tick(self, symbol: str, ts_ms: int, price: float):
+        sym = str(symbol).upper()
+        if sym == self.left:
+            leg = 0
+        elif sym == self.right:
+            leg = 1
+        else:
+            return
+        ts_ms = int(ts_ms)
+        if self._last_ts[leg] is not None and ts_ms < self._last_ts[leg]:
+            # out-of-order tick: never move a leg backwards
+            return
+        if self.grid_ms is None:
+            self._last_px[leg] = float(price)
+            self._last_ts[leg] = ts_ms
+            row = self._row_at(np.array([ts_ms]))
+            if not np.isnan(row).any():
+                self._append(np.array([ts_ms], dtype=np.int64), row)
+            return
+        b = ts_ms - ts_ms % self.grid_ms
+        if self._open_bin is not None and b > self._open_bin:
+            # finalise the open bin and forward-fill every grid point up to (excluding) b
+            if self._n and self._ts[self._n - 1] == self._open_bin:
+                self._n -= 1
+            grid = np.arange(self._open_bin, b, self.grid_ms, dtype=np.int64)
+            if len(grid) > self.max_points:
+                grid = grid[-self.max_points:]
+            rows = self._row_at(grid)
+            ok = ~np.isnan(rows).any(axis=1)
+            self._append(grid[ok], rows[ok])
+        elif self._open_bin is not None and b < self._open_bin:
+            b = self._open_bin
+        self._open_bin = b
+        self._last_px[leg] = float(price)
+        self._last_ts[leg] = ts_ms
+        # provisional point for the still-open bin
+        if self._n and self._ts[self._n - 1] == b:
+            self._n -= 1
+        row = self._row_at(np.array([b], dtype=np.int64))
+        if not np.isnan(row).any():
+            self._append(np.array([b], dtype=np.int64), row)
+
+    def add_ticks(self, ticks: List[Dict[str, Any]]):
+        for t in ticks:
+            try:
+                self.add_tick(t["symbol"], iso_to_ms(t["ts"]), t["price"])
+            except Exception:
+                continue
+
+    def load(self, ts_left: np.ndarray, px_left: np.ndarray, ts_right: np.ndarray, px_right: np.ndarray):
+        """Bulk-seed an empty aligner from each leg's time-ordered ticks (vectorised as-of join)."""
+        if self.grid_ms is None or len(ts_left) == 0 or len(ts_right) == 0:
+            events = sorted([(int(t), self.left, p) for t, p in zip(ts_left, px_left)] +
+                            [(int(t), self.right, p) for t, p in zip(ts_right, px_right)], key=lambda e: e[0])
+            for t, sym, p in events:
+                self.add_tick(sym, t, p)
+            return
+        legs = [(np.asarray(ts_left, dtype=np.int64), np.asarray(px_left, dtype=float)),
+                (np.asarray(ts_right, dtype=np.int64), np.asarray(px_right, dtype=float))]
+        start = max(int(ts[0]) for ts, _ in legs)
+        end = max(int(ts[-1]) for ts, _ in legs)
+        grid = np.arange(start - start % self.grid_ms, end - end % self.grid_ms + 1, self.grid_ms, dtype=np.int64)
+        rows = np.empty((len(grid), 2), dtype=float)
+        for i, (ts, px) in enumerate(legs):
+            # last tick strictly before the end of each grid interval
+            pos = np.searchsorted(ts, grid + self.grid_ms, side="left") - 1
+            rows[:, i] = np.where(pos >= 0, px[np.clip(pos, 0, None)], np.nan)
+            if self.max_staleness_ms is not None:
+                rows[(pos >= 0) & (grid - ts[np.clip(pos, 0, None)] > self.max_staleness_ms), i] = np.nan
+            self._last_px[i] = float(px[-1])
+            self._last_ts[i] = int(ts[-1])
+        # drop stale / unseen rows before capping, so the cap counts kept points as streaming does
+        ok = np.flatnonzero(~np.isnan(rows).any(axis=1))[-self.max_points:]
+        self._append(grid[ok], rows[ok])
+        self._open_bin = int(grid[-1])
+
+    def arrays(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """(ts_ms, left, right) views over the aligned grid, oldest first."""
+        lo = max(0, self._n - self.max_points)
+        return self._ts[lo:self._n], self._vals[lo:self._n, 0], self._vals[lo:self._n, 1]
+
+    def to_frame(self) -> pd.DataFrame:
+        ts, l, r = self.arrays()
+        idx = pd.to_datetime(ts, unit="ms", utc=True)
+        return pd.DataFrame({self.left: l.copy(), self.right: r.copy()}, index=idx)
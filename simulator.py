@@ -0,0 +1,239 @@
+# simulator.py
+import argparse
+import asyncio
+import json
+import logging
+import math
+import time
+from typing import Dict, Any, Optional, List
+
+import numpy as np
+import websockets
+
+DEFAULT_SIM_PORT = 9443
+ARRIVALS = ["poisson", "bursty"]
+
+
+def sim_symbols(n: int) -> List[str]:
+    """Synthetic symbol names for load tests: SIM000USDT, SIM001USDT, ..."""
+    return [f"SIM{i:03d}USDT" for i in range(int(n))]
+
+
+def _default_base(symbol: str, rng: np.random.Generator) -> float:
+    s = symbol.lower()
+    if s.startswith("btc"):
+        return 90000.0
+    if s.startswith("eth"):
+        return 3000.0
+    return float(np.round(np.exp(rng.uniform(0.0, 7.0)), 2))
+
+
+class MarketSimulator:
+    """
+    Seedable synthetic trade generator for load tests.
+    - symbols are taken in pairs: leg A's log-price is a GBM driven by a common market factor
+      (correlation `rho`), leg B = beta * A + an OU spread, so every pair is cointegrated;
+      an unpaired last symbol is a plain GBM
+    - arrivals: "poisson" at `rate` trades/s across all symbols, or "bursty": a Markov-modulated
+      Poisson process that switches into bursts of burst_factor x rate
+    - activity is skewed across symbols (weight ~ 1 / rank^activity_skew)
+    - generate(t0_ms, dt_ms) returns one columnar batch; ticks() / wire_messages() turn it into
+      repo tick dicts or Binance @trade / @aggTrade JSON
+    """
+
+    def __init__(self, symbols: List[str], rate: float = 1000.0, arrivals: str = "poisson", seed: Optional[int] = None,
+                 sigma: float = 0.0005, rho: float = 0.5, beta: float = 1.0, ou_theta: float = 0.05, ou_sigma: float = 0.0003,
+                 burst_factor: float = 10.0, burst_on_s: float = 30.0, burst_len_s: float = 2.0, activity_skew: float = 0.5,
+                 bases: Optional[Dict[str, float]] = None):
+        if arrivals not in ARRIVALS:
+            raise ValueError(f"unknown arrivals {arrivals}")
+        self.symbols = [s.upper() for s in symbols]
+        self.rate = float(rate)
+        self.arrivals = arrivals
+        self.seed = seed
+        self.sigma = sigma          # per sqrt(second)
+        self.rho = rho
+        self.beta = beta
+        self.ou_theta = ou_theta    # per second
+        self.ou_sigma = ou_sigma    # per sqrt(second)
+        self.burst_factor = burst_factor
+        self.burst_on_s = burst_on_s
+        self.burst_len_s = burst_len_s
+        self._rng = np.random.default_rng(seed)
+        n = len(self.symbols)
+        bases = bases or {}
+        self.base = np.array([bases.get(s, _default_base(s, self._rng)) for s in self.symbols], dtype=float)
+        self.tick_size = 10.0 ** (np.floor(np.log10(self.base)) - 4)
+        self._log_px = np.log(self.base)
+        self._spread = np.zeros(n)
+        self._is_b = np.zeros(n, dtype=bool)
+        self._is_b[1:n - n % 2:2] = True
+        w = 1.0 / np.arange(1, n + 1) ** activity_skew
+        self._weights = w / w.sum()
+        self._next_id = np.full(n, 1, dtype=np.int64)
+        self._bursting = False
+        self.generated = 0
+
+    def _step_prices(self, dt_s: float):
+        n = len(self.symbols)
+        m = self._rng.standard_normal()
+        z = math.sqrt(self.rho) * m + math.sqrt(1.0 - self.rho) * self._rng.standard_normal(n)
+        a = ~self._is_b
+        self._log_px[a] += -0.5 * self.sigma ** 2 * dt_s + self.sigma * math.sqrt(dt_s) * z[a]
+        if self._is_b.any():
+            idx_b = np.flatnonzero(self._is_b)
+            s = self._spread[idx_b]
+            s += -self.ou_theta * s * dt_s + self.ou_sigma * math.sqrt(dt_s) * self._rng.standard_normal(len(idx_b))
+            self._spread[idx_b] = s
+            idx_a = idx_b - 1
+            self._log_px[idx_b] = (np.log(self.base[idx_b])
+                                   + self.beta * (self._log_px[idx_a] - np.log(self.base[idx_a])) + s)
+
+    def _arrival_rate(self, dt_s: float) -> float:
+        if self.arrivals == "poisson":
+            return self.rate
+        # two-state regime switch; expected burst every burst_on_s, lasting burst_len_s
+        if self._bursting:
+            if self._rng.random() < dt_s / self.burst_len_s:
+                self._bursting = False
+        elif self._rng.random() < dt_s / self.burst_on_s:
+            self._bursting = True
+        return self.rate * (self.burst_factor if self._bursting else 1.0)
+
+    def generate(self, t0_ms: int, dt_ms: int) -> Dict[str, np.ndarray]:
+        """Trades in [t0_ms, t0_ms + dt_ms), time-ordered: ts_ms, sym (index), price, size, id, maker."""
+        dt_s = dt_ms / 1000.0
+        self._step_prices(dt_s)
+        k = int(self._rng.poisson(self._arrival_rate(dt_s) * dt_s))
+        ts = np.sort(self._rng.integers(t0_ms, t0_ms + max(1, int(dt_ms)), k))
+        sym = self._rng.choice(len(self.symbols), size=k, p=self._weights)
+        maker = self._rng.random(k) < 0.5
+        mid = np.exp(self._log_px[sym])
+        tick = self.tick_size[sym]
+        # bid/ask bounce around the mid, on the symbol's tick grid
+        price = np.round((mid + np.where(maker, -0.5, 0.5) * tick) / tick) * tick
+        size = np.round(self._rng.lognormal(-3.0, 1.2, k), 6)
+        # per-symbol sequential trade ids, in time order
+        ids = np.empty(k, dtype=np.int64)
+        if k:
+            order = np.argsort(sym, kind="stable")
+            s_sorted = sym[order]
+            first = np.r_[0, np.flatnonzero(np.diff(s_sorted)) + 1]
+            counts = np.diff(np.r_[first, k])
+            rank = np.arange(k) - np.repeat(first, counts)
+            ids[order] = self._next_id[s_sorted] + rank
+            np.add.at(self._next_id, s_sorted[first], counts)
+        self.generated += k
+        return {"ts_ms": ts, "sym": sym, "price": price, "size": size, "id": ids, "maker": maker}
+
+    def ticks(self, batch: Dict[str, np.ndarray]) -> List[Dict[str, Any]]:
+        """Batch as repo tick dicts ({"symbol", "ts", "price", "size", "trades", "id"})."""
+        iso = np.datetime_as_string(batch["ts_ms"].astype("datetime64[ms]"), unit="ms")
+        syms = self.symbols
+        return [{"symbol": syms[s], "ts": t + "Z", "price": float(p), "size": float(q), "trades": 1, "id": int(i)}
+                for s, t, p, q, i in zip(batch["sym"].tolist(), iso, batch["price"].tolist(), batch["size"].tolist(),
+                                         batch["id"].tolist())]
+
+    def wire_messages(self, batch: Dict[str, np.ndarray], stream: str = "trade") -> List[tuple]:
+        """(symbol index, JSON text) per trade in Binance futures @trade or @aggTrade format."""
+        out = []
+        syms = self.symbols
+        for s, t, p, q, i, m in zip(batch["sym"].tolist(), batch["ts_ms"].tolist(), batch["price"].tolist(),
+                                    batch["size"].tolist(), batch["id"].tolist(), batch["maker"].tolist()):
+            if stream == "aggTrade":
+                msg = {"e": "aggTrade", "E": t, "s": syms[s], "a": i, "p": f"{p:.8f}", "q": f"{q:.6f}",
+                       "f": i, "l": i, "T": t, "m": m}
+            else:
+                msg = {"e": "trade", "E": t, "T": t, "s": syms[s], "t": i, "p": f"{p:.8f}", "q": f"{q:.6f}",
+                       "X": "MARKET", "m": m}
+            out.append((s, json.dumps(msg)))
+        return out
+
+
+class SimulatorServer:
+    """
+    Serves a MarketSimulator over a local websocket in the Binance wire format, so the real
+    ingest path (BinanceIngestor(ws_base_url="ws://127.0.0.1:9443/ws")) can be load tested offline.
+    - one stream per connection: /ws/<symbol>@trade or /ws/<symbol>@aggTrade
+    - trades are generated in real time every step_ms and only encoded for subscribed symbols
+    """
+
+    def __init__(self, sim: MarketSimulator, host: str = "127.0.0.1", port: int = DEFAULT_SIM_PORT, step_ms: int = 20):
+        self.sim = sim
+        self.host = host
+        self.port = port
+        self.step_ms = step_ms
+        self._index = {s.lower(): i for i, s in enumerate(sim.symbols)}
+        self._subs: Dict[tuple, set] = {}
+        self.sent = 0
+        self.clients = 0
+
+    async def _handler(self, ws, path: Optional[str] = None):
+        path = path or getattr(ws, "path", None) or ws.request.path
+        stream = path.rsplit("/", 1)[-1]
+        sym, _, kind = stream.partition("@")
+        idx = self._index.get(sym.lower())
+        if idx is None or kind not in ("trade", "aggTrade"):
+            await ws.close(code=1008, reason="unknown stream")
+            return
+        key = (idx, kind)
+        self._subs.setdefault(key, set()).add(ws)
+        self.clients += 1
+        try:
+            await ws.wait_closed()
+        finally:
+            self._subs[key].discard(ws)
+            self.clients -= 1
+
+    async def _pump(self):
+        t = int(time.time() * 1000)
+        while True:
+            now = int(time.time() * 1000)
+            # fixed-length steps: the RNG draws (and so a seeded run) do not depend on scheduler timing
+            while t + self.step_ms <= now:
+                batch = self.sim.generate(t, self.step_ms)
+                t += self.step_ms
+                for kind in ("trade", "aggTrade"):
+                    wanted = {i for (i, k), subs in self._subs.items() if k == kind and subs}
+                    if not wanted:
+                        continue
+                    m = np.isin(batch["sym"], list(wanted))
+                    sub = {k: v[m] for k, v in batch.items()}
+                    for s, text in self.sim.wire_messages(sub, kind):
+                        for ws in list(self._subs.get((s, kind), ())):
+                            try:
+                                await ws.send(text)
+                                self.sent += 1
+                            except Exception:
+                                self._subs[(s, kind)].discard(ws)
+            await asyncio.sleep(self.step_ms / 4000.0)
+
+    async def run(self):
+        async with websockets.serve(self._handler, self.host, self.port):
+            await self._pump()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"generated": self.sim.generated, "sent": self.sent, "clients": self.clients}
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Synthetic trade feed in the Binance websocket format")
+    ap.add_argument("--symbols", default="btcusdt,ethusdt", help="comma list, or a number N for SIM000USDT..")
+    ap.add_argument("--rate", type=float, default=1000.0, help="trades per second across all symbols")
+    ap.add_argument("--arrivals", choices=ARRIVALS, default="poisson")
+    ap.add_argument("--seed", type=int, default=None)
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=DEFAULT_SIM_PORT)
+    args = ap.parse_args()
+    logging.basicConfig(level=logging.INFO, format="[%(asctime)s] %(levelname)s: %(message)s")
+    syms = sim_symbols(int(args.symbols)) if args.symbols.isdigit() else [s.strip() for s in args.symbols.split(",") if s.strip()]
+    server = SimulatorServer(MarketSimulator(syms, rate=args.rate, arrivals=args.arrivals, seed=args.seed), args.host, args.port)
+    logging.info(f"serving {len(syms)} symbols at ws://{args.host}:{args.port}/ws/<symbol>@trade, {args.rate:g} trades/s")
+    try:
+        asyncio.run(server.run())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
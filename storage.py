@@ -1,11 +1,21 @@
 # storage.py
 import aiosqlite
 import asyncio
+import glob
+import heapq
 import os
-from typing import Dict, Any, Optional, List
-from datetime import datetime
+import queue
+import sqlite3
+import threading
+import time
+import zlib
+import numpy as np
+from typing import Dict, Any, Optional, List, Tuple
+from datetime import datetime, timedelta
 import csv
 
+from profiler import PROFILER
+
 DB_SCHEMA = """
 CREATE TABLE IF NOT EXISTS ticks (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -13,11 +23,392 @@ CREATE TABLE IF NOT EXISTS ticks (
     ts TEXT NOT NULL,
     price REAL NOT NULL,
     size REAL,
+    trades INTEGER DEFAULT 1,
     created_at TEXT DEFAULT (datetime('now'))
 );
 CREATE INDEX IF NOT EXISTS idx_ticks_symbol_ts ON ticks(symbol, ts);
+CREATE TABLE IF NOT EXISTS bars_1m (
+    symbol TEXT NOT NULL,
+    ts TEXT NOT NULL,
+    open REAL NOT NULL,
+    high REAL NOT NULL,
+    low REAL NOT NULL,
+    close REAL NOT NULL,
+    volume REAL,
+    trades INTEGER,
+    PRIMARY KEY (symbol, ts)
+);
 """
 
+# named read queries; each pooled connection keeps them in its prepared-statement cache
+READ_QUERIES = {
+    "recent": "SELECT symbol, ts, price, size FROM ticks ORDER BY id DESC LIMIT ?",
+    "recent_symbol": "SELECT symbol, ts, price, size FROM ticks WHERE symbol = ? ORDER BY id DESC LIMIT ?",
+    "range": "SELECT symbol, ts, price, size FROM ticks WHERE symbol = ? AND ts >= ? AND ts < ? ORDER BY ts",
+    "symbols": "SELECT DISTINCT symbol FROM ticks",
+    "count": "SELECT COUNT(*) AS n FROM ticks",
+}
+
+
+class ReadPool:
+    """
+    Small pool of read-only aiosqlite connections for WAL readers.
+    - each connection runs on its own thread, so up to `size` queries run in parallel
+      and never wait on the writer connection (WAL readers don't block the writer)
+    - acquiring a connection bounds concurrency; callers beyond `size` wait their turn
+    - per-query wall time is recorded under the query name (see stats())
+    """
+
+    def __init__(self, path: str, size: int = 4, statement_cache: int = 64):
+        self.path = path
+        self.size = max(1, int(size))
+        self.statement_cache = statement_cache
+        self._free: Optional[asyncio.Queue] = None
+        self._conns: List[aiosqlite.Connection] = []
+        self._stats: Dict[str, Dict[str, float]] = {}
+
+    async def start(self):
+        if self._free is not None:
+            return
+        self._free = asyncio.Queue()
+        uri = f"file:{os.path.abspath(self.path)}?mode=ro"
+        for _ in range(self.size):
+            conn = await aiosqlite.connect(uri, uri=True, timeout=30.0, cached_statements=self.statement_cache)
+            conn.row_factory = aiosqlite.Row
+            await conn.execute("PRAGMA query_only=ON;")
+            await conn.execute("PRAGMA busy_timeout=5000;")
+            self._conns.append(conn)
+            self._free.put_nowait(conn)
+
+    async def query(self, name: str, params: Tuple = (), timeout: Optional[float] = None) -> List[Dict[str, Any]]:
+        """Run a named READ_QUERIES entry (or raw SQL) on a pooled connection."""
+        if self._free is None:
+            await self.start()
+        sql = READ_QUERIES.get(name, name)
+        conn = await asyncio.wait_for(self._free.get(), timeout=timeout)
+        t0 = time.perf_counter()
+        try:
+            cur = await conn.execute(sql, params)
+            rows = await cur.fetchall()
+            await cur.close()
+            return [dict(r) for r in rows]
+        finally:
+            self._record(name, time.perf_counter() - t0)
+            self._free.put_nowait(conn)
+
+    def _record(self, name: str, secs: float):
+        s = self._stats.setdefault(name, {"count": 0, "total_ms": 0.0, "max_ms": 0.0, "last_ms": 0.0})
+        ms = secs * 1000.0
+        s["count"] += 1
+        s["total_ms"] += ms
+        s["last_ms"] = ms
+        s["max_ms"] = max(s["max_ms"], ms)
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        out = {}
+        for name, s in self._stats.items():
+            out[name] = dict(s, avg_ms=s["total_ms"] / s["count"] if s["count"] else 0.0)
+        return out
+
+    async def close(self):
+        for conn in self._conns:
+            try:
+                await conn.close()
+            except Exception:
+                pass
+        self._conns = []
+        self._free = None
+
+# minute bars from aged ticks; ts is the minute prefix "YYYY-MM-DDTHH:MM" of the tick ISO timestamps
+ROLLUP_SQL = """
+INSERT INTO bars_1m (symbol, ts, open, high, low, close, volume, trades)
+SELECT g.symbol, g.m,
+       (SELECT price FROM ticks WHERE id = g.first_id), g.hi, g.lo,
+       (SELECT price FROM ticks WHERE id = g.last_id), g.vol, g.n
+FROM (
+    SELECT symbol, substr(ts, 1, 16) AS m, MIN(id) AS first_id, MAX(id) AS last_id,
+           MAX(price) AS hi, MIN(price) AS lo, SUM(size) AS vol, SUM(COALESCE(trades, 1)) AS n
+    FROM ticks WHERE symbol = ? AND ts >= ? AND ts < ? AND id <= ?
+    GROUP BY m
+) g WHERE true
+ON CONFLICT(symbol, ts) DO UPDATE SET
+    high = max(high, excluded.high), low = min(low, excluded.low), close = excluded.close,
+    volume = volume + excluded.volume, trades = trades + excluded.trades
+"""
+
+
+class StorageMaintenance:
+    """
+    Background retention / compaction jobs for the ticks database.
+    Every `interval_s` seconds, per symbol:
+      - ticks older than the symbol's retention are rolled up into bars_1m (whole minutes only)
+      - each slice (up to `slice_minutes`, shrunk to about `delete_chunk` rows but never below one
+        minute) is rolled up and deleted in one transaction, so an interrupted pass can never roll
+        the same ticks up twice; a pause between slices keeps the batch writer from being held up long
+    Then a passive WAL checkpoint and an incremental vacuum of up to `vacuum_pages` pages run.
+    Runs on its own connection so its transactions never mix with the writer's batches.
+    retention_s: default retention in seconds (None = keep everything)
+    retention_overrides: {SYMBOL: seconds or None}
+    """
+
+    def __init__(self, path: str, retention_s: Optional[float] = None, retention_overrides: Optional[Dict[str, Optional[float]]] = None,
+                 interval_s: float = 300.0, slice_minutes: int = 10, delete_chunk: int = 2000,
+                 chunk_pause_s: float = 0.05, vacuum_pages: int = 1000):
+        self.path = path
+        self.retention_s = retention_s
+        self.retention_overrides = {k.upper(): v for k, v in (retention_overrides or {}).items()}
+        self.interval_s = interval_s
+        self.slice_minutes = max(1, int(slice_minutes))
+        self.delete_chunk = max(1, int(delete_chunk))
+        self.chunk_pause_s = chunk_pause_s
+        self.vacuum_pages = vacuum_pages
+        self._task: Optional[asyncio.Task] = None
+        self._running = False
+        self.last_run: Dict[str, Any] = {}
+
+    def retention_for(self, symbol: str) -> Optional[float]:
+        return self.retention_overrides.get(symbol.upper(), self.retention_s)
+
+    def start(self):
+        self._running = True
+        self._task = asyncio.get_running_loop().create_task(self._loop())
+
+    async def stop(self):
+        self._running = False
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except BaseException:
+                pass
+            self._task = None
+
+    async def _loop(self):
+        while self._running:
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.last_run = {"error": str(e), "at": datetime.utcnow().isoformat()}
+            await asyncio.sleep(self.interval_s)
+
+    async def run_once(self, now: Optional[datetime] = None) -> Dict[str, Any]:
+        """Run one maintenance pass; returns a summary (also kept in last_run)."""
+        if not os.path.exists(self.path):
+            return {}
+        now = now or datetime.utcnow()
+        t0 = time.perf_counter()
+        summary: Dict[str, Any] = {"rolled_minutes": 0, "deleted": 0, "symbols": {}}
+        db = await aiosqlite.connect(self.path, timeout=30.0)
+        try:
+            await db.execute("PRAGMA busy_timeout=5000;")
+            cur = await db.execute("SELECT DISTINCT symbol FROM ticks")
+            symbols = [r[0] for r in await cur.fetchall()]
+            for sym in symbols:
+                keep = self.retention_for(sym)
+                if keep is None:
+                    continue
+                # only whole minutes are rolled up, so a bar never mixes kept and deleted ticks
+                cutoff = (now - timedelta(seconds=float(keep))).strftime("%Y-%m-%dT%H:%M")
+                rolled, deleted = await self._expire_symbol(db, sym, cutoff)
+                summary["rolled_minutes"] += rolled
+                summary["deleted"] += deleted
+                summary["symbols"][sym] = {"cutoff": cutoff, "rolled_minutes": rolled, "deleted": deleted}
+            await db.execute("PRAGMA wal_checkpoint(PASSIVE);")
+            cur = await db.execute("PRAGMA auto_vacuum;")
+            mode = (await cur.fetchone())[0]
+            if mode == 2 and self.vacuum_pages:
+                await db.execute(f"PRAGMA incremental_vacuum({int(self.vacuum_pages)});")
+            summary["incremental_vacuum"] = mode == 2
+        finally:
+            await db.close()
+        summary["secs"] = time.perf_counter() - t0
+        summary["at"] = now.isoformat()
+        self.last_run = summary
+        return summary
+
+    async def _expire_symbol(self, db: aiosqlite.Connection, sym: str, cutoff: str) -> Tuple[int, int]:
+        cur = await db.execute("SELECT MIN(ts), MAX(id) FROM ticks WHERE symbol = ? AND ts < ?", (sym, cutoff))
+        oldest, max_id = await cur.fetchone()
+        if oldest is None:
+            return 0, 0
+        rolled = deleted = 0
+        start = datetime.strptime(oldest[:16], "%Y-%m-%dT%H:%M")
+        end = datetime.strptime(cutoff, "%Y-%m-%dT%H:%M")
+        while start < end and self._running_or_manual():
+            # jump over gaps (e.g. days without ingestion) instead of walking empty slices
+            cur = await db.execute("SELECT MIN(ts) FROM ticks WHERE symbol = ? AND ts >= ? AND ts < ?",
+                                   (sym, start.strftime("%Y-%m-%dT%H:%M"), cutoff))
+            nxt = (await cur.fetchone())[0]
+            if nxt is None:
+                break
+            start = max(start, datetime.strptime(nxt[:16], "%Y-%m-%dT%H:%M"))
+            stop = min(start + timedelta(minutes=self.slice_minutes), end)
+            lo = start.strftime("%Y-%m-%dT%H:%M")
+            # shrink busy slices to ~delete_chunk rows (whole minutes, at least one)
+            cur = await db.execute("SELECT ts FROM ticks WHERE symbol = ? AND ts >= ? AND ts < ? ORDER BY ts LIMIT 1 OFFSET ?",
+                                   (sym, lo, stop.strftime("%Y-%m-%dT%H:%M"), self.delete_chunk))
+            row = await cur.fetchone()
+            if row is not None:
+                stop = max(start + timedelta(minutes=1), datetime.strptime(row[0][:16], "%Y-%m-%dT%H:%M"))
+            hi = stop.strftime("%Y-%m-%dT%H:%M")
+            # rollup and delete commit together: the upsert adds volume/trades, so a rolled-up
+            # slice whose ticks survived (cancel, failed delete) would be counted twice next pass.
+            # ids above max_id arrived after we looked; they are left for the next pass
+            await db.execute("BEGIN")
+            try:
+                cur = await db.execute(ROLLUP_SQL, (sym, lo, hi, max_id))
+                n_rolled = max(cur.rowcount, 0)
+                cur = await db.execute("DELETE FROM ticks WHERE symbol = ? AND ts >= ? AND ts < ? AND id <= ?",
+                                       (sym, lo, hi, max_id))
+                n_deleted = max(cur.rowcount, 0)
+                await db.commit()
+            except BaseException:
+                await db.rollback()
+                raise
+            rolled += n_rolled
+            deleted += n_deleted
+            start = stop
+            await asyncio.sleep(self.chunk_pause_s)
+        return rolled, deleted
+
+    def _running_or_manual(self) -> bool:
+        # run_once() may be called directly without start()
+        return self._running or self._task is None
+
+
+def shard_paths(path: str, shards: int) -> List[str]:
+    """Shard files of a sharded tick store: ticks.db -> ticks.shard0-of-4.db, ..."""
+    stem, ext = os.path.splitext(path)
+    return [f"{stem}.shard{i}-of-{int(shards)}{ext or '.db'}" for i in range(int(shards))]
+
+
+def shard_index(symbol: str, shards: int) -> int:
+    # stable across processes (unlike hash())
+    return zlib.crc32(symbol.upper().encode("utf-8")) % int(shards)
+
+
+def tick_db_paths(path: str) -> List[str]:
+    """Every existing tick database behind `path`: the single file and/or its shard files."""
+    stem, ext = os.path.splitext(path)
+    paths = [path] if os.path.exists(path) else []
+    return paths + sorted(glob.glob(glob.escape(stem) + ".shard*-of-*" + (ext or ".db")))
+
+
+def load_recent_ticks(path: str, symbols: List[str], minutes: float) -> Dict[str, Dict[str, np.ndarray]]:
+    """
+    Columnar bulk read for warm starts (synchronous, read-only connections).
+    For each symbol returns the ticks of the last `minutes` before that symbol's newest
+    stored tick, oldest first, as arrays: ts (ISO str), ts_ms (int64), price, size.
+    Reads the single file and any shard files behind `path`.
+    """
+    out: Dict[str, Dict[str, np.ndarray]] = {}
+    paths = tick_db_paths(path)
+    if not paths:
+        return out
+    conns = [sqlite3.connect(f"file:{os.path.abspath(p)}?mode=ro", uri=True, timeout=5.0) for p in paths]
+    try:
+        for sym in symbols:
+            sym = sym.upper()
+            newest = max((c.execute("SELECT MAX(ts) FROM ticks WHERE symbol = ?", (sym,)).fetchone()[0] or "" for c in conns), default="")
+            if not newest:
+                continue
+            newest_ms = np.datetime64(newest.rstrip("Z"), "ms")
+            since = str(newest_ms - np.timedelta64(int(minutes * 60000), "ms"))
+            rows = []
+            for c in conns:
+                rows.extend(c.execute("SELECT ts, price, size FROM ticks WHERE symbol = ? AND ts >= ? ORDER BY ts", (sym, since)).fetchall())
+            if not rows:
+                continue
+            if len(conns) > 1:
+                rows.sort(key=lambda r: r[0])
+            ts, price, size = zip(*rows)
+            ts = np.asarray(ts, dtype=object)
+            out[sym] = {
+                "ts": ts,
+                "ts_ms": np.array([t.rstrip("Z") for t in ts], dtype="datetime64[ms]").astype(np.int64),
+                "price": np.asarray(price, dtype=float),
+                "size": np.asarray([s or 0.0 for s in size], dtype=float),
+            }
+    finally:
+        for c in conns:
+            c.close()
+    return out
+
+
+CSV_HEADER = ["symbol", "ts", "price", "size", "trades"]
+_csv_checked: set = set()
+
+
+def _csv_needs_header(path: str) -> bool:
+    """True for a new file. A file from before the trades column is moved aside (*.legacy.csv) once."""
+    if not os.path.exists(path):
+        return True
+    if path not in _csv_checked:
+        _csv_checked.add(path)
+        with open(path, "r", encoding="utf-8") as f:
+            first = f.readline().strip().split(",")
+        if first != CSV_HEADER:
+            os.replace(path, path[:-4] + ".legacy.csv")
+            return True
+    return False
+
+
+def _csv_row(t: Dict[str, Any]) -> list:
+    # coalesced ticks (merge / aggtrade) carry the number of trades they stand for
+    return [t.get("symbol"), t.get("ts"), t.get("price"), t.get("size", 0.0), int(t.get("trades", 1))]
+
+
+def _append_ticks_csv(csv_dir: str, batch: List[Dict[str, Any]], all_lock: Optional[threading.Lock] = None):
+    """
+    Append ticks to csv_dir/ticks_all.csv (global) and csv_dir/{SYMBOL}.csv (per-symbol).
+    `all_lock` serialises the shared global file when several writers append concurrently.
+    """
+    header = CSV_HEADER
+    all_path = os.path.join(csv_dir, "ticks_all.csv")
+    # open global combined file in append mode
+    try:
+        if all_lock is not None:
+            all_lock.acquire()
+        try:
+            first_all = _csv_needs_header(all_path)
+            with open(all_path, "a", newline="", encoding="utf-8") as f_all:
+                writer_all = csv.writer(f_all)
+                if first_all:
+                    writer_all.writerow(header)
+                for t in batch:
+                    writer_all.writerow(_csv_row(t))
+        finally:
+            if all_lock is not None:
+                all_lock.release()
+    except Exception:
+        # best-effort: ignore CSV write errors
+        pass
+
+    # per-symbol files (group by symbol to minimize opens)
+    per_sym = {}
+    for t in batch:
+        sym = str(t.get("symbol") or "UNKNOWN").upper()
+        if sym not in per_sym:
+            per_sym[sym] = []
+        per_sym[sym].append(t)
+
+    for sym, rows in per_sym.items():
+        try:
+            sym_file = os.path.join(csv_dir, f"{sym}.csv")
+            first_sym = _csv_needs_header(sym_file)
+            with open(sym_file, "a", newline="", encoding="utf-8") as f_sym:
+                writer = csv.writer(f_sym)
+                if first_sym:
+                    writer.writerow(header)
+                for t in rows:
+                    writer.writerow(_csv_row(t))
+        except Exception:
+            # ignore per-symbol write failures
+            pass
+
+
 class AsyncStorage:
     """
     Async storage manager using aiosqlite with a background writer queue.
@@ -27,16 +418,22 @@ class AsyncStorage:
       - start(): initialize DB and spawn writer task
       - enqueue_tick(tick): push tick to writer queue (async)
       - close(): flush queue and close DB
-      - fetch_recent(limit): async read
+      - fetch_recent(limit, symbol): async read through the read pool
+      - fetch_range(symbol, start_ts, end_ts): async range read through the read pool
+      - query_stats(): per-query timing of pooled reads
+    Pass `maintenance` (a StorageMaintenance) to run retention/compaction in the background.
     """
 
-    def __init__(self, path: Optional[str] = "ticks.db", csv_dir: Optional[str] = "csv_data"):
+    def __init__(self, path: Optional[str] = "ticks.db", csv_dir: Optional[str] = "csv_data", read_pool_size: int = 4,
+                 maintenance: Optional[StorageMaintenance] = None):
         self.path = path or "ticks.db"
         self.csv_dir = csv_dir or "csv_data"
         self._queue: asyncio.Queue = asyncio.Queue()
         self._task: Optional[asyncio.Task] = None
         self._db: Optional[aiosqlite.Connection] = None
         self._running = False
+        self._pool = ReadPool(self.path, size=read_pool_size)
+        self.maintenance = maintenance
         os.makedirs(self.csv_dir, exist_ok=True)
 
     async def start(self):
@@ -45,17 +442,31 @@ class AsyncStorage:
         db_dir = os.path.dirname(os.path.abspath(self.path))
         os.makedirs(db_dir, exist_ok=True)
         self._db = await aiosqlite.connect(self.path, timeout=30.0)
+        # incremental auto-vacuum only takes effect on a new database (before tables exist)
+        await self._db.execute("PRAGMA auto_vacuum=INCREMENTAL;")
         # use WAL and busy timeout to reduce locks
         await self._db.execute("PRAGMA journal_mode=WAL;")
         await self._db.execute("PRAGMA synchronous=NORMAL;")
         await self._db.execute("PRAGMA busy_timeout=5000;")
         # initialize schema
         await self._db.executescript(DB_SCHEMA)
+        # databases created before coalescing have no trades column (existing rows count as 1 trade)
+        async with self._db.execute("PRAGMA table_info(ticks)") as cur:
+            cols = [row[1] for row in await cur.fetchall()]
+        if "trades" not in cols:
+            await self._db.execute("ALTER TABLE ticks ADD COLUMN trades INTEGER DEFAULT 1")
         await self._db.commit()
+        # read-only connections can only open once the file and schema exist
+        try:
+            await self._pool.start()
+        except Exception:
+            pass
         self._running = True
         # spawn writer task on current loop
         loop = asyncio.get_running_loop()
         self._task = loop.create_task(self._writer_loop())
+        if self.maintenance is not None:
+            self.maintenance.start()
 
     async def _writer_loop(self):
         """Consume queue and write to sqlite in batches; also append to CSVs using thread executor."""
@@ -77,16 +488,21 @@ class AsyncStorage:
                     except asyncio.QueueEmpty:
                         break
 
-                # write batch to sqlite transaction
-                try:
-                    await self._db.execute("BEGIN")
-                    stmt = "INSERT INTO ticks (symbol, ts, price, size) VALUES (?, ?, ?, ?)"
+                # only the row building is timed: thread_time() across the awaits below would also
+                # charge every other coroutine that runs on the loop meanwhile
+                with PROFILER.section("storage.write"):
+                    rows = []
                     for t in batch:
                         try:
-                            await self._db.execute(stmt, (t['symbol'], t['ts'], float(t['price']), float(t.get('size', 0.0))))
+                            rows.append((t['symbol'], t['ts'], float(t['price']), float(t.get('size', 0.0)),
+                                         int(t.get('trades', 1))))
                         except Exception:
                             # ignore per-row failures
                             continue
+                # write batch to sqlite transaction (runs on aiosqlite's thread)
+                try:
+                    await self._db.execute("BEGIN")
+                    await self._db.executemany("INSERT INTO ticks (symbol, ts, price, size, trades) VALUES (?, ?, ?, ?, ?)", rows)
                     await self._db.commit()
                 except Exception:
                     # attempt to rollback in case of error
@@ -114,43 +530,7 @@ class AsyncStorage:
          - csv_dir/ticks_all.csv  (global)
          - csv_dir/{SYMBOL}.csv   (per-symbol)
         """
-        # header for CSV files
-        header = ["symbol", "ts", "price", "size"]
-        all_path = os.path.join(self.csv_dir, "ticks_all.csv")
-        # open global combined file in append mode
-        try:
-            first_all = not os.path.exists(all_path)
-            with open(all_path, "a", newline="", encoding="utf-8") as f_all:
-                writer_all = csv.writer(f_all)
-                if first_all:
-                    writer_all.writerow(header)
-                for t in batch:
-                    writer_all.writerow([t.get("symbol"), t.get("ts"), t.get("price"), t.get("size", 0.0)])
-        except Exception:
-            # best-effort: ignore CSV write errors
-            pass
-
-        # per-symbol files (group by symbol to minimize opens)
-        per_sym = {}
-        for t in batch:
-            sym = str(t.get("symbol") or "UNKNOWN").upper()
-            if sym not in per_sym:
-                per_sym[sym] = []
-            per_sym[sym].append(t)
-
-        for sym, rows in per_sym.items():
-            try:
-                sym_file = os.path.join(self.csv_dir, f"{sym}.csv")
-                first_sym = not os.path.exists(sym_file)
-                with open(sym_file, "a", newline="", encoding="utf-8") as f_sym:
-                    writer = csv.writer(f_sym)
-                    if first_sym:
-                        writer.writerow(header)
-                    for t in rows:
-                        writer.writerow([t.get("symbol"), t.get("ts"), t.get("price"), t.get("size", 0.0)])
-            except Exception:
-                # ignore per-symbol write failures
-                pass
+        _append_ticks_csv(self.csv_dir, batch)
 
     async def enqueue_tick(self, tick: Dict[str, Any]):
         """Put a tick into the write queue (async)."""
@@ -159,9 +539,18 @@ class AsyncStorage:
         except Exception:
             pass
 
+    def enqueue_tick_nowait(self, tick: Dict[str, Any]):
+        """Synchronous form of enqueue_tick (the queue is unbounded)."""
+        try:
+            self._queue.put_nowait(tick)
+        except Exception:
+            pass
+
     async def close(self):
         """Stop writer, flush remaining items and close DB."""
         self._running = False
+        if self.maintenance is not None:
+            await self.maintenance.stop()
         # give writer a short moment to flush
         if self._task:
             try:
@@ -182,23 +571,239 @@ class AsyncStorage:
             except Exception:
                 pass
             self._db = None
+        await self._pool.close()
 
-    async def fetch_recent(self, limit: int = 500) -> List[Dict[str, Any]]:
-        """Fetch recent ticks (async)."""
+    async def fetch_recent(self, limit: int = 500, symbol: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Fetch recent ticks (async, pooled read-only connection)."""
         if not os.path.exists(self.path):
             return []
-        # try to use open connection if available
-        if self._db:
+        if symbol:
+            return await self._pool.query("recent_symbol", (symbol.upper(), limit))
+        return await self._pool.query("recent", (limit,))
+
+    async def fetch_range(self, symbol: str, start_ts: str, end_ts: str) -> List[Dict[str, Any]]:
+        """Fetch one symbol's ticks with start_ts <= ts < end_ts (ISO strings), oldest first."""
+        if not os.path.exists(self.path):
+            return []
+        return await self._pool.query("range", (symbol.upper(), start_ts, end_ts))
+
+    async def fetch_range_many(self, symbols: List[str], start_ts: str, end_ts: str) -> List[Dict[str, Any]]:
+        """Several symbols' ranges, read concurrently and merged by ts."""
+        parts = await asyncio.gather(*(self.fetch_range(s, start_ts, end_ts) for s in symbols))
+        return list(heapq.merge(*parts, key=lambda r: r["ts"]))
+
+    async def fetch_many(self, requests: List[Tuple[str, Tuple]]) -> List[List[Dict[str, Any]]]:
+        """Run several named queries concurrently (bounded by the pool size)."""
+        if not os.path.exists(self.path):
+            return [[] for _ in requests]
+        return list(await asyncio.gather(*(self._pool.query(name, params) for name, params in requests)))
+
+    def query_stats(self) -> Dict[str, Dict[str, float]]:
+        return self._pool.stats()
+
+
+def init_tick_db(path: str):
+    """Create / migrate a tick database synchronously (same schema and pragmas as AsyncStorage.start)."""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30.0)
+    try:
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL;")
+        conn.execute("PRAGMA journal_mode=WAL;")
+        conn.executescript(DB_SCHEMA)
+        cols = [row[1] for row in conn.execute("PRAGMA table_info(ticks)")]
+        if "trades" not in cols:
+            conn.execute("ALTER TABLE ticks ADD COLUMN trades INTEGER DEFAULT 1")
+        conn.commit()
+    finally:
+        conn.close()
+
+
+class _ShardWriter:
+    """
+    One shard's write path: a batch queue drained by a dedicated thread that owns the
+    shard's sqlite3 connection (SQLite releases the GIL while it works, so shards commit in parallel).
+    """
+
+    INSERT = "INSERT INTO ticks (symbol, ts, price, size, trades) VALUES (?, ?, ?, ?, ?)"
+
+    def __init__(self, path: str, csv_dir: Optional[str] = None, csv_lock: Optional[threading.Lock] = None,
+                 batch_size: int = 5000):
+        self.path = path
+        self.csv_dir = csv_dir
+        self.csv_lock = csv_lock
+        self.batch_size = batch_size
+        self.q: "queue.Queue[Optional[Dict[str, Any]]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self.written = 0
+        self.batches = 0
+        self.busy_s = 0.0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def put(self, tick: Dict[str, Any]):
+        self.q.put_nowait(tick)
+
+    def _run(self):
+        conn = sqlite3.connect(self.path, timeout=30.0)
+        conn.execute("PRAGMA synchronous=NORMAL;")
+        conn.execute("PRAGMA busy_timeout=5000;")
+        stop = False
+        while not stop:
+            item = self.q.get()
+            if item is None:
+                break
+            batch = [item]
+            while len(batch) < self.batch_size:
+                try:
+                    item = self.q.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            t0 = time.perf_counter()
+            with PROFILER.section("storage.write"):
+                try:
+                    rows = []
+                    for t in batch:
+                        try:
+                            rows.append((t["symbol"], t["ts"], float(t["price"]), float(t.get("size", 0.0)), int(t.get("trades", 1))))
+                        except Exception:
+                            # ignore per-row failures
+                            continue
+                    conn.executemany(self.INSERT, rows)
+                    conn.commit()
+                    self.written += len(rows)
+                    self.batches += 1
+                except Exception:
+                    try:
+                        conn.rollback()
+                    except Exception:
+                        pass
+            self.busy_s += time.perf_counter() - t0
+            if self.csv_dir:
+                _append_ticks_csv(self.csv_dir, batch, self.csv_lock)
+        conn.close()
+
+    def stop(self, timeout: float = 5.0):
+        if self._thread is not None:
+            self.q.put(None)
+            self._thread.join(timeout=timeout)
+            self._thread = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {"path": self.path, "queued": self.q.qsize(), "written": self.written, "batches": self.batches,
+                "busy_s": round(self.busy_s, 3)}
+
+
+class ShardedStorage:
+    """
+    Tick storage split over K SQLite files for large symbol universes, where one writer
+    connection is the ceiling.
+    - symbols map to shards by crc32 (stable across runs); files are shard_paths(path, K)
+    - each shard has its own batch queue and writer thread with its own connection
+    - reads fan out: per-symbol queries go to the symbol's shard only, cross-symbol ones run on
+      every shard concurrently and are merged by ts
+    - same interface as AsyncStorage (start / enqueue_tick / close / fetch_* / query_stats)
+    Retention/compaction runs one StorageMaintenance per shard.
+    """
+
+    def __init__(self, path: Optional[str] = "ticks.db", shards: int = 4, csv_dir: Optional[str] = "csv_data",
+                 read_pool_size: int = 2, retention_s: Optional[float] = None,
+                 retention_overrides: Optional[Dict[str, Optional[float]]] = None, batch_size: int = 5000):
+        self.path = path or "ticks.db"
+        self.shards = max(1, int(shards))
+        self.paths = shard_paths(self.path, self.shards)
+        self.csv_dir = csv_dir
+        if csv_dir:
+            os.makedirs(csv_dir, exist_ok=True)
+        csv_lock = threading.Lock()
+        self._writers = [_ShardWriter(p, csv_dir, csv_lock, batch_size) for p in self.paths]
+        self._pools = [ReadPool(p, size=read_pool_size) for p in self.paths]
+        self.maintenance = [StorageMaintenance(p, retention_s=retention_s, retention_overrides=retention_overrides)
+                            for p in self.paths] if (retention_s or retention_overrides) else []
+        self._shard_of: Dict[str, int] = {}
+
+    def shard_of(self, symbol: str) -> int:
+        i = self._shard_of.get(symbol)
+        if i is None:
+            i = self._shard_of[symbol] = shard_index(symbol, self.shards)
+        return i
+
+    async def start(self):
+        await asyncio.gather(*(asyncio.to_thread(init_tick_db, p) for p in self.paths))
+        for w in self._writers:
+            w.start()
+        for pool in self._pools:
             try:
-                cur = await self._db.execute("SELECT symbol, ts, price, size FROM ticks ORDER BY id DESC LIMIT ?", (limit,))
-                rows = await cur.fetchall()
-                return [dict(r) for r in rows]
+                await pool.start()
             except Exception:
                 pass
-        # fallback: open temporary read connection
-        conn = await aiosqlite.connect(self.path)
-        conn.row_factory = aiosqlite.Row
-        cur = await conn.execute("SELECT symbol, ts, price, size FROM ticks ORDER BY id DESC LIMIT ?", (limit,))
-        rows = await cur.fetchall()
-        await conn.close()
-        return [dict(r) for r in rows]
+        for m in self.maintenance:
+            m.start()
+
+    async def enqueue_tick(self, tick: Dict[str, Any]):
+        self.enqueue_tick_nowait(tick)
+
+    def enqueue_tick_nowait(self, tick: Dict[str, Any]):
+        try:
+            self._writers[self.shard_of(tick["symbol"])].put(tick)
+        except Exception:
+            pass
+
+    async def close(self):
+        for m in self.maintenance:
+            await m.stop()
+        await asyncio.gather(*(asyncio.to_thread(w.stop) for w in self._writers))
+        for pool in self._pools:
+            await pool.close()
+
+    async def query(self, name: str, params: Tuple = ()) -> List[Dict[str, Any]]:
+        """A named READ_QUERIES entry, routed to one shard or fanned out and merged."""
+        if name in ("recent_symbol", "range"):
+            return await self._pools[self.shard_of(str(params[0]).upper())].query(name, params)
+        parts = await asyncio.gather(*(pool.query(name, params) for pool in self._pools))
+        if name == "recent":
+            rows = [r for part in parts for r in part]
+            rows.sort(key=lambda r: r["ts"], reverse=True)
+            return rows[:params[0]]
+        if name == "count":
+            return [{"n": sum(part[0]["n"] for part in parts if part)}]
+        if name == "symbols":
+            return [{"symbol": s} for s in sorted({r["symbol"] for part in parts for r in part})]
+        return [r for part in parts for r in part]
+
+    async def fetch_recent(self, limit: int = 500, symbol: Optional[str] = None) -> List[Dict[str, Any]]:
+        if symbol:
+            return await self.query("recent_symbol", (symbol.upper(), limit))
+        return await self.query("recent", (limit,))
+
+    async def fetch_range(self, symbol: str, start_ts: str, end_ts: str) -> List[Dict[str, Any]]:
+        return await self.query("range", (symbol.upper(), start_ts, end_ts))
+
+    async def fetch_range_many(self, symbols: List[str], start_ts: str, end_ts: str) -> List[Dict[str, Any]]:
+        """Several symbols' ranges, read from their shards concurrently and merged by ts."""
+        parts = await asyncio.gather(*(self.fetch_range(s, start_ts, end_ts) for s in symbols))
+        return list(heapq.merge(*parts, key=lambda r: r["ts"]))
+
+    async def fetch_many(self, requests: List[Tuple[str, Tuple]]) -> List[List[Dict[str, Any]]]:
+        return list(await asyncio.gather(*(self.query(name, params) for name, params in requests)))
+
+    def query_stats(self) -> Dict[str, Dict[str, float]]:
+        out: Dict[str, Dict[str, float]] = {}
+        for pool in self._pools:
+            for name, s in pool.stats().items():
+                o = out.setdefault(name, {"count": 0, "total_ms": 0.0, "max_ms": 0.0, "last_ms": 0.0})
+                o["count"] += s["count"]
+                o["total_ms"] += s["total_ms"]
+                o["max_ms"] = max(o["max_ms"], s["max_ms"])
+                o["last_ms"] = s["last_ms"]
+        for o in out.values():
+            o["avg_ms"] = o["total_ms"] / o["count"] if o["count"] else 0.0
+        return out
+
+    def writer_stats(self) -> List[Dict[str, Any]]:
+        return [w.stats() for w in self._writers]
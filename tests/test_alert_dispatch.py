@@ -0,0 +1,84 @@
+# test_alert_dispatch.py
+import time
+
+import pytest
+
+from alert_dispatch import AlertDispatcher, WebhookStandIn
+
+
+def wait_for(cond, timeout: float = 10.0) -> bool:
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        if cond():
+            return True
+        time.sleep(0.01)
+    return cond()
+
+
+def event(i: int):
+    return {"rule_id": "r1", "rule_name": "Rule 1", "metric": "zscore", "symbol": "BTCUSDT",
+            "ts": "2026-01-01T00:00:00+00:00", "value": float(i), "side": ">", "threshold": 0.0, "message": str(i)}
+
+
+@pytest.fixture
+def dispatcher(tmp_path):
+    d = AlertDispatcher(str(tmp_path / "alerts.db"))
+    d.start()
+    yield d
+    d.stop()
+
+
+@pytest.fixture
+def stand_in_factory():
+    started = []
+
+    def make(**kw):
+        s = WebhookStandIn(**kw).start()
+        started.append(s)
+        return s
+    yield make
+    for s in started:
+        s.stop()
+
+
+def test_webhook_retries_until_delivered(dispatcher, stand_in_factory):
+    stand_in = stand_in_factory(fail_first=2)
+    name = dispatcher.add_sink({"kind": "webhook", "target": stand_in.url, "rate_per_s": None, "backoff_s": 0.01})
+    dispatcher.submit([event(1)], [name])
+    assert wait_for(lambda: len(stand_in.events) == 1)
+    stats = dispatcher.sinks[name].stats()
+    assert stand_in.requests == 3
+    assert stats["retries"] == 2
+    assert stats["sent"] == 1
+    assert stats["failed"] == 0
+
+
+def test_webhook_gives_up_after_max_retries(dispatcher, stand_in_factory):
+    stand_in = stand_in_factory(fail_first=100)
+    name = dispatcher.add_sink({"kind": "webhook", "target": stand_in.url, "rate_per_s": None,
+                                "backoff_s": 0.01, "max_retries": 1})
+    dispatcher.submit([event(1), event(2)], [name])
+    assert wait_for(lambda: dispatcher.sinks[name].stats()["failed"] == 2)
+    assert stand_in.requests == 2
+    assert stand_in.events == []
+
+
+def test_webhook_rate_limit_spaces_sends(dispatcher, stand_in_factory):
+    stand_in = stand_in_factory()
+    name = dispatcher.add_sink({"kind": "webhook", "target": stand_in.url, "rate_per_s": 20.0,
+                                "burst": 1, "batch_size": 1})
+    t0 = time.monotonic()
+    dispatcher.submit([event(i) for i in range(10)], [name])
+    assert wait_for(lambda: len(stand_in.events) == 10)
+    # one send on the initial token, then nine more at 20/s
+    assert time.monotonic() - t0 >= 0.4
+    assert stand_in.requests == 10
+    assert [e["value"] for e in stand_in.events] == [float(i) for i in range(10)]
+
+
+def test_unselected_sinks_are_closed(dispatcher, tmp_path):
+    old = dispatcher.add_sink({"kind": "file", "target": str(tmp_path / "a.ndjson"), "rate_per_s": 5.0}, owner="s1")
+    dispatcher.select_sinks("s1", [old])
+    new = dispatcher.add_sink({"kind": "file", "target": str(tmp_path / "a.ndjson"), "rate_per_s": 10.0}, owner="s1")
+    dispatcher.select_sinks("s1", [new])
+    assert list(dispatcher.sinks) == [new]